@@ -4,107 +4,544 @@ Handles context, conversation history, and response generation
 """
 
 import os
+import time
+import asyncio
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from typing import List, Dict, Optional
-import openai
-from anthropic import Anthropic
+import logging
+import httpx
 import config
+import runtime_config
+import tracing
 from conversation_tracker import ConversationTracker
+from text_normalizer import normalize_text
+from quick_replies import QuickReplyMatcher, prompt_reference
+from context_builder import ContextBuilder, estimate_tokens
+from llm_router import LLMRouter
+from spend_governor import SpendGovernor
+from providers import AI_PROVIDERS, ai_client_classes
+
+logger = logging.getLogger(__name__)
+
+# Prompt used to fold older turns into the rolling conversation summary
+SUMMARY_PROMPT = (
+    "Aşağıda bir dil ve konuşma terapisi kliniği ile danışan arasındaki "
+    "WhatsApp konuşmasının önceki özeti ve yeni mesajlar var. Danışanın kim "
+    "olduğunu, ihtiyacını, verdiği bilgileri ve kliniğin verdiği sözleri "
+    "koruyarak kısa, güncel bir Türkçe özet yaz. Sadece özeti yaz."
+)
+
+class ResponseCache:
+    """
+    LRU/TTL cache of first-turn AI responses
+    Keyed by normalized message text plus a hash of the system prompt and model,
+    so editing SYSTEM_PROMPT (also by a config reload) invalidates every entry. Persisted in the
+    response_cache table so it survives restarts.
+    """
+
+    def __init__(self, tracker: ConversationTracker, model: str,
+                 max_entries: int = 500, ttl_seconds: int = 604800, settings=None,
+                 prompt_reference: str = ''):
+        self.tracker = tracker
+        self.settings = settings or runtime_config.current
+        self.prompt_reference = prompt_reference
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.model = model
+        self._prompt = None  # (config version, prompt_version)
+        self.entries = OrderedDict()  # cache_key -> (response, created_ts)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def prompt_version(self) -> str:
+        """Hash of model, the current SYSTEM_PROMPT and the prompt reference"""
+        snapshot = self.settings()
+        prompt = self._prompt
+        if prompt is None or prompt[0] != snapshot.version:
+            prompt = (snapshot.version, hashlib.sha256(
+                f"{self.model}\n{snapshot.SYSTEM_PROMPT}\n{self.prompt_reference}".encode('utf-8')
+            ).hexdigest()[:16])
+            self._prompt = prompt
+        return prompt[1]
+
+    def _oldest_valid(self) -> datetime:
+        return datetime.now() - timedelta(seconds=self.ttl_seconds)
+
+    def _load(self):
+        """Warm the in-memory LRU from the database"""
+        rows = self.tracker.get_cached_responses(self.prompt_version, self._oldest_valid(),
+                                                 self.max_entries)
+        # Rows come most recent first; insert oldest first so LRU order matches
+        for row in reversed(rows):
+            created_ts = datetime.fromisoformat(str(row['created_at'])).timestamp()
+            self.entries[row['cache_key']] = (row['response'], created_ts)
+
+    def make_key(self, message_text: str) -> Optional[str]:
+        """Cache key for a message, or None if nothing is left after normalization"""
+        normalized = normalize_text(message_text)
+        if not normalized:
+            return None
+        return hashlib.sha256(f"{self.prompt_version}:{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, message_text: str) -> Optional[str]:
+        """Look up a cached response"""
+        key = self.make_key(message_text)
+        if key is None:
+            return None
+
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry[1] > self.ttl_seconds:
+                del self.entries[key]
+                entry = None
+            if entry:
+                self.entries.move_to_end(key)
+
+        if entry is None:
+            # Another process (webhook vs monitor) may have stored it
+            row = self.tracker.get_cached_response(key, self._oldest_valid())
+            if row:
+                entry = (row['response'], datetime.fromisoformat(str(row['created_at'])).timestamp())
+                with self._lock:
+                    self.entries[key] = entry
+                    self._evict()
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        self.tracker.record_cache_hit(key)
+        return entry[0]
+
+    def put(self, message_text: str, response: str):
+        """Store a response for a message"""
+        key = self.make_key(message_text)
+        if key is None or not response:
+            return
+
+        with self._lock:
+            self.entries[key] = (response, time.time())
+            self.entries.move_to_end(key)
+            self._evict()
+
+        self.tracker.store_cached_response(key, self.prompt_version, normalize_text(message_text),
+                                           response, self.max_entries, self._oldest_valid())
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        """Get hit/miss counters since start"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "prompt_version": self.prompt_version
+            }
+
+
+class LLMClient:
+    """
+    Pooled, timeout-bounded client for one AI provider
+    One instance per provider is shared by every AIResponder in the process
+    (see get_llm_client). Sync calls share one HTTP connection pool; async
+    calls get a pool per event loop. A semaphore caps calls in flight.
+    """
+
+    def __init__(self, provider: str, api_key: str,
+                 connect_timeout: float = config.LLM_CONNECT_TIMEOUT,
+                 read_timeout: float = config.LLM_READ_TIMEOUT,
+                 max_connections: int = config.LLM_MAX_CONNECTIONS,
+                 max_concurrency: int = config.LLM_MAX_CONCURRENCY,
+                 max_retries: int = config.LLM_MAX_RETRIES):
+        if provider not in AI_PROVIDERS:
+            raise ValueError(f"Unsupported AI provider: {provider}")
+        self.provider = provider
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        # Waiting for a free slot counts against the same read budget
+        self.queue_timeout = read_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_state = weakref.WeakKeyDictionary()  # event loop -> (client, semaphore)
+        self._async_lock = threading.Lock()
+        self._client = None
+
+    @property
+    def client(self):
+        """Sync SDK client, built on first use so an unused provider's SDK is never imported"""
+        with self._async_lock:
+            if self._client is None:
+                self._client = self._make_client(httpx.Client(limits=self.limits, timeout=self.timeout))
+            return self._client
+
+    def _make_client(self, http_client):
+        kwargs = dict(api_key=self.api_key, http_client=http_client,
+                      timeout=self.timeout, max_retries=self.max_retries)
+        sync_class, _ = ai_client_classes(self.provider)
+        return sync_class(**kwargs)
+
+    def _make_async_client(self, http_client):
+        kwargs = dict(api_key=self.api_key, http_client=http_client,
+                      timeout=self.timeout, max_retries=self.max_retries)
+        _, async_class = ai_client_classes(self.provider)
+        return async_class(**kwargs)
+
+    def _async_for_loop(self):
+        """Async client and semaphore bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            state = self._async_state.get(loop)
+            if state is None:
+                http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+                state = (self._make_async_client(http_client), asyncio.Semaphore(self.max_concurrency))
+                self._async_state[loop] = state
+        return state
+
+    # ---------- request building / parsing ----------
+
+    def _request(self, model: str, system: str, messages: List[Dict], extra_system: Optional[str],
+                 max_tokens: int, temperature: float, cache_system: bool) -> Dict:
+        if self.provider == 'openai':
+            # The system prompt is always the first message and never changes,
+            # so OpenAI's automatic prefix caching can reuse it across calls.
+            # Per-conversation context goes after it so the prefix stays stable.
+            chat = [{"role": "system", "content": system}]
+            if extra_system:
+                chat.append({"role": "system", "content": extra_system})
+            return dict(model=model, messages=[*chat, *messages],
+                        temperature=temperature, max_tokens=max_tokens)
+
+        # Claude takes the system prompt separately and needs a user turn first
+        claude_messages = [{"role": m['role'], "content": m['content']}
+                           for m in messages if m['role'] != 'system']
+        while claude_messages and claude_messages[0]['role'] != 'user':
+            claude_messages.pop(0)
+
+        if cache_system and config.PROMPT_CACHING_ENABLED:
+            # Cache breakpoint after the static block
+            system_param = [{"type": "text", "text": system,
+                             "cache_control": {"type": "ephemeral"}}]
+            if extra_system:
+                system_param.append({"type": "text", "text": extra_system})
+        else:
+            system_param = f"{system}\n\n{extra_system}" if extra_system else system
 
-class AIResponder:
-    def __init__(self):
-        self.provider = config.AI_PROVIDER
-        self.model = config.AI_MODEL
-        self.tracker = ConversationTracker(config.DATABASE_PATH)
+        return dict(model=model, max_tokens=max_tokens, temperature=temperature,
+                    system=system_param, messages=claude_messages)
 
+    def _parse(self, response) -> tuple[str, Dict]:
+        usage = response.usage
         if self.provider == 'openai':
-            openai.api_key = config.OPENAI_API_KEY
-            self.client = openai.OpenAI()
-        elif self.provider == 'anthropic':
-            self.client = Anthropic(api_key=config.ANTHROPIC_API_KEY)
-        else:
-            raise ValueError(f"Unsupported AI provider: {self.provider}")
+            # prompt_tokens includes the cached prefix
+            details = getattr(usage, 'prompt_tokens_details', None)
+            cached = (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+            return response.choices[0].message.content, {
+                "total_tokens": usage.total_tokens,
+                "input_tokens": usage.prompt_tokens - cached,
+                "cached_input_tokens": cached,
+                "cache_write_tokens": 0,
+                "output_tokens": usage.completion_tokens
+            }
+
+        # input_tokens excludes cache reads and cache writes
+        cached = getattr(usage, 'cache_read_input_tokens', 0) or 0
+        written = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+        return response.content[0].text, {
+            "total_tokens": usage.input_tokens + cached + written + usage.output_tokens,
+            "input_tokens": usage.input_tokens + written,
+            "cached_input_tokens": cached,
+            "cache_write_tokens": written,
+            "output_tokens": usage.output_tokens
+        }
+
+    def _endpoint(self, client):
+        return client.chat.completions if self.provider == 'openai' else client.messages
+
+    # ---------- public API ----------
+
+    def complete(self, model: str, system: str, messages: List[Dict],
+                 extra_system: Optional[str] = None, max_tokens: int = 500,
+                 temperature: float = 0.7, cache_system: bool = True) -> tuple[str, Dict]:
+        """Run one completion; returns (text, usage)"""
+        request = self._request(model, system, messages, extra_system,
+                                max_tokens, temperature, cache_system)
+        if not self._semaphore.acquire(timeout=self.queue_timeout):
+            raise TimeoutError(f"{self.provider}: {self.max_concurrency} calls already in flight")
+        try:
+            response = self._endpoint(self.client).create(**request)
+        finally:
+            self._semaphore.release()
+        return self._parse(response)
+
+    async def acomplete(self, model: str, system: str, messages: List[Dict],
+                        extra_system: Optional[str] = None, max_tokens: int = 500,
+                        temperature: float = 0.7, cache_system: bool = True) -> tuple[str, Dict]:
+        """Async version of complete()"""
+        request = self._request(model, system, messages, extra_system,
+                                max_tokens, temperature, cache_system)
+        client, semaphore = self._async_for_loop()
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{self.provider}: {self.max_concurrency} calls already in flight")
+        try:
+            response = await self._endpoint(client).create(**request)
+        finally:
+            semaphore.release()
+        return self._parse(response)
 
-    def _build_conversation_history(self, phone_number: str) -> List[Dict]:
-        """Build conversation history for context"""
-        history = self.tracker.get_conversation_history(phone_number, limit=10)
 
-        messages = []
-        for msg in history:
-            role = "assistant" if msg['direction'] == 'outgoing' else "user"
-            messages.append({
-                "role": role,
-                "content": msg['message_text']
-            })
+_llm_clients: Dict[str, LLMClient] = {}
+_llm_clients_lock = threading.Lock()
 
-        return messages
 
-    def _generate_response_openai(self, messages: List[Dict]) -> tuple[str, int]:
-        """Generate response using OpenAI"""
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": config.SYSTEM_PROMPT},
-                    *messages
-                ],
-                temperature=0.7,
-                max_tokens=500
-            )
+def get_llm_client(provider: str) -> LLMClient:
+    """Get the process-wide LLMClient for a provider"""
+    with _llm_clients_lock:
+        client = _llm_clients.get(provider)
+        if client is None:
+            api_key = config.OPENAI_API_KEY if provider == 'openai' else config.ANTHROPIC_API_KEY
+            client = _llm_clients[provider] = LLMClient(provider, api_key)
+        return client
 
-            content = response.choices[0].message.content
-            tokens = response.usage.total_tokens
 
-            return content, tokens
+def prompt_cache_minimum(model: str) -> int:
+    """Shortest prompt prefix (tokens) the provider caches for a model"""
+    return 2048 if 'haiku' in model.lower() else 1024
 
-        except Exception as e:
-            print(f"OpenAI API error: {e}")
-            raise
 
-    def _generate_response_anthropic(self, messages: List[Dict]) -> tuple[str, int]:
-        """Generate response using Anthropic Claude"""
-        try:
-            # Convert messages to Claude format
-            claude_messages = []
-            for msg in messages:
-                if msg['role'] != 'system':
-                    claude_messages.append({
-                        "role": msg['role'],
-                        "content": msg['content']
-                    })
-
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=500,
-                system=config.SYSTEM_PROMPT,
-                messages=claude_messages
-            )
+def _span_usage(usage: Dict) -> Dict:
+    """The parts of an LLM usage record worth keeping on its trace span"""
+    return {key: usage.get(key) for key in ('provider', 'model', 'latency_ms', 'input_tokens',
+                                            'output_tokens', 'hedged')}
 
-            content = response.content[0].text
-            tokens = response.usage.input_tokens + response.usage.output_tokens
 
-            return content, tokens
+class AIResponder:
+    def __init__(self, tracker: Optional[ConversationTracker] = None,
+                 client_factory=None, settings=None, router: Optional[LLMRouter] = None):
+        # client_factory(provider) -> LLMClient-like object; defaults to the
+        # shared pooled clients (the replay benchmark passes a stub)
+        # settings() -> config-like object read per request; defaults to the
+        # current runtime config (tenants pass their own)
+        # router: shared between tenants so circuit state is per provider
+        self.settings = settings or runtime_config.current
+        current = self.settings()
+        self.provider = config.AI_PROVIDER
+        self.model = config.AI_MODEL
+        self.tracker = tracker or ConversationTracker(current.DATABASE_PATH)
+        self.quick_replies = QuickReplyMatcher.from_config(current) if config.QUICK_REPLIES_ENABLED else None
+        self.quick_reply_hits = 0
+        # Static, so it stays inside the cached system block
+        self.prompt_reference = prompt_reference(current.PROMPT_REFERENCE_FILE)
+        self.cache = None
+        if config.RESPONSE_CACHE_ENABLED:
+            self.cache = ResponseCache(self.tracker, self.model,
+                                       max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+                                       ttl_seconds=config.RESPONSE_CACHE_TTL,
+                                       settings=self.settings,
+                                       prompt_reference=self.prompt_reference)
+        self.context = ContextBuilder(self.tracker, summarize=self._summarize_turns)
+
+        client_factory = client_factory or get_llm_client
+        self.client_factory = client_factory
+        self.router = router or LLMRouter.from_config(client_factory)
+        self.governor = SpendGovernor(self.tracker, daily_budget=current.DAILY_AI_BUDGET_USD,
+                                      monthly_budget=current.MONTHLY_AI_BUDGET_USD)
+        self.budget_router = None
+        if config.AI_BUDGET_DOWNGRADE_MODEL:
+            self.budget_router = LLMRouter([(self.provider, config.AI_BUDGET_DOWNGRADE_MODEL)],
+                                           client_factory)
+        if config.PROMPT_CACHING_ENABLED:
+            self._check_cacheable()
+
+    def _system_prompt(self) -> str:
+        """The static system block: SYSTEM_PROMPT followed by the prompt reference"""
+        prompt = self.settings().SYSTEM_PROMPT
+        return f"{prompt}\n\n{self.prompt_reference}" if self.prompt_reference else prompt
+
+    def _check_cacheable(self):
+        """Warn when the static prompt is too short for any route's model to cache"""
+        tokens = estimate_tokens(self._system_prompt())
+        routes = self.router.routes + (self.budget_router.routes if self.budget_router else [])
+        for model in sorted({route.model for route in routes}):
+            minimum = prompt_cache_minimum(model)
+            if tokens < minimum:
+                logger.warning(f"System prompt is ~{tokens} tokens, below the {minimum}-token "
+                               f"minimum {model} caches; every call pays for it in full "
+                               f"(extend PROMPT_REFERENCE_FILE or SYSTEM_PROMPT)")
+
+    @property
+    def llm(self):
+        """LLMClient for the primary provider (looked up on use, not at startup)"""
+        return self.client_factory(self.provider)
+
+    @property
+    def client(self):
+        return getattr(self.llm, 'client', None)
+
+    def _build_context(self, phone_number: str, conversation_id: int,
+                       message_id: Optional[int],
+                       router: Optional[LLMRouter] = None) -> tuple[List[Dict], Optional[str]]:
+        """
+        Build token-budgeted history (without the current message) and older-turn summary
+        Summaries go through the same router as the reply and are logged as spend.
+        """
+        def summarize(previous: str, turns: List[Dict], max_tokens: int) -> str:
+            return self._summarize_turns(previous, turns, max_tokens, router=router,
+                                         conversation_id=conversation_id, message_id=message_id)
+        return self.context.build(phone_number, conversation_id, current_message_id=message_id,
+                                  summarize=summarize)
+
+    def _summarize_turns(self, previous: str, turns: List[Dict], max_tokens: int,
+                         router: Optional[LLMRouter] = None,
+                         conversation_id: Optional[int] = None,
+                         message_id: Optional[int] = None) -> str:
+        """Update the rolling summary with turns that left the context window"""
+        transcript = "\n".join(
+            f"{'Klinik' if t['role'] == 'assistant' else 'Danışan'}: {t['content']}" for t in turns
+        )
+        content = f"Önceki özet:\n{previous or '(yok)'}\n\nYeni mesajlar:\n{transcript}"
+        text, usage = (router or self.router).complete(system=SUMMARY_PROMPT,
+                                                       messages=[{"role": "user", "content": content}],
+                                                       max_tokens=max_tokens, temperature=0,
+                                                       cache_system=False)
+        if conversation_id is not None:
+            self._log_usage(conversation_id, message_id or 0, content, text, usage, kind='summary')
+        return text.strip()
+
+    def _log_usage(self, conversation_id: int, message_id: int, prompt: str, response: str,
+                   usage: Dict, was_sent: bool = True, kind: str = 'reply'):
+        """Log one LLM call's usage (and so its cost against the budgets)"""
+        self.tracker.log_ai_response(
+            conversation_id=conversation_id,
+            message_id=message_id,
+            prompt=prompt,
+            response=response,
+            model=usage['model'],
+            tokens_used=usage['total_tokens'],
+            was_sent=was_sent,
+            input_tokens=usage['input_tokens'],
+            cached_input_tokens=usage['cached_input_tokens'],
+            cache_write_tokens=usage['cache_write_tokens'],
+            output_tokens=usage['output_tokens'],
+            provider=usage['provider'],
+            latency_ms=usage['latency_ms'],
+            hedged=usage['hedged'],
+            kind=kind
+        )
+
+    def _summary_text(self, summary: Optional[str]) -> Optional[str]:
+        return f"Önceki konuşmanın özeti:\n{summary}" if summary else None
 
+    def _generate(self, messages: List[Dict], summary: Optional[str] = None,
+                  router: Optional[LLMRouter] = None, on_discarded=None) -> tuple[str, Dict]:
+        """
+        Generate a reply through the router; returns (text, usage)
+        usage also names the provider/model that answered and its latency.
+        on_discarded(text, usage) receives hedged answers that lost the race.
+        """
+        try:
+            return (router or self.router).complete(system=self._system_prompt(),
+                                                    messages=messages,
+                                        extra_system=self._summary_text(summary),
+                                                    on_discarded=on_discarded)
         except Exception as e:
-            print(f"Anthropic API error: {e}")
+            print(f"AI API error: {e}")
             raise
 
-    def generate_response(self, phone_number: str, message_text: str,
-                         conversation_id: int, message_id: int) -> Optional[str]:
-        """Generate AI response for a message"""
+    async def _agenerate(self, messages: List[Dict], summary: Optional[str] = None,
+                         router: Optional[LLMRouter] = None) -> tuple[str, Dict]:
+        """Async version of _generate()"""
+        try:
+            return await (router or self.router).acomplete(system=self._system_prompt(),
+                                                           messages=messages,
+                                               extra_system=self._summary_text(summary))
+        except Exception as e:
+            print(f"AI API error: {e}")
+            raise
+
+    def _prepare(self, phone_number: str, message_text: str,
+                 conversation_id: int, message_id: int) -> Dict:
+        """
+        Everything before the LLM call
+        Returns {"reply": text} when answered without the LLM, otherwise the
+        history, summary and first_turn flag for the request.
+        """
+
+        cfg = self.settings()
 
         # Check if we've exceeded max AI responses for this conversation
         ai_count = self.tracker.get_ai_response_count(conversation_id)
-        if ai_count >= config.MAX_AI_RESPONSES_PER_CONVERSATION:
+        if ai_count >= cfg.MAX_AI_RESPONSES_PER_CONVERSATION:
             escalation_message = (
                 f"Mesajınız için teşekkür ederiz! 🙏\n\n"
-                f"Detaylı bilgi ve yardım için {config.BUSINESS_INFO['therapist']} "
+                f"Detaylı bilgi ve yardım için {cfg.BUSINESS_INFO['therapist']} "
                 f"size çok kısa sürede dönüş yapacaktır.\n\n"
-                f"Acil durumlar için: {config.BUSINESS_INFO['phone']}"
+                f"Acil durumlar için: {cfg.BUSINESS_INFO['phone']}"
             )
-            return escalation_message
-
-        # Build conversation history
-        history = self._build_conversation_history(phone_number)
+            return {"reply": escalation_message}
+
+        # Answer common questions locally when the intent is unambiguous
+        if self.quick_replies:
+            quick_reply = self.quick_replies.match(message_text, cfg.QUICK_REPLY_MIN_CONFIDENCE)
+            if quick_reply:
+                shortcut, reply_text, confidence = quick_reply
+                self.quick_reply_hits += 1
+                self.tracker.log_ai_response(
+                    conversation_id=conversation_id,
+                    message_id=message_id,
+                    prompt=message_text,
+                    response=reply_text,
+                    model='local-quickreply',
+                    tokens_used=0,
+                    was_sent=True
+                )
+                print(f"Quick reply /{shortcut} (confidence {confidence})")
+                return {"reply": reply_text}
+
+        # Budget check: cheaper model, or no AI at all
+        spend_mode = self.governor.mode()
+        if spend_mode == SpendGovernor.LOCAL:
+            return {"reply": self._budget_exhausted_reply(message_text, conversation_id, message_id)}
+        router = self.budget_router if spend_mode == SpendGovernor.DOWNGRADE else self.router
+
+        # Build conversation history (the current message is already stored;
+        # it is left out here and appended once below)
+        history, summary = self._build_context(phone_number, conversation_id, message_id, router)
+
+        # First turn: no earlier messages, so the answer does not depend on
+        # context and can be cached
+        first_turn = ai_count == 0 and not history and not summary
+        if self.cache and first_turn:
+            cached = self.cache.get(message_text)
+            if cached:
+                self.tracker.log_ai_response(
+                    conversation_id=conversation_id,
+                    message_id=message_id,
+                    prompt=message_text,
+                    response=cached,
+                    model='response-cache',
+                    tokens_used=0,
+                    was_sent=True
+                )
+                return {"reply": cached}
 
         # Add current message
         history.append({
@@ -112,61 +549,159 @@ class AIResponder:
             "content": message_text
         })
 
-        try:
-            # Generate response based on provider
-            if self.provider == 'openai':
-                response_text, tokens = self._generate_response_openai(history)
-            elif self.provider == 'anthropic':
-                response_text, tokens = self._generate_response_anthropic(history)
-            else:
-                raise ValueError(f"Unsupported provider: {self.provider}")
-
-            # Log the AI response
-            self.tracker.log_ai_response(
-                conversation_id=conversation_id,
-                message_id=message_id,
-                prompt=message_text,
-                response=response_text,
-                model=self.model,
-                tokens_used=tokens,
-                was_sent=True
-            )
+        return {"history": history, "summary": summary, "first_turn": first_turn, "router": router}
+
+    def _budget_exhausted_reply(self, message_text: str, conversation_id: int,
+                                message_id: int) -> str:
+        """Reply without the LLM once the AI budget is used up"""
+        reply_text = self._fallback_message()
+        model = 'local-fallback'
+        if self.quick_replies:
+            quick_reply = self.quick_replies.match(message_text,
+                                                   config.AI_BUDGET_QUICK_REPLY_CONFIDENCE)
+            if quick_reply:
+                reply_text = quick_reply[1]
+                model = 'local-quickreply'
+                self.quick_reply_hits += 1
+
+        self.tracker.log_ai_response(
+            conversation_id=conversation_id,
+            message_id=message_id,
+            prompt=message_text,
+            response=reply_text,
+            model=model,
+            tokens_used=0,
+            was_sent=True,
+            error="AI budget exhausted"
+        )
+        return reply_text
+
+    def _finish(self, message_text: str, conversation_id: int, message_id: int,
+                first_turn: bool, response_text: str, usage: Dict) -> str:
+        """
+        Log a generated reply and store it in the response cache
+        Only answers of the configured model are cached: the cache is keyed by
+        that model, and a fallback or budget-downgrade answer must not be
+        served later as if it came from it.
+        """
+        self._log_usage(conversation_id, message_id, message_text, response_text, usage)
+
+        if self.cache and first_turn and usage.get('model', self.model) == self.model:
+            self.cache.put(message_text, response_text)
+
+        return response_text
+
+    def _fail(self, message_text: str, conversation_id: int, message_id: int,
+              error: Exception) -> str:
+        """Log a failed generation and return the fallback message"""
+        print(f"Error generating AI response: {error}")
+
+        # Log the error
+        self.tracker.log_ai_response(
+            conversation_id=conversation_id,
+            message_id=message_id,
+            prompt=message_text,
+            response="",
+            model=self.model,
+            was_sent=False,
+            error=str(error)
+        )
 
-            return response_text
+        # Return fallback message
+        return self._fallback_message()
 
-        except Exception as e:
-            print(f"Error generating AI response: {e}")
-
-            # Log the error
-            self.tracker.log_ai_response(
-                conversation_id=conversation_id,
-                message_id=message_id,
-                prompt=message_text,
-                response="",
-                model=self.model,
-                was_sent=False,
-                error=str(e)
-            )
+    def _fallback_message(self) -> str:
+        """Reply used when no AI answer is available; a human follows up"""
+        business_info = self.settings().BUSINESS_INFO
+        return (
+            f"Mesajınızı aldık! 📩\n\n"
+            f"{business_info['therapist']} size en kısa sürede "
+            f"dönüş yapacaktır.\n\n"
+            f"Acil durumlar için: {business_info['phone']}"
+        )
 
-            # Return fallback message
-            fallback = (
-                f"Mesajınızı aldık! 📩\n\n"
-                f"{config.BUSINESS_INFO['therapist']} size en kısa sürede "
-                f"dönüş yapacaktır.\n\n"
-                f"Acil durumlar için: {config.BUSINESS_INFO['phone']}"
-            )
-            return fallback
+    def generate_response(self, phone_number: str, message_text: str,
+                         conversation_id: int, message_id: int) -> Optional[str]:
+        """Generate AI response for a message"""
+        with tracing.span('ai.prepare') as span:
+            prepared = self._prepare(phone_number, message_text, conversation_id, message_id)
+            span.set(answered_locally="reply" in prepared)
+        if "reply" in prepared:
+            return prepared["reply"]
+
+        try:
+            def log_discarded(text: str, usage: Dict):
+                self._log_usage(conversation_id, message_id, message_text, text, usage,
+                                was_sent=False, kind='hedge')
+
+            with tracing.span('ai.llm') as span:
+                response_text, usage = self._generate(prepared["history"], prepared["summary"],
+                                                      prepared["router"], on_discarded=log_discarded)
+                span.set(**_span_usage(usage))
+            return self._finish(message_text, conversation_id, message_id,
+                                prepared["first_turn"], response_text, usage)
+        except Exception as e:
+            return self._fail(message_text, conversation_id, message_id, e)
+
+    async def agenerate_response(self, phone_number: str, message_text: str,
+                                 conversation_id: int, message_id: int) -> Optional[str]:
+        """
+        Async version of generate_response
+        The LLM call runs on the event loop; SQLite work runs in worker threads.
+        """
+        with tracing.span('ai.prepare') as span:
+            prepared = await asyncio.to_thread(self._prepare, phone_number, message_text,
+                                               conversation_id, message_id)
+            span.set(answered_locally="reply" in prepared)
+        if "reply" in prepared:
+            return prepared["reply"]
 
-    def generate_outside_hours_response(self, message_text: str) -> str:
+        try:
+            with tracing.span('ai.llm') as span:
+                response_text, usage = await self._agenerate(prepared["history"], prepared["summary"],
+                                                             prepared["router"])
+                span.set(**_span_usage(usage))
+            return await asyncio.to_thread(self._finish, message_text, conversation_id, message_id,
+                                           prepared["first_turn"], response_text, usage)
+        except Exception as e:
+            return await asyncio.to_thread(self._fail, message_text, conversation_id, message_id, e)
+
+    def get_cache_stats(self) -> Optional[Dict]:
+        """Get response cache hit rate, or None if the cache is disabled"""
+        return self.cache.stats() if self.cache else None
+
+    def get_budget_stats(self) -> Dict:
+        """Get spend against budgets and the current generation mode"""
+        return self.governor.status()
+
+    def get_route_stats(self) -> Dict:
+        """Get latency, error rate and circuit state per provider:model"""
+        return self.router.stats()
+
+    def get_quick_reply_stats(self) -> Optional[Dict]:
+        """Get quick reply usage, or None if quick replies are disabled"""
+        if not self.quick_replies:
+            return None
+        return {
+            "intents": len(self.quick_replies.replies),
+            "hits": self.quick_reply_hits,
+            "min_confidence": self.settings().QUICK_REPLY_MIN_CONFIDENCE
+        }
+
+    def generate_outside_hours_response(self, message_text: str,
+                                        reopens_at: Optional[str] = None) -> str:
         """Generate automatic response for outside business hours"""
+        business_info = self.settings().BUSINESS_INFO
+        reopening = f"{reopens_at} itibarıyla tekrar hizmetinizdeyiz.\n\n" if reopens_at else ""
         return (
             f"Merhaba! 👋\n\n"
             f"Mesajınız için teşekkür ederiz. Şu anda mesai saatleri dışındayız.\n\n"
-            f"📅 Çalışma Saatlerimiz:\n{config.BUSINESS_INFO['working_hours']}\n\n"
+            f"📅 Çalışma Saatlerimiz:\n{business_info['working_hours']}\n\n"
+            f"{reopening}"
             f"Mesajınızı aldık ve çalışma saatlerimiz içinde size dönüş yapacağız.\n\n"
-            f"Acil durumlar için: {config.BUSINESS_INFO['phone']}\n\n"
+            f"Acil durumlar için: {business_info['phone']}\n\n"
             f"İyi günler dileriz! 🌟\n\n"
-            f"{config.BUSINESS_INFO['name']}"
+            f"{business_info['name']}"
         )
 
     def generate_emergency_response(self) -> str:
@@ -174,7 +709,7 @@ class AIResponder:
         return (
             f"⚠️ Acil durumunuz için üzgünüz.\n\n"
             f"Lütfen hemen şu numaradan arayın:\n"
-            f"📞 {config.BUSINESS_INFO['phone']}\n\n"
+            f"📞 {self.settings().BUSINESS_INFO['phone']}\n\n"
             f"Veya acil sağlık hizmetleri için 112'yi arayabilirsiniz."
         )
 
@@ -196,11 +731,14 @@ def test_ai_responder():
     for msg in test_messages:
         print(f"\n📩 Input: {msg}")
         try:
-            response = responder._generate_response_openai([
+            response = responder._generate([
                 {"role": "user", "content": msg}
             ])
             print(f"🤖 Response: {response[0]}")
-            print(f"📊 Tokens: {response[1]}")
+            print(f"📊 Tokens: {response[1]['total_tokens']} "
+                  f"(cached input: {response[1]['cached_input_tokens']}) "
+                  f"via {response[1]['provider']}:{response[1]['model']} "
+                  f"in {response[1]['latency_ms']}ms")
         except Exception as e:
             print(f"❌ Error: {e}")
 
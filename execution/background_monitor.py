@@ -3,13 +3,22 @@ Background Monitor - Continuously checks for pending AI responses
 Sends automated responses when delay period has elapsed
 """
 
+import os
+import json
 import time
+import heapq
 import logging
+import threading
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import config
-from conversation_tracker import ConversationTracker
-from ai_responder import AIResponder
-from whatsapp_sender import WhatsAppSender
+import runtime_config
+from metrics import MetricsRegistry, Timer
+from profiling import monitor_profiler
+import tracing
+from whatsapp_sender import PRIORITY_AI
+from tenants import Tenant, TenantRegistry
+from conversation_tracker import is_auto_reply
 
 # Set up logging
 logging.basicConfig(
@@ -23,26 +32,47 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class BackgroundMonitor:
-    def __init__(self):
-        self.tracker = ConversationTracker(config.DATABASE_PATH)
-        self.ai_responder = AIResponder()
-        self.whatsapp_sender = WhatsAppSender()
+    def __init__(self, tenants: TenantRegistry = None):
+        # Tenants (and their components) are shared with the webhook server in
+        # embedded mode; one loop schedules responses for every tenant
+        self.tenants = tenants or TenantRegistry.from_config()
+        # Standalone: this process sends every tenant's outbox; the web
+        # workers only enqueue and wake it
+        self.owns_tenants = tenants is None
         self.running = False
+        self.thread = None
+        self._wakeup = threading.Event()
+        self._due_times = []
+        self._due_lock = threading.Lock()
+        self.metrics = MetricsRegistry()
+        self.started_at = None
+        self.last_heartbeat = None
+        self.status_server = None
 
-    def start(self, check_interval=30):
+    def start(self, check_interval=None):
         """
         Start monitoring for pending responses
-        check_interval: How often to check (in seconds)
+        check_interval: How often to check (in seconds); default
+        MONITOR_CHECK_INTERVAL from the current config, re-read every cycle
         """
         self.running = True
+        self.started_at = time.time()
         logger.info("🚀 Background monitor started")
-        logger.info(f"Check interval: {check_interval}s")
-        logger.info(f"Response delay: {config.RESPONSE_DELAY}s")
+        logger.info(f"Check interval: {check_interval or runtime_config.current().MONITOR_CHECK_INTERVAL}s")
+        logger.info(f"Response delay: {runtime_config.current().RESPONSE_DELAY}s")
+
+        self.start_status_server()
+        if self.owns_tenants:
+            self.tenants.start()
 
         try:
             while self.running:
-                self.process_pending_responses()
-                time.sleep(check_interval)
+                with monitor_profiler.session('cycle'), Timer() as cycle:
+                    self.process_pending_responses()
+                self.metrics.observe('cycle_seconds', cycle.elapsed)
+                self.heartbeat()
+                self._wait_for_next_cycle(check_interval or
+                                          runtime_config.current().MONITOR_CHECK_INTERVAL)
 
         except KeyboardInterrupt:
             logger.info("Monitor stopped by user")
@@ -51,31 +81,144 @@ class BackgroundMonitor:
             logger.error(f"Monitor error: {e}", exc_info=True)
             self.stop()
 
+    def start_in_background(self, check_interval=None):
+        """Run the monitor loop in a daemon thread (embedded mode)"""
+        self.thread = threading.Thread(target=self.start, args=(check_interval,),
+                                       name='background-monitor', daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def notify_scheduled(self, due_timestamp: float):
+        """
+        Hand a newly scheduled response to the running loop
+        The loop wakes at that time instead of waiting for the next poll;
+        the pending_responses row stays the durable record.
+        """
+        with self._due_lock:
+            heapq.heappush(self._due_times, due_timestamp)
+        self._wakeup.set()
+
+    def _wait_for_next_cycle(self, check_interval):
+        """Sleep until the next poll or the earliest in-memory due time"""
+        deadline = time.time() + check_interval
+        while self.running:
+            # Clear first so a notify arriving while we compute still wakes us
+            self._wakeup.clear()
+            now = time.time()
+            with self._due_lock:
+                if self._due_times and self._due_times[0] <= now:
+                    # This cycle's DB query picks up everything already due
+                    while self._due_times and self._due_times[0] <= now:
+                        heapq.heappop(self._due_times)
+                    return
+                next_due = self._due_times[0] if self._due_times else deadline
+            timeout = min(deadline, next_due) - now
+            if timeout <= 0:
+                return
+            self._wakeup.wait(timeout)
+
     def stop(self):
         """Stop the monitor"""
         self.running = False
+        self._wakeup.set()
+        if self.status_server:
+            self.status_server.shutdown()
+            self.status_server = None
+        if self.owns_tenants:
+            self.tenants.stop()
         logger.info("Background monitor stopped")
 
-    def process_pending_responses(self):
-        """Check for and process pending responses"""
+    def heartbeat(self):
+        """Record that a cycle completed and refresh the status file"""
+        self.last_heartbeat = time.time()
+        status_file = runtime_config.current().MONITOR_STATUS_FILE
+        if status_file:
+            try:
+                self.write_status_file(status_file)
+            except Exception as e:
+                logger.error(f"Error writing status file: {e}")
+
+    def write_status_file(self, path: str):
+        """Atomically write the health snapshot as JSON"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.get_health(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_status_server(self):
+        """Serve GET /status (health) and /stats on a local port from a daemon thread"""
+        if not config.MONITOR_STATUS_PORT:
+            return
+
+        monitor = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.rstrip('/')
+                if path in ('/status', '/health', ''):
+                    payload = monitor.get_health()
+                    code = 200 if payload['healthy'] else 503
+                elif path == '/stats':
+                    payload = monitor.get_status()
+                    code = 200
+                else:
+                    self.send_error(404)
+                    return
+                body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Status request: " + format % args)
+
         try:
-            # Get all pending responses that are due
-            pending = self.tracker.get_pending_responses()
+            self.status_server = ThreadingHTTPServer(
+                (config.MONITOR_STATUS_HOST, config.MONITOR_STATUS_PORT), StatusHandler
+            )
+        except OSError as e:
+            logger.error(f"Could not start status server: {e}")
+            return
 
-            if not pending:
-                logger.debug("No pending responses")
-                return
+        thread = threading.Thread(target=self.status_server.serve_forever,
+                                  name='monitor-status', daemon=True)
+        thread.start()
+        logger.info(f"Status endpoint: http://{config.MONITOR_STATUS_HOST}:"
+                    f"{config.MONITOR_STATUS_PORT}/status")
 
-            logger.info(f"Found {len(pending)} pending response(s)")
+    def process_pending_responses(self):
+        """Check for and process pending responses of every tenant"""
+        for tenant in self.tenants:
+            try:
+                # Get all pending responses that are due
+                pending = tenant.tracker.get_pending_responses()
 
-            for item in pending:
-                self.handle_pending_response(item)
+                if not pending:
+                    logger.debug(f"[{tenant.id}] No pending responses")
+                    continue
 
-        except Exception as e:
-            logger.error(f"Error processing pending responses: {e}", exc_info=True)
+                logger.info(f"[{tenant.id}] Found {len(pending)} pending response(s)")
+
+                for item in pending:
+                    self.handle_pending_response(item, tenant)
 
-    def handle_pending_response(self, pending_item: dict):
-        """Handle a single pending response"""
+            except Exception as e:
+                logger.error(f"[{tenant.id}] Error processing pending responses: {e}", exc_info=True)
+
+    def _outcome(self, tenant: Tenant, outcome: str):
+        self.metrics.increment(f'outcome.{outcome}')
+        tenant.metrics.increment(f'ai_responses.{outcome}')
+        tracing.set_attributes(outcome=outcome)
+
+    def handle_pending_response(self, pending_item: dict, tenant: Tenant = None):
+        """Handle a single pending response (of the default tenant unless given)"""
+        tenant = tenant or self.tenants.default
+        tracker = tenant.tracker
         try:
             pending_id = pending_item['id']
             message_id = pending_item['message_id']
@@ -83,70 +226,130 @@ class BackgroundMonitor:
             phone_number = pending_item['phone_number']
             message_text = pending_item['message_text']
 
-            logger.info(f"Processing pending response {pending_id} for {phone_number}")
+            trace_id = pending_item.get('trace_id')
+            logger.info(f"[{tenant.id}] Processing pending response {pending_id} for {phone_number}"
+                        f"{f' (trace {trace_id})' if trace_id else ''}")
 
-            # Check if human has already responded
-            # Get the last message from this conversation
-            history = self.tracker.get_conversation_history(phone_number, limit=5)
+            # How late we are compared to the scheduled time
+            scheduled_for = datetime.fromisoformat(str(pending_item['scheduled_for']))
+            lag = (datetime.now() - scheduled_for).total_seconds()
+            self.metrics.observe('dispatch_lag_seconds', lag)
+            received_at = datetime.fromisoformat(str(pending_item['received_at']))
+            tracing.record('response.delay', trace_id, received_at.timestamp(), time.time(),
+                           scheduled_for=scheduled_for.isoformat(), lag_seconds=round(lag, 3))
 
-            # Check if there's any outgoing message after this incoming message
-            incoming_time = pending_item['received_at']
-            for msg in history:
-                if msg['direction'] == 'outgoing' and msg['received_at'] > incoming_time:
-                    # Human already responded, cancel AI response
-                    logger.info(f"Human already responded, cancelling AI response {pending_id}")
-                    self.tracker.mark_pending_as_processed(pending_id, status='cancelled')
-                    return
+            with tracing.span('monitor.respond', trace_id, tenant=tenant.id, pending_id=pending_id):
+                # Check if human has already responded
+                # Get the last message from this conversation
+                history = tracker.get_conversation_history(phone_number, limit=5)
 
-            # Generate AI response
-            logger.info(f"Generating AI response for message: {message_text[:50]}...")
-            response_text = self.ai_responder.generate_response(
-                phone_number=phone_number,
-                message_text=message_text,
-                conversation_id=conversation_id,
-                message_id=message_id
-            )
+                # Check if there's any outgoing message after this incoming message
+                incoming_time = pending_item['received_at']
+                for msg in history:
+                    if (msg['direction'] == 'outgoing' and msg['received_at'] > incoming_time
+                            and not is_auto_reply(msg)):
+                        # Human already responded, cancel AI response
+                        logger.info(f"Human already responded, cancelling AI response {pending_id}")
+                        tracker.mark_pending_as_processed(pending_id, status='cancelled')
+                        self._outcome(tenant, 'cancelled')
+                        return
 
-            if not response_text:
-                logger.error(f"Failed to generate response for pending {pending_id}")
-                self.tracker.mark_pending_as_processed(pending_id, status='failed')
-                return
+                # Generate AI response
+                logger.info(f"Generating AI response for message: {message_text[:50]}...")
+                with tracing.span('ai.generate'), Timer() as llm_timer:
+                    response_text = tenant.ai_responder.generate_response(
+                        phone_number=phone_number,
+                        message_text=message_text,
+                        conversation_id=conversation_id,
+                        message_id=message_id
+                    )
+                self.metrics.observe('llm_latency_seconds', llm_timer.elapsed)
+
+                if not response_text:
+                    logger.error(f"Failed to generate response for pending {pending_id}")
+                    tracker.mark_pending_as_processed(pending_id, status='failed')
+                    self._outcome(tenant, 'failed')
+                    return
 
-            # Send the response
-            logger.info(f"Sending AI response to {phone_number}")
-            sent_message_id = self.whatsapp_sender.send_message(phone_number, response_text)
-
-            if sent_message_id:
-                # Log as sent successfully
-                self.tracker.add_outgoing_message(
-                    phone_number=phone_number,
-                    message_text=response_text,
-                    is_ai=True,
-                    message_id=sent_message_id
-                )
-                self.tracker.mark_pending_as_processed(pending_id, status='sent')
-                logger.info(f"✅ AI response sent successfully: {sent_message_id}")
-            else:
-                logger.error(f"Failed to send AI response for pending {pending_id}")
-                self.tracker.mark_pending_as_processed(pending_id, status='failed')
+                # Queue the response; the pending row is only claimed if still pending
+                with tracing.span('outbox.enqueue'):
+                    outbox_id = tracker.enqueue_outgoing_message(
+                        phone_number, response_text, PRIORITY_AI, is_ai=True,
+                        idempotency_key=f"pending:{pending_id}", pending_id=pending_id,
+                        trace_id=trace_id
+                    )
+                if outbox_id is None:
+                    logger.info(f"Pending response {pending_id} was handled meanwhile, not sending")
+                    self._outcome(tenant, 'cancelled')
+                    return
+                tenant.notify_outbox()
+                self._outcome(tenant, 'queued')
+                logger.info(f"✅ AI response queued for {phone_number} (outbox {outbox_id})")
 
         except Exception as e:
             logger.error(f"Error handling pending response: {e}", exc_info=True)
+            self._outcome(tenant, 'error')
             try:
-                self.tracker.mark_pending_as_processed(pending_id, status='error')
+                tracker.mark_pending_as_processed(pending_id, status='error')
             except:
                 pass
 
     def get_status(self):
-        """Get monitor status"""
-        stats = self.tracker.get_statistics()
+        """Get monitor status (per tenant under "tenants" when there are several)"""
+        if self.tenants.multi_tenant:
+            stats = {"tenants": self.tenants.stats()}
+        else:
+            stats = self.tenants.default.stats()
         return {
             "running": self.running,
             "timestamp": datetime.now().isoformat(),
-            "is_business_hours": config.is_business_hours(),
+            "config": runtime_config.stats(),
+            "ai_routes": self.tenants.route_stats(),
+            "profiling": monitor_profiler.stats(),
             **stats
         }
 
+    def get_health(self):
+        """
+        Get loop health and dispatch metrics
+        Unhealthy when the heartbeat is stale or p95 dispatch lag over the last
+        MONITOR_LAG_WINDOW_SECONDS is over the threshold, so one old backlog
+        does not keep a quiet clinic unhealthy until 1000 newer samples arrive
+        """
+        cfg = runtime_config.current()
+        now = time.time()
+        heartbeat_age = now - self.last_heartbeat if self.last_heartbeat else None
+        lag = self.metrics.summary('dispatch_lag_seconds', max_age=cfg.MONITOR_LAG_WINDOW_SECONDS)
+        p95_lag = lag['p95'] if lag else 0.0
+
+        problems = []
+        if not self.running:
+            problems.append("monitor not running")
+        if heartbeat_age is None:
+            if self.started_at and now - self.started_at > cfg.MONITOR_HEARTBEAT_TIMEOUT:
+                problems.append("no cycle completed since start")
+        elif heartbeat_age > cfg.MONITOR_HEARTBEAT_TIMEOUT:
+            problems.append(f"heartbeat stale for {heartbeat_age:.0f}s")
+        if p95_lag > cfg.MONITOR_LAG_ALERT_SECONDS:
+            problems.append(f"p95 dispatch lag {p95_lag:.1f}s over "
+                            f"{cfg.MONITOR_LAG_ALERT_SECONDS:.0f}s in the last "
+                            f"{cfg.MONITOR_LAG_WINDOW_SECONDS:.0f}s")
+
+        return {
+            "healthy": not problems,
+            "problems": problems,
+            "running": self.running,
+            "timestamp": datetime.now().isoformat(),
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            "last_heartbeat": datetime.fromtimestamp(self.last_heartbeat).isoformat() if self.last_heartbeat else None,
+            "heartbeat_age_seconds": round(heartbeat_age, 3) if heartbeat_age is not None else None,
+            "lag_alert_seconds": cfg.MONITOR_LAG_ALERT_SECONDS,
+            "lag_window_seconds": cfg.MONITOR_LAG_WINDOW_SECONDS,
+            "recent_lag_p95_seconds": p95_lag,
+            "config_version": cfg.version,
+            **self.metrics.snapshot()
+        }
+
 
 def main():
     """Main function to run the monitor"""
@@ -165,15 +368,23 @@ def main():
         logger.error(f"❌ Configuration error:\n{e}")
         return
 
+    # Start monitor; SIGHUP or a changed .env reloads the config
+    tracing.service = 'monitor'
+    monitor = BackgroundMonitor()
+    try:
+        monitor.tenants.validate()
+    except ValueError as e:
+        logger.error(f"❌ Tenant configuration error:\n{e}")
+        return
+    logger.info(f"Tenants: {', '.join(tenant.id for tenant in monitor.tenants)}")
+
     # Create logs directory
-    import os
     os.makedirs('logs', exist_ok=True)
 
-    # Start monitor
-    monitor = BackgroundMonitor()
+    runtime_config.start_watching()
 
     try:
-        monitor.start(check_interval=30)  # Check every 30 seconds
+        monitor.start()
     except KeyboardInterrupt:
         logger.info("\nShutting down gracefully...")
         monitor.stop()
@@ -0,0 +1,240 @@
+"""
+Broadcast - Send a template message to many recipients
+Per-recipient progress is stored in broadcast_jobs, so an interrupted job
+resumes where it stopped. The job sends from this process, beside the live
+outbox dispatcher and not through it, so it is paced separately at
+BROADCAST_RATE_PER_SECOND; keep that well below WHATSAPP_RATE_PER_SECOND.
+
+Usage:
+    python execution/broadcast.py create --job reminders-0601 --template appointment_reminder --csv patients.csv
+    python execution/broadcast.py create --job reminders-0601 --template appointment_reminder --from-conversations --active-days 90
+    python execution/broadcast.py run --job reminders-0601 [--retry-failed] [--resend-interrupted]
+    python execution/broadcast.py status [--job reminders-0601]
+"""
+
+import re
+import csv
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import config
+from conversation_tracker import ConversationTracker
+from whatsapp_sender import WhatsAppSender
+from delivery_status import StatusRecorder
+
+# CSV columns that hold the phone number (otherwise the first column is used)
+PHONE_COLUMNS = ('phone_number', 'phone', 'telefon', 'numara')
+
+# Shorter than any full international number
+MIN_PHONE_DIGITS = 10
+
+
+def normalize_phone(raw: str, country_code: str = config.DEFAULT_COUNTRY_CODE) -> Optional[str]:
+    """
+    '+90 (555) 111-22-33' or '0555 111 22 33' -> '+905551112233'
+    A single leading 0 is a local number in country_code. None if the
+    result cannot be a full number.
+    """
+    raw = raw.strip().replace('whatsapp:', '')
+    digits = re.sub(r'\D', '', raw)
+    if raw.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith('0') and not raw.startswith('+'):
+        digits = country_code + digits[1:]
+    if len(digits) < MIN_PHONE_DIGITS or digits.startswith('0'):
+        return None
+    return f'+{digits}'
+
+
+def _unique(phones) -> List[str]:
+    seen = set()
+    result = []
+    for phone in phones:
+        if phone and phone not in seen:
+            seen.add(phone)
+            result.append(phone)
+    return result
+
+
+def load_recipients_csv(path: str) -> Tuple[List[str], int]:
+    """
+    Read phone numbers from a CSV file (with or without a header row)
+    Returns (phones, skipped): rows without a usable number are skipped.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.reader(f))
+    if not rows:
+        return [], 0
+
+    header = [cell.strip().lower() for cell in rows[0]]
+    column = next((header.index(name) for name in PHONE_COLUMNS if name in header), None)
+    if column is not None:
+        rows = rows[1:]
+    else:
+        column = 0
+
+    phones = [normalize_phone(row[column]) if len(row) > column else None for row in rows]
+    skipped = sum(1 for phone in phones if phone is None)
+    return _unique(phones), skipped
+
+
+def recipients_from_conversations(tracker: ConversationTracker, status: Optional[str] = None,
+                                  active_days: Optional[int] = None) -> List[str]:
+    """Phone numbers of past conversations, optionally only recently active ones"""
+    active_since = datetime.now() - timedelta(days=active_days) if active_days else None
+    return _unique(tracker.get_conversation_phones(status=status, active_since=active_since))
+
+
+class BroadcastRunner:
+    """
+    Sends the pending recipients of a job in batches
+    Each batch is claimed ('sending') before it is queued and its results are
+    written in one transaction, so a crash can only leave the current batch
+    in 'sending'. Those are reported as interrupted and only resent on request.
+    """
+
+    def __init__(self, tracker: ConversationTracker, sender: WhatsAppSender,
+                 batch_size: int = config.BROADCAST_BATCH_SIZE,
+                 rate_per_second: float = config.BROADCAST_RATE_PER_SECOND):
+        if sender.provider != 'meta':
+            raise ValueError("Template broadcasts are only supported for the Meta provider")
+        self.tracker = tracker
+        self.sender = sender
+        self.batch_size = batch_size
+        # Live replies share the provider limit from another process
+        sender.outbound.set_rate(rate_per_second, burst=max(int(rate_per_second), 1))
+
+    def run(self, job_id: str, retry_failed: bool = False,
+            resend_interrupted: bool = False) -> Dict:
+        """Send all pending recipients; returns counts and throughput"""
+        requeue = (['failed'] if retry_failed else []) + (['sending'] if resend_interrupted else [])
+        if requeue:
+            count = self.tracker.requeue_broadcast_recipients(job_id, requeue)
+            print(f"Requeued {count} recipient(s) ({', '.join(requeue)})")
+
+        sent = failed = 0
+        started = time.perf_counter()
+        while True:
+            rows = self.tracker.claim_broadcast_recipients(job_id, self.batch_size)
+            if not rows:
+                break
+            batch_sent, batch_failed = self._send_batch(job_id, rows)
+            sent += batch_sent
+            failed += batch_failed
+            elapsed = time.perf_counter() - started
+            print(f"📤 {job_id}: {sent} sent, {failed} failed "
+                  f"({(sent + failed) / elapsed:.1f} msg/s)")
+
+        elapsed = time.perf_counter() - started
+        return {
+            "job_id": job_id,
+            "sent": sent,
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 2),
+            "messages_per_second": round((sent + failed) / elapsed, 2) if elapsed else 0.0,
+            "progress": self.tracker.get_broadcast_progress(job_id).get(job_id)
+        }
+
+    def _send_batch(self, job_id: str, rows: List[Dict]) -> tuple:
+        first = rows[0]
+        items = self.sender.outbound.submit_templates(
+            [row['phone_number'] for row in rows], first['template_name'],
+            language_code=first['language_code'], components=first['components'])
+        try:
+            for item in items:
+                item.wait()
+        finally:
+            # Read results from the items themselves: wait() returns before
+            # send callbacks have run. On interrupt, messages that never left
+            # the queue go back to pending; ones mid-send stay 'sending'.
+            batch = []
+            for item in items:
+                if self.sender.outbound.cancel(item) or item.status == 'cancelled':
+                    batch.append((item.to_number, 'pending', None, None))
+                elif item.status in ('sent', 'failed'):
+                    error = None if item.status == 'sent' else 'send failed'
+                    batch.append((item.to_number, item.status, item.message_id, error))
+            self.tracker.update_broadcast_results(job_id, batch)
+
+        sent = sum(1 for r in batch if r[1] == 'sent')
+        failed = sum(1 for r in batch if r[1] == 'failed')
+        return sent, failed
+
+
+def print_progress(jobs: Dict[str, Dict]):
+    if not jobs:
+        print("No broadcast jobs")
+        return
+    for job_id, info in jobs.items():
+        statuses = info['statuses']
+        print(f"{job_id}  template={info['template']}  total={info['total']}  "
+              f"sent={statuses.get('sent', 0)}  failed={statuses.get('failed', 0)}  "
+              f"pending={statuses.get('pending', 0)}  interrupted={statuses.get('sending', 0)}  "
+              f"updated={info['updated_at']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk WhatsApp template broadcasts")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    create = commands.add_parser('create', help="Create a job (or add recipients to one)")
+    create.add_argument('--job', required=True)
+    create.add_argument('--template', required=True, help="Approved template name")
+    create.add_argument('--language', default='tr')
+    create.add_argument('--components', help="Template components as a JSON list")
+    source = create.add_mutually_exclusive_group(required=True)
+    source.add_argument('--csv', help="CSV file with phone numbers")
+    source.add_argument('--from-conversations', action='store_true',
+                        help="Everyone in the conversations table")
+    create.add_argument('--status', help="With --from-conversations: only this conversation status")
+    create.add_argument('--active-days', type=int,
+                        help="With --from-conversations: only conversations active in the last N days")
+
+    run = commands.add_parser('run', help="Send the pending recipients of a job")
+    run.add_argument('--job', required=True)
+    run.add_argument('--retry-failed', action='store_true', help="Send failed recipients again")
+    run.add_argument('--resend-interrupted', action='store_true',
+                     help="Send recipients left in 'sending' by a crash again (may duplicate)")
+    run.add_argument('--batch-size', type=int, default=config.BROADCAST_BATCH_SIZE)
+    run.add_argument('--rate', type=float, default=config.BROADCAST_RATE_PER_SECOND,
+                     help="Messages per second (live replies need the rest of the provider limit)")
+
+    status = commands.add_parser('status', help="Show job progress")
+    status.add_argument('--job')
+
+    args = parser.parse_args()
+    tracker = ConversationTracker(config.DATABASE_PATH)
+
+    if args.command == 'create':
+        if args.csv:
+            phones, skipped = load_recipients_csv(args.csv)
+            if skipped:
+                print(f"⚠️  Skipped {skipped} row(s) without a valid phone number")
+        else:
+            phones = recipients_from_conversations(tracker, args.status, args.active_days)
+        components = json.loads(args.components) if args.components else None
+        added = tracker.create_broadcast_job(args.job, phones, args.template, args.language, components)
+        print(f"✅ Job {args.job}: {added} recipient(s) added ({len(phones) - added} already in the job)")
+
+    elif args.command == 'run':
+        sender = WhatsAppSender()
+        recorder = StatusRecorder(tracker)
+        sender.outbound.add_listener(recorder.record_sent_item)
+        try:
+            result = BroadcastRunner(tracker, sender, batch_size=args.batch_size, rate_per_second=args.rate).run(
+                args.job, retry_failed=args.retry_failed, resend_interrupted=args.resend_interrupted)
+            print(json.dumps(result, indent=2, ensure_ascii=False))
+        except KeyboardInterrupt:
+            print("\n⏸️  Interrupted - run the same command again to resume")
+        finally:
+            sender.close()
+            recorder.stop()
+
+    else:
+        print_progress(tracker.get_broadcast_progress(args.job))
+
+
+if __name__ == '__main__':
+    main()
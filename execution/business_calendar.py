@@ -0,0 +1,219 @@
+"""
+Business Calendar - Opening hours with holidays and special days
+Precomputes the open intervals of the coming weeks so is_open() and
+next_opening() are a bisect over sorted timestamps.
+"""
+
+import os
+import re
+import threading
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import pytz
+import config
+import runtime_config
+
+TURKISH_DAYS = ['Pazartesi', 'Salı', 'Çarşamba', 'Perşembe', 'Cuma', 'Cumartesi', 'Pazar']
+
+# "2026-10-29" (closed) or "2026-12-31 09:00-13:00" (special hours), optional "# name"
+_EXCEPTION_RE = re.compile(
+    r'^(?P<day>\d{4}-\d{2}-\d{2})(?:\s+(?P<start>\d{1,2}:\d{2})\s*-\s*(?P<end>\d{1,2}:\d{2}))?$')
+
+# How far next_opening() looks ahead before giving up
+MAX_LOOKAHEAD_DAYS = 366
+
+Hours = Optional[Tuple[time, time]]
+
+
+def load_holidays(path: str) -> Dict[date, Hours]:
+    """
+    Read closed days and special hours from a file
+    Returns {date: None} for closed days and {date: (start, end)} for special hours.
+    """
+    exceptions: Dict[date, Hours] = {}
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            match = _EXCEPTION_RE.match(line)
+            if not match:
+                raise ValueError(f"{path}:{number}: expected 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM-HH:MM'")
+            day = date.fromisoformat(match.group('day'))
+            if match.group('start'):
+                start = time.fromisoformat(match.group('start').zfill(5))
+                end = time.fromisoformat(match.group('end').zfill(5))
+                if end <= start:
+                    raise ValueError(f"{path}:{number}: closing time must be after opening time")
+                exceptions[day] = (start, end)
+            else:
+                exceptions[day] = None
+    return exceptions
+
+
+class BusinessCalendar:
+    """
+    Open intervals in the business timezone
+    Regular hours apply on BUSINESS_DAYS; a holiday entry closes the day or
+    replaces its hours (which can also open a day that is normally closed).
+    Naive datetimes are taken as business-timezone local time. The closing
+    minute itself still counts as open.
+    """
+
+    def __init__(self, timezone: str = config.BUSINESS_TIMEZONE,
+                 days: Iterable[int] = config.BUSINESS_DAYS,
+                 hours: Tuple[time, time] = (config.BUSINESS_HOURS_START, config.BUSINESS_HOURS_END),
+                 exceptions: Optional[Dict[date, Hours]] = None,
+                 horizon_days: int = config.BUSINESS_CALENDAR_DAYS):
+        self.tz = pytz.timezone(timezone)
+        self.days = set(days)
+        self.hours = hours
+        self.exceptions = exceptions or {}
+        self.horizon_days = max(horizon_days, 1)
+        self.rebuilds = 0
+        self._lock = threading.Lock()
+        # (first day, last day + 1, start timestamps, end timestamps), swapped as one
+        self._window: Tuple[date, date, List[float], List[float]] = (date.max, date.min, [], [])
+
+    @classmethod
+    def from_config(cls, settings=None) -> 'BusinessCalendar':
+        """Regular hours from the current config (or `settings`) plus HOLIDAYS_FILE (if it exists)"""
+        cfg = settings or runtime_config.current()
+        exceptions = {}
+        if cfg.HOLIDAYS_FILE and os.path.exists(cfg.HOLIDAYS_FILE):
+            exceptions = load_holidays(cfg.HOLIDAYS_FILE)
+        return cls(timezone=cfg.BUSINESS_TIMEZONE, days=cfg.BUSINESS_DAYS,
+                   hours=(cfg.BUSINESS_HOURS_START, cfg.BUSINESS_HOURS_END),
+                   exceptions=exceptions, horizon_days=cfg.BUSINESS_CALENDAR_DAYS)
+
+    def hours_on(self, day: date) -> Hours:
+        """Opening hours on a day, or None if closed"""
+        if day in self.exceptions:
+            return self.exceptions[day]
+        return self.hours if day.weekday() in self.days else None
+
+    def _build(self, first_day: date):
+        """Precompute intervals from first_day for horizon_days"""
+        starts, ends = [], []
+        last_day = first_day + timedelta(days=self.horizon_days)
+        day = first_day
+        while day < last_day:
+            hours = self.hours_on(day)
+            if hours:
+                starts.append(self.tz.localize(datetime.combine(day, hours[0])).timestamp())
+                ends.append(self.tz.localize(datetime.combine(day, hours[1])).timestamp())
+            day += timedelta(days=1)
+        self._window = (first_day, last_day, starts, ends)
+        self.rebuilds += 1
+
+    def _intervals(self, day: date) -> Tuple[date, date, List[float], List[float]]:
+        """Intervals covering `day`, rebuilt when it falls outside the current window"""
+        window = self._window
+        if window[0] <= day < window[1]:
+            return window
+        with self._lock:
+            window = self._window
+            if not window[0] <= day < window[1]:
+                # Start a day early so lookups just after midnight stay in the window
+                self._build(day - timedelta(days=1))
+                window = self._window
+        return window
+
+    def now(self) -> datetime:
+        return datetime.now(self.tz)
+
+    def _localize(self, dt: Optional[datetime]) -> datetime:
+        if dt is None:
+            return self.now()
+        if dt.tzinfo is None:
+            return self.tz.localize(dt)
+        return dt.astimezone(self.tz)
+
+    def is_open(self, dt: Optional[datetime] = None) -> bool:
+        """True if the business is open at dt (default: now)"""
+        dt = self._localize(dt)
+        _, _, starts, ends = self._intervals(dt.date())
+        ts = dt.timestamp()
+        index = bisect_right(starts, ts) - 1
+        return index >= 0 and ts <= ends[index]
+
+    def next_opening(self, dt: Optional[datetime] = None) -> Optional[datetime]:
+        """
+        When the business is next open: dt itself if open now
+        None if there is no opening within MAX_LOOKAHEAD_DAYS.
+        """
+        dt = self._localize(dt)
+        if self.is_open(dt):
+            return dt
+        ts = dt.timestamp()
+        day = dt.date()
+        limit = day + timedelta(days=MAX_LOOKAHEAD_DAYS)
+        while day < limit:
+            _, last_day, starts, _ = self._intervals(day)
+            index = bisect_right(starts, ts)
+            if index < len(starts):
+                return datetime.fromtimestamp(starts[index], self.tz)
+            day = last_day
+        return None
+
+    def stats(self) -> Dict:
+        opening = self.next_opening()
+        first_day, last_day, starts, _ = self._window
+        return {
+            "timezone": self.tz.zone,
+            "open_now": self.is_open(),
+            "next_opening": opening.isoformat() if opening else None,
+            "holidays": len(self.exceptions),
+            "window": [first_day.isoformat(), last_day.isoformat()] if starts else None,
+            "rebuilds": self.rebuilds,
+        }
+
+
+def describe_opening(opening: datetime, now: datetime) -> str:
+    """'bugün 09:00', 'yarın 09:00' or 'Cumartesi 09:00' (with the date when over a week away)"""
+    days_ahead = (opening.date() - now.date()).days
+    clock = opening.strftime('%H:%M')
+    if days_ahead == 0:
+        return f"bugün {clock}"
+    if days_ahead == 1:
+        return f"yarın {clock}"
+    if days_ahead < 7:
+        return f"{TURKISH_DAYS[opening.weekday()]} {clock}"
+    return f"{opening.strftime('%d.%m.%Y')} {TURKISH_DAYS[opening.weekday()]} {clock}"
+
+
+_calendars: Dict[str, Tuple[int, BusinessCalendar]] = {}
+_calendar_lock = threading.Lock()
+
+
+def get_calendar(settings=None, key: str = 'default') -> BusinessCalendar:
+    """
+    Shared calendar per key (tenant), built on first use and again after each config reload
+    settings: config-like object with a version (default: the current runtime config)
+    """
+    settings = settings or runtime_config.current()
+    entry = _calendars.get(key)
+    if entry is None or entry[0] != settings.version:
+        with _calendar_lock:
+            entry = _calendars.get(key)
+            if entry is None or entry[0] != settings.version:
+                try:
+                    calendar = BusinessCalendar.from_config(settings)
+                except (OSError, ValueError) as e:
+                    if entry is None:
+                        raise
+                    # A broken holidays file keeps the previous calendar
+                    print(f"❌ Could not rebuild business calendar: {e}")
+                    calendar = entry[1]
+                entry = (settings.version, calendar)
+                _calendars[key] = entry
+    return entry[1]
+
+
+if __name__ == '__main__':
+    calendar = get_calendar()
+    now = calendar.now()
+    print(f"Open now: {calendar.is_open(now)}")
+    opening = calendar.next_opening(now)
+    print(f"Next opening: {describe_opening(opening, now) if opening else 'none within a year'}")
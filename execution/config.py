@@ -5,6 +5,7 @@ Loads environment variables and provides configuration constants
 
 import os
 from datetime import time
+from types import SimpleNamespace
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -24,12 +25,91 @@ TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID', '')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN', '')
 TWILIO_WHATSAPP_NUMBER = os.getenv('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+905438247016')
 
+# Provider API base URLs (point at execution/whatsapp_simulator.py for load tests)
+META_API_URL = os.getenv('META_API_URL', 'https://graph.facebook.com/v18.0')
+DIALOG360_API_URL = os.getenv('DIALOG360_API_URL', 'https://waba.360dialog.io/v1')
+TWILIO_API_URL = os.getenv('TWILIO_API_URL', '')  # empty = Twilio SDK default
+
+# WhatsApp HTTP connection pool, timeouts (seconds) and retries
+WHATSAPP_CONNECT_TIMEOUT = float(os.getenv('WHATSAPP_CONNECT_TIMEOUT', '5'))
+WHATSAPP_READ_TIMEOUT = float(os.getenv('WHATSAPP_READ_TIMEOUT', '15'))
+WHATSAPP_POOL_SIZE = int(os.getenv('WHATSAPP_POOL_SIZE', '10'))
+WHATSAPP_MAX_RETRIES = int(os.getenv('WHATSAPP_MAX_RETRIES', '2'))  # connect errors, 429, 503
+
+# Outbound send queue: provider-wide and per-recipient rate limits (0 = unlimited)
+WHATSAPP_RATE_PER_SECOND = float(os.getenv('WHATSAPP_RATE_PER_SECOND', '20'))
+WHATSAPP_RATE_BURST = int(os.getenv('WHATSAPP_RATE_BURST', '20'))
+WHATSAPP_RECIPIENT_PER_MINUTE = float(os.getenv('WHATSAPP_RECIPIENT_PER_MINUTE', '10'))
+WHATSAPP_RECIPIENT_BURST = int(os.getenv('WHATSAPP_RECIPIENT_BURST', '5'))
+WHATSAPP_SEND_WORKERS = int(os.getenv('WHATSAPP_SEND_WORKERS', '4'))
+WHATSAPP_QUEUE_TIMEOUT = float(os.getenv('WHATSAPP_QUEUE_TIMEOUT', '120'))  # blocking send() wait
+
+# Template broadcasts: recipients claimed and recorded per batch
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '100'))
+# broadcast.py sends from its own process, next to the live dispatcher, so
+# it keeps to a small share of the provider limit (messages per second)
+BROADCAST_RATE_PER_SECOND = float(os.getenv('BROADCAST_RATE_PER_SECOND', '2'))
+# Country code for local-format numbers in recipient lists ('0555 ...')
+DEFAULT_COUNTRY_CODE = os.getenv('DEFAULT_COUNTRY_CODE', '90')
+
+# Outbox: outgoing messages are stored first, then sent by the dispatcher
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '50'))  # max messages in flight
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))  # seconds
+OUTBOX_LEASE_SECONDS = float(os.getenv('OUTBOX_LEASE_SECONDS', '300'))  # resend unfinished sends after
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETRY_BACKOFF = float(os.getenv('OUTBOX_RETRY_BACKOFF', '30'))  # seconds, doubles per attempt
+# Only the monitor process dispatches; web workers wake it through this
+# localhost UDP port (0: it finds new messages at the next poll)
+OUTBOX_NOTIFY_PORT = int(os.getenv('OUTBOX_NOTIFY_PORT', '5002'))
+
+# Delivery receipts (sent/delivered/read/failed) are written in batches
+DELIVERY_STATUS_BATCH_SIZE = int(os.getenv('DELIVERY_STATUS_BATCH_SIZE', '100'))
+DELIVERY_STATUS_FLUSH_INTERVAL = float(os.getenv('DELIVERY_STATUS_FLUSH_INTERVAL', '2'))  # seconds
+
 # AI API (OpenAI or Anthropic)
 AI_PROVIDER = os.getenv('AI_PROVIDER', 'openai')  # openai, anthropic
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
 AI_MODEL = os.getenv('AI_MODEL', 'gpt-4o-mini')  # gpt-4o, gpt-4o-mini, claude-3-sonnet-20240229
 
+# Optional second provider/model used when the primary is slow or failing
+AI_FALLBACK_PROVIDER = os.getenv('AI_FALLBACK_PROVIDER', '')  # openai, anthropic
+AI_FALLBACK_MODEL = os.getenv('AI_FALLBACK_MODEL', '')
+
+# Route order: 'priority' (primary first) or 'latency' (fastest p50 first)
+AI_ROUTING = os.getenv('AI_ROUTING', 'priority')
+
+# Hedging: start the fallback when the primary takes longer than its p95
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'False').lower() == 'true'
+AI_HEDGE_DELAY = float(os.getenv('AI_HEDGE_DELAY', '8'))  # until enough samples exist
+AI_HEDGE_MIN_SAMPLES = int(os.getenv('AI_HEDGE_MIN_SAMPLES', '20'))
+
+# Circuit breaker per provider/model
+AI_CIRCUIT_FAILURES = int(os.getenv('AI_CIRCUIT_FAILURES', '5'))  # consecutive
+AI_CIRCUIT_ERROR_RATE = float(os.getenv('AI_CIRCUIT_ERROR_RATE', '0.5'))
+AI_CIRCUIT_WINDOW = int(os.getenv('AI_CIRCUIT_WINDOW', '20'))  # calls
+AI_CIRCUIT_RESET_SECONDS = float(os.getenv('AI_CIRCUIT_RESET_SECONDS', '60'))
+
+# AI spend budgets in USD (0 = no limit). At AI_BUDGET_DOWNGRADE_AT of a
+# budget replies switch to AI_BUDGET_DOWNGRADE_MODEL (same provider); when a
+# budget is used up only quick replies are sent and a human takes over.
+DAILY_AI_BUDGET_USD = float(os.getenv('DAILY_AI_BUDGET_USD', '0'))
+MONTHLY_AI_BUDGET_USD = float(os.getenv('MONTHLY_AI_BUDGET_USD', '0'))
+AI_BUDGET_DOWNGRADE_MODEL = os.getenv('AI_BUDGET_DOWNGRADE_MODEL', '')
+AI_BUDGET_DOWNGRADE_AT = float(os.getenv('AI_BUDGET_DOWNGRADE_AT', '0.8'))
+AI_BUDGET_QUICK_REPLY_CONFIDENCE = float(os.getenv('AI_BUDGET_QUICK_REPLY_CONFIDENCE', '0.5'))
+
+# AI client connection pool, timeouts (seconds) and concurrency
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '30'))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '10'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '4'))  # calls in flight per provider
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+
+# Mark the static system prompt as cacheable (Anthropic cache_control).
+# OpenAI caches the identical prefix automatically.
+PROMPT_CACHING_ENABLED = os.getenv('PROMPT_CACHING_ENABLED', 'True').lower() == 'true'
+
 # ==================== SERVER CONFIG ====================
 
 # Flask server settings
@@ -52,12 +132,32 @@ MAX_AI_RESPONSES_PER_CONVERSATION = int(os.getenv('MAX_AI_RESPONSES', '3'))
 BUSINESS_HOURS_START = time(9, 0)   # 09:00
 BUSINESS_HOURS_END = time(20, 0)    # 20:00
 BUSINESS_DAYS = [5, 6]  # Saturday=5, Sunday=6 (0=Monday)
+BUSINESS_TIMEZONE = os.getenv('BUSINESS_TIMEZONE', 'Europe/Istanbul')
+
+# Closed days and special hours (one date per line), and how many days
+# of opening hours are precomputed at a time
+HOLIDAYS_FILE = os.getenv('HOLIDAYS_FILE', 'holidays.txt')
+BUSINESS_CALENDAR_DAYS = int(os.getenv('BUSINESS_CALENDAR_DAYS', '28'))
 
 # Respond immediately outside business hours
 IMMEDIATE_RESPONSE_OUTSIDE_HOURS = os.getenv('IMMEDIATE_OUTSIDE_HOURS', 'True').lower() == 'true'
 
-# Emergency keywords (immediate notification, no AI response)
-EMERGENCY_KEYWORDS = ['acil', 'urgent', 'emergency', 'ivedi', 'hemen']
+# Emergency terms (immediate notification, no AI response), one per line;
+# the file is reloaded when it changes. EMERGENCY_KEYWORDS are used without it.
+EMERGENCY_TERMS_FILE = os.getenv('EMERGENCY_TERMS_FILE', 'emergency-terms.txt')
+EMERGENCY_TERMS_RELOAD_INTERVAL = float(os.getenv('EMERGENCY_TERMS_RELOAD_INTERVAL', '5'))  # seconds
+EMERGENCY_KEYWORDS = ['acil*', 'urgent*', 'emergency', 'ivedi*', 'hemen']
+
+# Cache AI answers to repeated first-turn questions (prices, address, ...)
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'True').lower() == 'true'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '500'))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '604800'))  # 7 days
+
+# Conversation context sent to the AI
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1200'))  # tokens of history
+CONTEXT_HISTORY_LIMIT = int(os.getenv('CONTEXT_HISTORY_LIMIT', '30'))  # rows considered
+CONTEXT_SUMMARY_ENABLED = os.getenv('CONTEXT_SUMMARY_ENABLED', 'True').lower() == 'true'
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv('CONTEXT_SUMMARY_MAX_TOKENS', '200'))
 
 # ==================== DATABASE CONFIG ====================
 
@@ -85,7 +185,9 @@ BUSINESS_INFO = {
 
 # ==================== AI PROMPT CONFIGURATION ====================
 
-SYSTEM_PROMPT = f"""Sen {BUSINESS_INFO['name']} kliniğinin yardımcı asistanısın.
+def build_system_prompt(info: dict) -> str:
+    """System prompt for a clinic's BUSINESS_INFO (tenants with their own info reuse it)"""
+    return f"""Sen {info['name']} kliniğinin yardımcı asistanısın.
 
 GÖREV:
 - Hastalardan gelen mesajlara profesyonel, yardımsever ve dostane bir şekilde yanıt ver
@@ -94,17 +196,17 @@ GÖREV:
 - Karmaşık tıbbi sorular için terapiste yönlendir
 
 KLİNİK BİLGİLERİ:
-- İsim: {BUSINESS_INFO['name']}
-- Terapist: {BUSINESS_INFO['therapist']}
-- Telefon: {BUSINESS_INFO['phone']}
-- Adres: {BUSINESS_INFO['address']}
-- Çalışma Saatleri: {BUSINESS_INFO['working_hours']}
+- İsim: {info['name']}
+- Terapist: {info['therapist']}
+- Telefon: {info['phone']}
+- Adres: {info['address']}
+- Çalışma Saatleri: {info['working_hours']}
 
 HİZMETLER:
-{chr(10).join(f'- {service}' for service in BUSINESS_INFO['services'])}
+{chr(10).join(f'- {service}' for service in info['services'])}
 
 ÜCRET POLİTİKASI:
-{BUSINESS_INFO['pricing_policy']}
+{info['pricing_policy']}
 
 İLETİŞİM KURALLARI:
 1. Her zaman Türkçe yanıt ver
@@ -113,7 +215,7 @@ HİZMETLER:
 4. Tıbbi teşhis koyma, sadece genel bilgi ver
 5. Karmaşık durumları terapiste yönlendir
 6. Emojileri ölçülü kullan (1-2 emoji per mesaj)
-7. MUTLAKA şu cümleyi ekle: "Bu otomatik yanıttır. {BUSINESS_INFO['therapist']} size kısa sürede dönüş yapacaktır."
+7. MUTLAKA şu cümleyi ekle: "Bu otomatik yanıttır. {info['therapist']} size kısa sürede dönüş yapacaktır."
 
 ÖRNEKLER:
 
@@ -145,6 +247,41 @@ Detaylı değerlendirme için randevu oluşturabiliriz.
 Bu otomatik yanıttır. Dkt. Veysi İkvan size kısa sürede dönüş yapacaktır."
 """
 
+SYSTEM_PROMPT = build_system_prompt(BUSINESS_INFO)
+
+# ==================== QUICK REPLIES ====================
+
+# Answer common questions from quick-replies-reference.txt without the LLM
+QUICK_REPLIES_ENABLED = os.getenv('QUICK_REPLIES_ENABLED', 'True').lower() == 'true'
+QUICK_REPLIES_FILE = os.getenv('QUICK_REPLIES_FILE', 'quick-replies-reference.txt')
+
+# Quick replies appended to the static system prompt (empty disables it).
+# Besides keeping AI answers consistent with them, this lifts the prompt over
+# the shortest prefix providers cache: 1024 tokens (2048 for Claude Haiku).
+# SYSTEM_PROMPT alone is ~650 tokens and would never be cached.
+PROMPT_REFERENCE_FILE = os.getenv('PROMPT_REFERENCE_FILE', QUICK_REPLIES_FILE)
+
+# Share of the message's meaningful words that must match one intent (0-1)
+QUICK_REPLY_MIN_CONFIDENCE = float(os.getenv('QUICK_REPLY_MIN_CONFIDENCE', '0.75'))
+
+# Phrases per quick reply shortcut; a trailing * matches word prefixes
+QUICK_REPLY_KEYWORDS = {
+    'randevu': ['randevu*', 'randevu al*', 'seans al*', 'görüşme ayarla*'],
+    'hizmetler': ['hizmet*', 'tedavi alan*', 'hangi tedavi*', 'neler yapıyorsunuz'],
+    'ucret': ['ücret*', 'fiyat*', 'ne kadar', 'kaç para', 'kaç tl', 'seans ücret*'],
+    'adres': ['adres*', 'nerede*', 'neresi*', 'konum*', 'yol tarif*', 'nasıl gel*'],
+    'saatler': ['çalışma saat*', 'saat kaç*', 'kaçta aç*', 'kaçta kapan*', 'açık mısınız', 'açıksınız*',
+                'mesai*', 'hangi gün*'],
+    'degerlendirme': ['değerlendirme*', 'ilk görüşme*', 'ilk seans*', 'süreç nasıl*'],
+    'online': ['online*', 'online terapi*', 'online seans*', 'çevrimiçi', 'uzaktan terapi*', 'görüntülü*', 'internetten'],
+    'tesekkur': ['teşekkür*', 'teşekkürler', 'sağ ol*', 'sağol*', 'eyvallah', 'çok sağ ol*'],
+}
+
+# Appended to every quick reply, as the system prompt requires for AI answers
+QUICK_REPLY_FOOTER = (
+    f"Bu otomatik yanıttır. {BUSINESS_INFO['therapist']} size kısa sürede dönüş yapacaktır."
+)
+
 # ==================== LOGGING CONFIG ====================
 
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
@@ -155,30 +292,123 @@ LOG_FILE = os.getenv('LOG_FILE', 'logs/whatsapp_ai.log')
 # Maximum messages per minute to prevent abuse
 MAX_MESSAGES_PER_MINUTE = int(os.getenv('MAX_MESSAGES_PER_MINUTE', '10'))
 
+# ==================== MONITORING ====================
+
+# How often the background monitor polls for due responses (seconds)
+MONITOR_CHECK_INTERVAL = int(os.getenv('MONITOR_CHECK_INTERVAL', '30'))
+
+# Run the monitor inside the webhook server process (single-process mode)
+EMBEDDED_MONITOR = os.getenv('EMBEDDED_MONITOR', 'False').lower() == 'true'
+
+# Only one process may own the embedded scheduler (gunicorn workers race for it)
+MONITOR_LOCK_FILE = os.getenv('MONITOR_LOCK_FILE', 'data/monitor.lock')
+
+# Local status endpoint for the background monitor (0 disables it)
+MONITOR_STATUS_HOST = os.getenv('MONITOR_STATUS_HOST', '127.0.0.1')
+MONITOR_STATUS_PORT = int(os.getenv('MONITOR_STATUS_PORT', '5001'))
+
+# Status file rewritten after every monitor cycle (empty disables it)
+MONITOR_STATUS_FILE = os.getenv('MONITOR_STATUS_FILE', 'logs/monitor_status.json')
+
+# Report unhealthy when p95 dispatch lag exceeds this many seconds
+MONITOR_LAG_ALERT_SECONDS = float(os.getenv('MONITOR_LAG_ALERT_SECONDS', '120'))
+
+# ...over the responses dispatched in the last this many seconds
+MONITOR_LAG_WINDOW_SECONDS = float(os.getenv('MONITOR_LAG_WINDOW_SECONDS', '900'))
+
+# Report unhealthy when the loop has not completed a cycle for this long
+MONITOR_HEARTBEAT_TIMEOUT = float(os.getenv('MONITOR_HEARTBEAT_TIMEOUT', '180'))
+
+# ==================== PROFILING ====================
+
+# Share of webhook requests and monitor cycles profiled (0 = off, 0.01 = 1%)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+
+# cprofile (pstats files) or sampler (collapsed stacks for flame graphs)
+PROFILE_MODE = os.getenv('PROFILE_MODE', 'cprofile')
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+
+# Only keep profiles of requests/cycles that took at least this long (ms)
+PROFILE_MIN_MS = float(os.getenv('PROFILE_MIN_MS', '0'))
+
+# Where profiles go; the oldest are deleted beyond PROFILE_MAX_FILES
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'logs/profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '100'))
+
+# X-Admin-Token for /admin/profile and the X-Profile header (empty disables both)
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN', '')
+
+# ==================== TRACING ====================
+
+# Spans of every message's path (webhook, delay, AI, send) are appended here;
+# empty disables export (trace IDs are still stored with the messages)
+TRACE_FILE = os.getenv('TRACE_FILE', 'logs/traces.jsonl')
+
+# jsonl (one span per line) or otlp (OTLP/JSON, for an OpenTelemetry collector)
+TRACE_FORMAT = os.getenv('TRACE_FORMAT', 'jsonl')
+
+# Move the file to TRACE_FILE.1 at this size (0 = never)
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(50 * 1024 * 1024)))
+
+# ==================== TENANTS ====================
+
+# Several clinics/numbers in one deployment: JSON object of tenant ID ->
+# setting overrides (see tenants.example.json). Without the file the
+# settings above serve a single clinic.
+TENANTS_FILE = os.getenv('TENANTS_FILE', 'tenants.json')
+
+# ==================== RUNTIME RELOAD ====================
+
+# How often .env, config.py and HOLIDAYS_FILE are checked for changes
+# (seconds, 0 = only reload on SIGHUP); see execution/runtime_config.py
+CONFIG_WATCH_INTERVAL = float(os.getenv('CONFIG_WATCH_INTERVAL', '5'))
+
 # ==================== VALIDATION ====================
 
-def validate_config():
-    """Validate that all required configuration is present"""
+def validate_config(settings=None):
+    """
+    Validate that all required configuration is present
+    settings: a config-like object to check instead (e.g. a tenant's settings)
+    """
+    s = settings or SimpleNamespace(**globals())
     errors = []
 
     # Check WhatsApp API credentials
-    if WHATSAPP_API_PROVIDER == 'twilio':
-        if not TWILIO_ACCOUNT_SID:
+    if s.WHATSAPP_API_PROVIDER == 'twilio':
+        if not s.TWILIO_ACCOUNT_SID:
             errors.append("TWILIO_ACCOUNT_SID is required")
-        if not TWILIO_AUTH_TOKEN:
+        if not s.TWILIO_AUTH_TOKEN:
             errors.append("TWILIO_AUTH_TOKEN is required")
-    elif WHATSAPP_API_PROVIDER == 'meta':
-        if not WHATSAPP_API_KEY:
+    elif s.WHATSAPP_API_PROVIDER == 'meta':
+        if not s.WHATSAPP_API_KEY:
             errors.append("WHATSAPP_API_KEY is required for Meta API")
-        if not WHATSAPP_PHONE_NUMBER_ID:
+        if not s.WHATSAPP_PHONE_NUMBER_ID:
             errors.append("WHATSAPP_PHONE_NUMBER_ID is required for Meta API")
 
     # Check AI API credentials
-    if AI_PROVIDER == 'openai' and not OPENAI_API_KEY:
+    if s.AI_PROVIDER == 'openai' and not s.OPENAI_API_KEY:
         errors.append("OPENAI_API_KEY is required")
-    elif AI_PROVIDER == 'anthropic' and not ANTHROPIC_API_KEY:
+    elif s.AI_PROVIDER == 'anthropic' and not s.ANTHROPIC_API_KEY:
         errors.append("ANTHROPIC_API_KEY is required")
 
+    if s.AI_FALLBACK_PROVIDER:
+        if s.AI_FALLBACK_PROVIDER not in ('openai', 'anthropic'):
+            errors.append(f"Unsupported AI_FALLBACK_PROVIDER: {s.AI_FALLBACK_PROVIDER}")
+        elif not s.AI_FALLBACK_MODEL:
+            errors.append("AI_FALLBACK_MODEL is required when AI_FALLBACK_PROVIDER is set")
+        elif s.AI_FALLBACK_PROVIDER == 'openai' and not s.OPENAI_API_KEY:
+            errors.append("OPENAI_API_KEY is required for the fallback provider")
+        elif s.AI_FALLBACK_PROVIDER == 'anthropic' and not s.ANTHROPIC_API_KEY:
+            errors.append("ANTHROPIC_API_KEY is required for the fallback provider")
+
+    if s.PROFILE_MODE not in ('cprofile', 'sampler'):
+        errors.append(f"Unsupported PROFILE_MODE: {s.PROFILE_MODE}")
+    if not 0 <= s.PROFILE_SAMPLE_RATE <= 1:
+        errors.append("PROFILE_SAMPLE_RATE must be between 0 and 1")
+
+    if s.TRACE_FORMAT not in ('jsonl', 'otlp'):
+        errors.append(f"Unsupported TRACE_FORMAT: {s.TRACE_FORMAT}")
+
     if errors:
         raise ValueError(f"Configuration errors:\n" + "\n".join(f"- {err}" for err in errors))
 
@@ -187,27 +417,10 @@ def validate_config():
 # ==================== UTILITY FUNCTIONS ====================
 
 def is_business_hours(dt=None):
-    """Check if current time is within business hours"""
-    from datetime import datetime
-    import pytz
-
-    if dt is None:
-        # Turkey timezone
-        turkey_tz = pytz.timezone('Europe/Istanbul')
-        dt = datetime.now(turkey_tz)
-
-    # Check day of week
-    if dt.weekday() not in BUSINESS_DAYS:
-        return False
-
-    # Check time
-    current_time = dt.time()
-    return BUSINESS_HOURS_START <= current_time <= BUSINESS_HOURS_END
-
-def contains_emergency_keyword(message):
-    """Check if message contains emergency keywords"""
-    message_lower = message.lower()
-    return any(keyword in message_lower for keyword in EMERGENCY_KEYWORDS)
+    """Check if current time is within business hours (holidays included)"""
+    # Imported here: the calendar module reads this config
+    from business_calendar import get_calendar
+    return get_calendar().is_open(dt)
 
 if __name__ == '__main__':
     # Test configuration
@@ -0,0 +1,152 @@
+"""
+Context Builder - Fit conversation history into a token budget
+Recent turns are kept verbatim; older turns are folded into a rolling
+per-conversation summary stored in the database
+"""
+
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+import config
+from conversation_tracker import ConversationTracker, is_auto_reply
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding('cl100k_base')
+except Exception:  # Optional dependency; fall back to a character estimate
+    _ENCODING = None
+
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Turkish averages fewer characters per token than English
+CHARS_PER_TOKEN = 3.5
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate token count locally (tiktoken when installed)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text down to roughly max_tokens, keeping the beginning"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if _ENCODING is not None:
+        return _ENCODING.decode(_ENCODING.encode(text)[:max_tokens]) + '…'
+    return text[:int(max_tokens * CHARS_PER_TOKEN)] + '…'
+
+
+def extractive_summary(previous: str, turns: List[Dict], max_tokens: int) -> str:
+    """Summary without an LLM: previous summary plus the start of each turn"""
+    lines = [previous] if previous else []
+    for turn in turns:
+        speaker = 'Klinik' if turn['role'] == 'assistant' else 'Danışan'
+        lines.append(f"{speaker}: {truncate_to_tokens(turn['content'], 40)}")
+    # Keep the most recent lines when over budget
+    while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return truncate_to_tokens('\n'.join(lines), max_tokens)
+
+
+class ContextBuilder:
+    """
+    Builds the message list sent to the LLM
+    summarize(previous_summary, turns, max_tokens) -> str updates a summary;
+    it is only called for turns that newly fell out of the window.
+    """
+
+    def __init__(self, tracker: ConversationTracker,
+                 summarize: Optional[Callable[[str, List[Dict], int], str]] = None,
+                 token_budget: int = config.CONTEXT_TOKEN_BUDGET,
+                 history_limit: int = config.CONTEXT_HISTORY_LIMIT,
+                 summary_max_tokens: int = config.CONTEXT_SUMMARY_MAX_TOKENS):
+        self.tracker = tracker
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.history_limit = history_limit
+        self.summary_max_tokens = summary_max_tokens
+
+    def build(self, phone_number: str, conversation_id: int,
+              current_message_id: Optional[int] = None,
+              summarize: Optional[Callable[[str, List[Dict], int], str]] = None
+              ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Get (history_messages, summary) for a conversation
+        The current message (current_message_id) is left out; the caller appends it.
+        summarize overrides the builder's summarizer for this request.
+        """
+        rows = self.tracker.get_conversation_history(phone_number, limit=self.history_limit)
+        rows = [r for r in rows if r['id'] != current_message_id and r['message_text']
+                and not is_auto_reply(r)]
+
+        # Newest first until the budget is spent
+        kept: List[Dict] = []
+        used = 0
+        for row in reversed(rows):
+            cost = estimate_tokens(row['message_text']) + MESSAGE_OVERHEAD_TOKENS
+            if used + cost > self.token_budget:
+                if not kept:
+                    # A single huge last turn: keep a truncated copy
+                    room = max(self.token_budget - MESSAGE_OVERHEAD_TOKENS, 0)
+                    kept.append({**row, 'message_text': truncate_to_tokens(row['message_text'], room)})
+                break
+            kept.append(row)
+            used += cost
+        kept.reverse()
+
+        messages = [self._to_message(row) for row in kept]
+
+        if not config.CONTEXT_SUMMARY_ENABLED:
+            return messages, None
+
+        # Everything older than the oldest kept turn belongs in the summary
+        window_start_id = kept[0]['id'] if kept else (current_message_id or 0)
+        summary = self._update_summary(conversation_id, window_start_id, current_message_id,
+                                       summarize or self.summarize)
+        return messages, summary
+
+    def _to_message(self, row: Dict) -> Dict:
+        role = "assistant" if row['direction'] == 'outgoing' else "user"
+        return {"role": role, "content": row['message_text']}
+
+    def _update_summary(self, conversation_id: int, window_start_id: int,
+                        current_message_id: Optional[int],
+                        summarize: Optional[Callable] = None) -> Optional[str]:
+        """
+        Fold turns that left the window since the last update into the summary
+        Oldest first and at most history_limit turns per call, so a long
+        backlog (e.g. the first run over old conversations) catches up over
+        several replies instead of skipping its oldest turns.
+        """
+        stored = self.tracker.get_conversation_summary(conversation_id)
+        previous = stored['summary'] if stored else ''
+        summarized_through = stored['summarized_through_id'] if stored else 0
+
+        rows = self.tracker.get_messages_between(conversation_id, summarized_through,
+                                                 window_start_id, limit=self.history_limit)
+        if not rows:
+            return previous or None
+        through_id = rows[-1]['id']
+        dropped = [r for r in rows if r['id'] != current_message_id and r['message_text']
+                   and not is_auto_reply(r)]
+        if not dropped:
+            # Nothing to fold in; still move past these rows
+            self.tracker.save_conversation_summary(conversation_id, previous, through_id)
+            return previous or None
+
+        turns = [self._to_message(row) for row in dropped]
+        summary = None
+        if summarize:
+            try:
+                summary = summarize(previous, turns, self.summary_max_tokens)
+            except Exception as e:
+                print(f"Summary generation failed, using extractive summary: {e}")
+        if not summary:
+            summary = extractive_summary(previous, turns, self.summary_max_tokens)
+
+        self.tracker.save_conversation_summary(conversation_id, summary, through_id)
+        return summary
@@ -5,20 +5,39 @@ Tracks message history, response status, and AI interaction metadata
 
 import sqlite3
 import os
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 import json
+from pricing import estimate_cost
+
+# Messages sent with {"auto_reply": ...} metadata (e.g. outside-hours notices)
+# are not answers: they neither count as AI responses nor as context
+_NOT_AUTO_REPLY = "(metadata IS NULL OR metadata NOT LIKE '%\"auto_reply\"%')"
+
+
+def is_auto_reply(message: Dict) -> bool:
+    """True for an automatic acknowledgement such as the outside-hours reply"""
+    try:
+        return bool(json.loads(message.get('metadata') or '{}').get('auto_reply'))
+    except (ValueError, AttributeError):
+        return False
+
 
 class ConversationTracker:
     def __init__(self, db_path='data/conversations.db'):
         self.db_path = db_path
         self._ensure_database_exists()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the database (one per operation)"""
+        return sqlite3.connect(self.db_path)
+
     def _ensure_database_exists(self):
         """Create database directory and file if they don't exist"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
 
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         # Create conversations table
@@ -49,6 +68,7 @@ class ConversationTracker:
                 human_response_pending BOOLEAN DEFAULT 1,
                 human_responded_at TIMESTAMP,
                 metadata TEXT,
+                trace_id TEXT,
                 FOREIGN KEY (conversation_id) REFERENCES conversations(id)
             )
         ''')
@@ -67,10 +87,37 @@ class ConversationTracker:
                 generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 was_sent BOOLEAN DEFAULT 0,
                 error TEXT,
+                input_tokens INTEGER DEFAULT 0,
+                cached_input_tokens INTEGER DEFAULT 0,
+                cache_write_tokens INTEGER DEFAULT 0,
+                provider TEXT,
+                latency_ms INTEGER,
+                hedged BOOLEAN DEFAULT 0,
+                output_tokens INTEGER DEFAULT 0,
+                kind TEXT DEFAULT 'reply',
                 FOREIGN KEY (conversation_id) REFERENCES conversations(id),
                 FOREIGN KEY (message_id) REFERENCES messages(id)
             )
         ''')
+        self._ensure_columns(cursor, 'ai_responses', {
+            'input_tokens': 'INTEGER DEFAULT 0',
+            'cached_input_tokens': 'INTEGER DEFAULT 0',
+            'cache_write_tokens': 'INTEGER DEFAULT 0',
+            'provider': 'TEXT',
+            'latency_ms': 'INTEGER',
+            'hedged': 'BOOLEAN DEFAULT 0',
+            'output_tokens': 'INTEGER DEFAULT 0',
+            'kind': "TEXT DEFAULT 'reply'"
+        })
+
+        # Create spend_counters table: running AI spend per day and month
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS spend_counters (
+                period TEXT PRIMARY KEY,
+                spend REAL NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP
+            )
+        ''')
 
         # Create pending_responses table for delayed responses
         cursor.execute('''
@@ -82,24 +129,140 @@ class ConversationTracker:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 status TEXT DEFAULT 'pending',
                 processed_at TIMESTAMP,
+                trace_id TEXT,
                 FOREIGN KEY (message_id) REFERENCES messages(id),
                 FOREIGN KEY (conversation_id) REFERENCES conversations(id)
             )
         ''')
 
+        # Create response_cache table for repeated first-turn questions
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                prompt_version TEXT NOT NULL,
+                normalized_text TEXT,
+                response TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_hit_at TIMESTAMP,
+                hits INTEGER DEFAULT 0
+            )
+        ''')
+
+        # Create conversation_summaries table for rolling context summaries
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                conversation_id INTEGER PRIMARY KEY,
+                summary TEXT NOT NULL,
+                summarized_through_id INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+            )
+        ''')
+
+        # Create broadcast_jobs table: one row per recipient of a template broadcast
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                job_id TEXT NOT NULL,
+                phone_number TEXT NOT NULL,
+                template_name TEXT NOT NULL,
+                language_code TEXT NOT NULL DEFAULT 'tr',
+                components TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                message_id TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP,
+                PRIMARY KEY (job_id, phone_number)
+            )
+        ''')
+
+        # Create message_status table: delivery receipts per provider message ID
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS message_status (
+                message_id TEXT PRIMARY KEY,
+                provider TEXT,
+                recipient TEXT,
+                lane TEXT,
+                status TEXT NOT NULL,
+                status_rank INTEGER NOT NULL DEFAULT 0,
+                submitted_at TIMESTAMP,
+                sent_at TIMESTAMP,
+                delivered_at TIMESTAMP,
+                read_at TIMESTAMP,
+                failed_at TIMESTAMP,
+                error TEXT,
+                updated_at TIMESTAMP
+            )
+        ''')
+
+        # Create outbox table: outgoing messages waiting for the dispatcher
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                conversation_id INTEGER NOT NULL,
+                phone_number TEXT NOT NULL,
+                message_text TEXT NOT NULL,
+                is_ai BOOLEAN DEFAULT 0,
+                priority INTEGER NOT NULL,
+                pending_response_id INTEGER,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                provider_message_id TEXT,
+                sent_message_id INTEGER,
+                error TEXT,
+                created_at TIMESTAMP NOT NULL,
+                next_attempt_at TIMESTAMP NOT NULL,
+                claimed_at TIMESTAMP,
+                sent_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                metadata TEXT,
+                trace_id TEXT,
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id),
+                FOREIGN KEY (pending_response_id) REFERENCES pending_responses(id),
+                FOREIGN KEY (sent_message_id) REFERENCES messages(id)
+            )
+        ''')
+
+        self._ensure_columns(cursor, 'outbox', {'metadata': 'TEXT', 'trace_id': 'TEXT'})
+        self._ensure_columns(cursor, 'messages', {'trace_id': 'TEXT'})
+        self._ensure_columns(cursor, 'pending_responses', {'trace_id': 'TEXT'})
+
         # Create indexes for performance
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_received ON messages(received_at)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_pending_scheduled ON pending_responses(scheduled_for, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cache_last_hit ON response_cache(last_hit_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_status ON broadcast_jobs(job_id, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_status_submitted ON message_status(submitted_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, next_attempt_at)')
 
         conn.commit()
         conn.close()
 
+    def _ensure_columns(self, cursor, table: str, columns: Dict[str, str]):
+        """Add columns introduced after a database was first created"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
     def get_or_create_conversation(self, phone_number: str, customer_name: Optional[str] = None) -> int:
         """Get existing conversation or create new one"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
+        conversation_id = self._get_or_create_conversation(cursor, phone_number, customer_name)
+
+        conn.commit()
+        conn.close()
+        return conversation_id
+
+    def _get_or_create_conversation(self, cursor, phone_number: str,
+                                    customer_name: Optional[str] = None) -> int:
+        """Conversation lookup/creation inside the caller's transaction"""
         cursor.execute('SELECT id FROM conversations WHERE phone_number = ?', (phone_number,))
         result = cursor.fetchone()
 
@@ -114,25 +277,23 @@ class ConversationTracker:
                 VALUES (?, ?, ?, ?)
             ''', (phone_number, customer_name, datetime.now(), datetime.now()))
             conversation_id = cursor.lastrowid
-
-        conn.commit()
-        conn.close()
         return conversation_id
 
     def add_incoming_message(self, phone_number: str, message_text: str,
-                            message_id: str, metadata: Optional[Dict] = None) -> int:
+                            message_id: str, metadata: Optional[Dict] = None,
+                            trace_id: Optional[str] = None) -> int:
         """Record an incoming message from customer"""
         conversation_id = self.get_or_create_conversation(phone_number)
 
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
             INSERT INTO messages
-            (conversation_id, direction, message_text, message_id, received_at, metadata)
-            VALUES (?, ?, ?, ?, ?, ?)
+            (conversation_id, direction, message_text, message_id, received_at, metadata, trace_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (conversation_id, 'incoming', message_text, message_id, datetime.now(),
-              json.dumps(metadata) if metadata else None))
+              json.dumps(metadata) if metadata else None, trace_id))
 
         message_db_id = cursor.lastrowid
         conn.commit()
@@ -145,7 +306,7 @@ class ConversationTracker:
         """Record an outgoing message (human or AI)"""
         conversation_id = self.get_or_create_conversation(phone_number)
 
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -158,60 +319,93 @@ class ConversationTracker:
 
         message_db_id = cursor.lastrowid
 
-        # Mark all pending messages in this conversation as human-responded
         if not is_ai:
-            cursor.execute('''
-                UPDATE messages
-                SET human_response_pending = 0, human_responded_at = ?
-                WHERE conversation_id = ? AND human_response_pending = 1
-            ''', (datetime.now(), conversation_id))
-
-            # Cancel any pending AI responses
-            cursor.execute('''
-                UPDATE pending_responses
-                SET status = 'cancelled', processed_at = ?
-                WHERE conversation_id = ? AND status = 'pending'
-            ''', (datetime.now(), conversation_id))
+            self._mark_human_responded(cursor, conversation_id)
 
         conn.commit()
         conn.close()
 
         return message_db_id
 
-    def schedule_ai_response(self, message_id: int, delay_seconds: int = 300) -> int:
-        """Schedule an AI response for a message after delay"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Get conversation_id for this message
-        cursor.execute('SELECT conversation_id FROM messages WHERE id = ?', (message_id,))
-        result = cursor.fetchone()
-        if not result:
-            conn.close()
-            raise ValueError(f"Message {message_id} not found")
-
-        conversation_id = result[0]
-        scheduled_for = datetime.now() + timedelta(seconds=delay_seconds)
+    def _mark_human_responded(self, cursor, conversation_id: int):
+        """A human answered: clear pending flags and cancel scheduled AI responses"""
+        # Mark all pending messages in this conversation as human-responded
+        cursor.execute('''
+            UPDATE messages
+            SET human_response_pending = 0, human_responded_at = ?
+            WHERE conversation_id = ? AND human_response_pending = 1
+        ''', (datetime.now(), conversation_id))
 
+        # Cancel any pending AI responses
         cursor.execute('''
-            INSERT INTO pending_responses (message_id, conversation_id, scheduled_for)
-            VALUES (?, ?, ?)
-        ''', (message_id, conversation_id, scheduled_for))
+            UPDATE pending_responses
+            SET status = 'cancelled', processed_at = ?
+            WHERE conversation_id = ? AND status = 'pending'
+        ''', (datetime.now(), conversation_id))
+
+    def schedule_ai_response(self, message_id: int, delay_seconds: int = 300,
+                             trace_id: Optional[str] = None, merge: bool = False) -> int:
+        """
+        Schedule an AI response for a message after delay
+        merge: move the conversation's not yet due pending response to this
+        message and time instead of adding another, so messages sent while the
+        clinic is closed get one answer (to the latest, with the rest as context).
+        """
+        conn = self._connect()
+        conn.isolation_level = None
+        cursor = conn.cursor()
 
-        pending_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # Get conversation_id for this message
+            cursor.execute('SELECT conversation_id FROM messages WHERE id = ?', (message_id,))
+            result = cursor.fetchone()
+            if not result:
+                raise ValueError(f"Message {message_id} not found")
+
+            conversation_id = result[0]
+            now = datetime.now()
+            scheduled_for = now + timedelta(seconds=delay_seconds)
+
+            existing = None
+            if merge:
+                # Only rows not yet due; a due one may already be with the monitor
+                cursor.execute('''
+                    SELECT id FROM pending_responses
+                    WHERE conversation_id = ? AND status = 'pending' AND scheduled_for > ?
+                    ORDER BY id DESC LIMIT 1
+                ''', (conversation_id, now))
+                existing = cursor.fetchone()
+
+            if existing:
+                pending_id = existing[0]
+                cursor.execute('''
+                    UPDATE pending_responses SET message_id = ?, scheduled_for = ?, trace_id = ?
+                    WHERE id = ?
+                ''', (message_id, scheduled_for, trace_id, pending_id))
+            else:
+                cursor.execute('''
+                    INSERT INTO pending_responses (message_id, conversation_id, scheduled_for, trace_id)
+                    VALUES (?, ?, ?, ?)
+                ''', (message_id, conversation_id, scheduled_for, trace_id))
+                pending_id = cursor.lastrowid
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
 
         return pending_id
 
     def get_pending_responses(self) -> List[Dict]:
         """Get all pending responses that are due"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
         cursor.execute('''
-            SELECT pr.*, m.message_text, c.phone_number
+            SELECT pr.*, m.message_text, m.received_at, c.phone_number
             FROM pending_responses pr
             JOIN messages m ON pr.message_id = m.id
             JOIN conversations c ON pr.conversation_id = c.id
@@ -226,7 +420,7 @@ class ConversationTracker:
 
     def mark_pending_as_processed(self, pending_id: int, status: str = 'sent'):
         """Mark a pending response as processed"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -239,13 +433,14 @@ class ConversationTracker:
         conn.close()
 
     def get_ai_response_count(self, conversation_id: int) -> int:
-        """Get number of AI responses sent in a conversation"""
-        conn = sqlite3.connect(self.db_path)
+        """Get number of AI responses sent in a conversation (automatic notices excluded)"""
+        conn = self._connect()
         cursor = conn.cursor()
 
-        cursor.execute('''
+        cursor.execute(f'''
             SELECT COUNT(*) FROM messages
             WHERE conversation_id = ? AND is_ai_response = 1 AND direction = 'outgoing'
+              AND {_NOT_AUTO_REPLY}
         ''', (conversation_id,))
 
         count = cursor.fetchone()[0]
@@ -255,7 +450,7 @@ class ConversationTracker:
 
     def get_conversation_history(self, phone_number: str, limit: int = 10) -> List[Dict]:
         """Get recent message history for a conversation"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
@@ -272,32 +467,656 @@ class ConversationTracker:
 
         return results[::-1]  # Reverse to get chronological order
 
+    def get_messages_between(self, conversation_id: int, after_id: int, before_id: int,
+                             limit: int = 50) -> List[Dict]:
+        """Get the `limit` oldest messages with after_id < id < before_id, oldest first"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT * FROM messages
+            WHERE conversation_id = ? AND id > ? AND id < ?
+            ORDER BY id ASC
+            LIMIT ?
+        ''', (conversation_id, after_id, before_id, limit))
+
+        results = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+
+        return results
+
+    def get_conversation_summary(self, conversation_id: int) -> Optional[Dict]:
+        """Get the rolling summary of older turns for a conversation"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT summary, summarized_through_id, updated_at FROM conversation_summaries
+            WHERE conversation_id = ?
+        ''', (conversation_id,))
+
+        result = cursor.fetchone()
+        conn.close()
+
+        return dict(result) if result else None
+
+    def save_conversation_summary(self, conversation_id: int, summary: str,
+                                  summarized_through_id: int):
+        """Store the rolling summary and the last message id it covers"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT OR REPLACE INTO conversation_summaries
+            (conversation_id, summary, summarized_through_id, updated_at)
+            VALUES (?, ?, ?, ?)
+        ''', (conversation_id, summary, summarized_through_id, datetime.now()))
+
+        conn.commit()
+        conn.close()
+
     def log_ai_response(self, conversation_id: int, message_id: int,
                        prompt: str, response: str, model: str,
                        tokens_used: int = 0, was_sent: bool = True,
-                       error: Optional[str] = None):
-        """Log AI response generation for monitoring"""
-        conn = sqlite3.connect(self.db_path)
+                       error: Optional[str] = None, input_tokens: int = 0,
+                       cached_input_tokens: int = 0, cache_write_tokens: int = 0,
+                       provider: Optional[str] = None, latency_ms: Optional[int] = None,
+                       hedged: bool = False, output_tokens: int = 0, kind: str = 'reply'):
+        """
+        Log AI response generation for monitoring
+        input_tokens is uncached input (including prompt cache writes);
+        cached_input_tokens were read from the provider's prompt cache.
+        provider/model/latency_ms describe the route that answered.
+        kind: 'reply', 'summary' (rolling context summary) or 'hedge' (a
+        hedged request that lost the race); all of them count as spend.
+        """
+        conn = self._connect()
         cursor = conn.cursor()
 
-        # Rough cost estimate (update based on actual pricing)
-        cost_per_1k_tokens = 0.002 if 'gpt-4' in model else 0.0005
-        cost_estimate = (tokens_used / 1000) * cost_per_1k_tokens
+        if input_tokens or output_tokens or cached_input_tokens:
+            cost_estimate = estimate_cost(model, input_tokens, output_tokens,
+                                          cached_input_tokens, cache_write_tokens)
+        else:
+            # Only a total is known: price it all as output to stay on the safe side
+            cost_estimate = estimate_cost(model, output_tokens=tokens_used)
 
         cursor.execute('''
             INSERT INTO ai_responses
             (conversation_id, message_id, prompt, response, model,
-             tokens_used, cost_estimate, was_sent, error)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+             tokens_used, cost_estimate, was_sent, error,
+             input_tokens, cached_input_tokens, cache_write_tokens,
+             provider, latency_ms, hedged, output_tokens, kind)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (conversation_id, message_id, prompt, response, model,
-              tokens_used, cost_estimate, was_sent, error))
+              tokens_used, cost_estimate, was_sent, error,
+              input_tokens, cached_input_tokens, cache_write_tokens,
+              provider, latency_ms, hedged, output_tokens, kind))
+
+        # Keep the running totals in the same transaction
+        if cost_estimate:
+            now = datetime.now()
+            for period in self.spend_periods(now):
+                cursor.execute('''
+                    INSERT INTO spend_counters (period, spend, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT(period) DO UPDATE SET spend = spend + excluded.spend,
+                                                      updated_at = excluded.updated_at
+                ''', (period, cost_estimate, now))
+
+        conn.commit()
+        conn.close()
+
+    def get_cached_responses(self, prompt_version: str, created_after: datetime,
+                             limit: int) -> List[Dict]:
+        """Get the most recently used unexpired cache entries for a prompt version"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT cache_key, response, created_at FROM response_cache
+            WHERE prompt_version = ? AND created_at >= ?
+            ORDER BY last_hit_at DESC
+            LIMIT ?
+        ''', (prompt_version, created_after, limit))
+
+        results = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+
+        return results
+
+    def get_cached_response(self, cache_key: str, created_after: datetime) -> Optional[Dict]:
+        """Get one unexpired cache entry by key"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT cache_key, response, created_at FROM response_cache
+            WHERE cache_key = ? AND created_at >= ?
+        ''', (cache_key, created_after))
+
+        result = cursor.fetchone()
+        conn.close()
+
+        return dict(result) if result else None
+
+    def record_cache_hit(self, cache_key: str):
+        """Bump hit count and recency for a cache entry"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE response_cache
+            SET hits = hits + 1, last_hit_at = ?
+            WHERE cache_key = ?
+        ''', (datetime.now(), cache_key))
+
+        conn.commit()
+        conn.close()
+
+    def store_cached_response(self, cache_key: str, prompt_version: str,
+                              normalized_text: str, response: str,
+                              max_entries: int, created_after: datetime):
+        """Insert or replace a cache entry and evict expired / least recently used rows"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        now = datetime.now()
+
+        cursor.execute('''
+            INSERT OR REPLACE INTO response_cache
+            (cache_key, prompt_version, normalized_text, response, created_at, last_hit_at, hits)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+        ''', (cache_key, prompt_version, normalized_text, response, now, now))
+
+        # Expired entries and entries from older prompt versions
+        cursor.execute('''
+            DELETE FROM response_cache
+            WHERE created_at < ? OR prompt_version != ?
+        ''', (created_after, prompt_version))
+
+        # Least recently used beyond the size limit
+        cursor.execute('''
+            DELETE FROM response_cache
+            WHERE cache_key NOT IN (
+                SELECT cache_key FROM response_cache
+                ORDER BY last_hit_at DESC
+                LIMIT ?
+            )
+        ''', (max_entries,))
 
         conn.commit()
         conn.close()
 
+    @staticmethod
+    def spend_periods(dt: datetime) -> List[str]:
+        """Counter keys that a cost at `dt` is added to"""
+        return [f"day:{dt:%Y-%m-%d}", f"month:{dt:%Y-%m}"]
+
+    def get_spend(self, dt: Optional[datetime] = None) -> Dict[str, float]:
+        """Get AI spend for the day and month of `dt` (primary key lookups)"""
+        dt = dt or datetime.now()
+        day_key, month_key = self.spend_periods(dt)
+
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT period, spend FROM spend_counters WHERE period IN (?, ?)',
+                       (day_key, month_key))
+        rows = dict(cursor.fetchall())
+        conn.close()
+
+        return {"day": rows.get(day_key, 0.0), "month": rows.get(month_key, 0.0)}
+
+    def get_conversation_phones(self, status: Optional[str] = None,
+                                active_since: Optional[datetime] = None) -> List[str]:
+        """Get phone numbers of conversations, optionally by status and recent activity"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        query = 'SELECT phone_number FROM conversations WHERE 1 = 1'
+        params = []
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        if active_since:
+            query += ' AND last_message_at >= ?'
+            params.append(active_since)
+        cursor.execute(query + ' ORDER BY id', params)
+
+        phones = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return phones
+
+    def create_broadcast_job(self, job_id: str, phone_numbers: List[str], template_name: str,
+                             language_code: str = 'tr', components: Optional[list] = None) -> int:
+        """Add recipients to a broadcast job; existing recipients are kept as they are"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        now = datetime.now()
+        components_json = json.dumps(components, ensure_ascii=False) if components else None
+
+        cursor.executemany('''
+            INSERT OR IGNORE INTO broadcast_jobs
+            (job_id, phone_number, template_name, language_code, components, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)
+        ''', [(job_id, phone, template_name, language_code, components_json, now, now)
+              for phone in phone_numbers])
+        added = cursor.rowcount
+
+        conn.commit()
+        conn.close()
+        return added
+
+    def claim_broadcast_recipients(self, job_id: str, limit: int) -> List[Dict]:
+        """
+        Mark up to `limit` pending recipients as 'sending' and return them
+        The claim takes the write lock first, so two runners of the same job
+        never get the same recipient.
+        """
+        conn = self._connect()
+        conn.isolation_level = None
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute('''
+                SELECT phone_number, template_name, language_code, components FROM broadcast_jobs
+                WHERE job_id = ? AND status = 'pending'
+                ORDER BY rowid
+                LIMIT ?
+            ''', (job_id, limit))
+            rows = [dict(row) for row in cursor.fetchall()]
+
+            cursor.executemany('''
+                UPDATE broadcast_jobs SET status = 'sending', attempts = attempts + 1, updated_at = ?
+                WHERE job_id = ? AND phone_number = ? AND status = 'pending'
+            ''', [(datetime.now(), job_id, row['phone_number']) for row in rows])
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        for row in rows:
+            row['components'] = json.loads(row['components']) if row['components'] else None
+        return rows
+
+    def requeue_broadcast_recipients(self, job_id: str, statuses: List[str]) -> int:
+        """Set recipients in the given statuses back to 'pending'; returns how many"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        placeholders = ', '.join('?' for _ in statuses)
+        cursor.execute(f'''
+            UPDATE broadcast_jobs SET status = 'pending', updated_at = ?
+            WHERE job_id = ? AND status IN ({placeholders})
+        ''', (datetime.now(), job_id, *statuses))
+        count = cursor.rowcount
+
+        conn.commit()
+        conn.close()
+        return count
+
+    def update_broadcast_results(self, job_id: str, results: List[tuple]):
+        """Store (phone_number, status, message_id, error) for many recipients in one transaction"""
+        if not results:
+            return
+        conn = self._connect()
+        cursor = conn.cursor()
+        now = datetime.now()
+
+        cursor.executemany('''
+            UPDATE broadcast_jobs SET status = ?, message_id = ?, error = ?, updated_at = ?
+            WHERE job_id = ? AND phone_number = ?
+        ''', [(status, message_id, error, now, job_id, phone)
+              for phone, status, message_id, error in results])
+
+        conn.commit()
+        conn.close()
+
+    def get_broadcast_progress(self, job_id: Optional[str] = None) -> Dict[str, Dict]:
+        """Get recipient counts per status for one or all broadcast jobs"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        query = '''
+            SELECT job_id, template_name, status, COUNT(*), MIN(created_at), MAX(updated_at)
+            FROM broadcast_jobs
+        '''
+        params = ()
+        if job_id:
+            query += ' WHERE job_id = ?'
+            params = (job_id,)
+        cursor.execute(query + ' GROUP BY job_id, template_name, status ORDER BY MIN(created_at)', params)
+
+        jobs: Dict[str, Dict] = {}
+        for job, template, status, count, created_at, updated_at in cursor.fetchall():
+            info = jobs.setdefault(job, {"template": template, "total": 0, "created_at": created_at,
+                                         "updated_at": updated_at, "statuses": {}})
+            info["statuses"][status] = count
+            info["total"] += count
+            info["updated_at"] = max(info["updated_at"] or '', updated_at or '') or None
+        conn.close()
+        return jobs
+
+    # Later states win; callbacks can arrive out of order
+    STATUS_RANKS = {'submitted': 0, 'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+    def record_message_statuses(self, updates: List[Dict]):
+        """
+        Upsert delivery updates in one transaction
+        Each update has message_id, status and at (datetime), optionally
+        provider, recipient, lane and error. The first time seen for each
+        status is kept; the overall status only moves forward.
+        """
+        if not updates:
+            return
+        conn = self._connect()
+        cursor = conn.cursor()
+        now = datetime.now()
+
+        rows = []
+        for update in updates:
+            status = update['status']
+            at = update.get('at') or now
+            rows.append((
+                update['message_id'], update.get('provider'), update.get('recipient'),
+                update.get('lane'), status, self.STATUS_RANKS[status],
+                at if status == 'submitted' else None,
+                at if status == 'sent' else None,
+                at if status == 'delivered' else None,
+                at if status == 'read' else None,
+                at if status == 'failed' else None,
+                update.get('error'), now
+            ))
+
+        cursor.executemany('''
+            INSERT INTO message_status
+            (message_id, provider, recipient, lane, status, status_rank, submitted_at,
+             sent_at, delivered_at, read_at, failed_at, error, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(message_id) DO UPDATE SET
+                provider = COALESCE(message_status.provider, excluded.provider),
+                recipient = COALESCE(message_status.recipient, excluded.recipient),
+                lane = COALESCE(message_status.lane, excluded.lane),
+                status = CASE WHEN excluded.status_rank > message_status.status_rank
+                              THEN excluded.status ELSE message_status.status END,
+                status_rank = MAX(message_status.status_rank, excluded.status_rank),
+                submitted_at = COALESCE(message_status.submitted_at, excluded.submitted_at),
+                sent_at = COALESCE(message_status.sent_at, excluded.sent_at),
+                delivered_at = COALESCE(message_status.delivered_at, excluded.delivered_at),
+                read_at = COALESCE(message_status.read_at, excluded.read_at),
+                failed_at = COALESCE(message_status.failed_at, excluded.failed_at),
+                error = COALESCE(excluded.error, message_status.error),
+                updated_at = excluded.updated_at
+        ''', rows)
+
+        conn.commit()
+        conn.close()
+
+    def get_delivery_rows(self, since: datetime) -> List[Dict]:
+        """Get per-message delivery timings (seconds after submission) since a time"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT provider, lane, status,
+                   (julianday(delivered_at) - julianday(submitted_at)) * 86400 AS delivered_after,
+                   (julianday(read_at) - julianday(submitted_at)) * 86400 AS read_after
+            FROM message_status
+            WHERE submitted_at >= ?
+        ''', (since,))
+
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+
+    def enqueue_outgoing_message(self, phone_number: str, message_text: str, priority: int,
+                                 is_ai: bool = False, idempotency_key: Optional[str] = None,
+                                 pending_id: Optional[int] = None,
+                                 metadata: Optional[Dict] = None,
+                                 trace_id: Optional[str] = None) -> Optional[int]:
+        """
+        Queue an outgoing message in the outbox (the dispatcher sends it)
+        A human message cancels pending AI responses in the same transaction.
+        With pending_id, the pending response is marked 'queued' only if it is
+        still pending. Returns the outbox id (the existing one when the
+        idempotency key was used before), or None if the pending response was
+        already handled elsewhere. metadata is stored with the sent message;
+        trace_id ties the send to the trace of the message it answers.
+        The key check and insert hold the write lock, so concurrent retries
+        with the same key get the same row instead of a constraint error.
+        """
+        conn = self._connect()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        now = datetime.now()
+        idempotency_key = idempotency_key or uuid.uuid4().hex
+
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute('SELECT id FROM outbox WHERE idempotency_key = ?', (idempotency_key,))
+            existing = cursor.fetchone()
+            if existing:
+                cursor.execute('ROLLBACK')
+                return existing[0]
+
+            if pending_id is not None:
+                cursor.execute('''
+                    UPDATE pending_responses SET status = 'queued', processed_at = ?
+                    WHERE id = ? AND status = 'pending'
+                ''', (now, pending_id))
+                if cursor.rowcount == 0:
+                    cursor.execute('ROLLBACK')
+                    return None
+
+            conversation_id = self._get_or_create_conversation(cursor, phone_number)
+            if not is_ai:
+                self._mark_human_responded(cursor, conversation_id)
+
+            cursor.execute('''
+                INSERT INTO outbox
+                (idempotency_key, conversation_id, phone_number, message_text, is_ai, priority,
+                 pending_response_id, status, created_at, next_attempt_at, updated_at, metadata,
+                 trace_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?, ?, ?, ?)
+            ''', (idempotency_key, conversation_id, phone_number, message_text, is_ai, priority,
+                  pending_id, now, now, now, json.dumps(metadata) if metadata else None, trace_id))
+            outbox_id = cursor.lastrowid
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return outbox_id
+
+    def claim_outbox_messages(self, limit: int, lease_seconds: float,
+                              max_attempts: int) -> List[Dict]:
+        """
+        Mark up to `limit` due messages as 'sending' and return them
+        Messages left in 'sending' longer than the lease (the dispatcher died
+        mid-send) are claimed again, so delivery is at-least-once. The claim
+        takes the write lock first, so two dispatchers never get the same row.
+        """
+        conn = self._connect()
+        conn.isolation_level = None
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        now = datetime.now()
+        lease_expired = now - timedelta(seconds=lease_seconds)
+
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # Abandoned sends that used up their attempts are given up on
+            cursor.execute('''
+                UPDATE pending_responses SET status = 'failed', processed_at = ?
+                WHERE id IN (SELECT pending_response_id FROM outbox
+                             WHERE status = 'sending' AND claimed_at <= ? AND attempts >= ?)
+            ''', (now, lease_expired, max_attempts))
+            cursor.execute('''
+                UPDATE outbox SET status = 'failed', error = 'send lease expired', updated_at = ?
+                WHERE status = 'sending' AND claimed_at <= ? AND attempts >= ?
+            ''', (now, lease_expired, max_attempts))
+
+            cursor.execute('''
+                SELECT id, idempotency_key, phone_number, message_text, priority, attempts, created_at,
+                       trace_id
+                FROM outbox
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'sending' AND claimed_at <= ?)
+                ORDER BY priority, id
+                LIMIT ?
+            ''', (now, lease_expired, limit))
+            rows = [dict(row) for row in cursor.fetchall()]
+
+            cursor.executemany('''
+                UPDATE outbox SET status = 'sending', attempts = attempts + 1,
+                                  claimed_at = ?, updated_at = ?
+                WHERE id = ?
+            ''', [(now, now, row['id']) for row in rows])
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        for row in rows:
+            row['attempts'] += 1
+        return rows
+
+    def complete_outbox_messages(self, results: List[tuple], max_attempts: int,
+                                 retry_backoff: float) -> Dict[str, int]:
+        """
+        Store (outbox_id, provider_message_id, error) send results in one transaction
+        A sent message is written to messages together with its outbox row, so
+        it is recorded exactly once even if it was sent twice. Failed messages
+        are retried with exponential backoff until max_attempts.
+        """
+        counts = {"sent": 0, "retry": 0, "failed": 0, "duplicate": 0}
+        if not results:
+            return counts
+        conn = self._connect()
+        conn.isolation_level = None
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        now = datetime.now()
+
+        # The status check and the writes share one write lock, so two
+        # finishers of the same row cannot both record it
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for outbox_id, provider_message_id, error in results:
+                cursor.execute('''
+                    SELECT status, attempts, conversation_id, message_text, is_ai, pending_response_id,
+                           metadata
+                    FROM outbox WHERE id = ?
+                ''', (outbox_id,))
+                row = cursor.fetchone()
+                if row is None or row['status'] != 'sending':
+                    # Another dispatcher already finished this message
+                    counts["duplicate"] += 1
+                    continue
+
+                if provider_message_id:
+                    cursor.execute('''
+                        INSERT OR IGNORE INTO messages
+                        (conversation_id, direction, message_text, message_id, received_at,
+                         is_ai_response, human_response_pending, metadata)
+                        VALUES (?, 'outgoing', ?, ?, ?, ?, 0, ?)
+                    ''', (row['conversation_id'], row['message_text'], provider_message_id, now,
+                          row['is_ai'], row['metadata']))
+                    sent_message_id = cursor.lastrowid if cursor.rowcount == 1 else None
+                    cursor.execute('''
+                        UPDATE outbox SET status = 'sent', provider_message_id = ?, sent_message_id = ?,
+                                          error = NULL, sent_at = ?, updated_at = ?
+                        WHERE id = ?
+                    ''', (provider_message_id, sent_message_id, now, now, outbox_id))
+                    pending_status = 'sent'
+                    counts["sent"] += 1
+                elif row['attempts'] < max_attempts:
+                    next_attempt = now + timedelta(seconds=retry_backoff * 2 ** (row['attempts'] - 1))
+                    cursor.execute('''
+                        UPDATE outbox SET status = 'pending', error = ?, next_attempt_at = ?, updated_at = ?
+                        WHERE id = ?
+                    ''', (error, next_attempt, now, outbox_id))
+                    counts["retry"] += 1
+                    continue
+                else:
+                    cursor.execute('''
+                        UPDATE outbox SET status = 'failed', error = ?, updated_at = ? WHERE id = ?
+                    ''', (error, now, outbox_id))
+                    pending_status = 'failed'
+                    counts["failed"] += 1
+
+                if row['pending_response_id'] is not None:
+                    cursor.execute('''
+                        UPDATE pending_responses SET status = ?, processed_at = ? WHERE id = ?
+                    ''', (pending_status, now, row['pending_response_id']))
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return counts
+
+    def renew_outbox_leases(self, outbox_ids: List[int]) -> int:
+        """
+        Restart the lease of messages this dispatcher still has in flight
+        A message can wait in the rate-limited send queue for minutes after
+        its claim; renewing keeps another dispatcher from claiming it again.
+        """
+        if not outbox_ids:
+            return 0
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        placeholders = ', '.join('?' for _ in outbox_ids)
+        cursor.execute(f'''
+            UPDATE outbox SET claimed_at = ?
+            WHERE status = 'sending' AND id IN ({placeholders})
+        ''', (datetime.now(), *outbox_ids))
+        count = cursor.rowcount
+
+        conn.commit()
+        conn.close()
+        return count
+
+    def get_outbox_message(self, outbox_id: int) -> Optional[Dict]:
+        """Get one outbox row"""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id, idempotency_key, phone_number, is_ai, priority, status, attempts,
+                   provider_message_id, error, created_at, sent_at
+            FROM outbox WHERE id = ?
+        ''', (outbox_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def get_outbox_counts(self) -> Dict[str, int]:
+        """Get outbox message counts per status"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+        counts = dict(cursor.fetchall())
+        conn.close()
+        return counts
+
     def get_statistics(self) -> Dict:
         """Get usage statistics"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         stats = {}
@@ -327,12 +1146,28 @@ class ConversationTracker:
         result = cursor.fetchone()[0]
         stats['total_ai_cost'] = result if result else 0.0
 
+        # Provider prompt cache savings
+        cursor.execute('SELECT SUM(input_tokens), SUM(cached_input_tokens) FROM ai_responses')
+        uncached, cached = cursor.fetchone()
+        uncached, cached = uncached or 0, cached or 0
+        stats['input_tokens'] = uncached
+        stats['cached_input_tokens'] = cached
+        stats['prompt_cache_hit_rate'] = round(cached / (uncached + cached), 4) if uncached + cached else 0.0
+
+        # Running spend for budgets
+        day_key, month_key = self.spend_periods(datetime.now())
+        cursor.execute('SELECT period, spend FROM spend_counters WHERE period IN (?, ?)',
+                       (day_key, month_key))
+        spend = dict(cursor.fetchall())
+        stats['spend_today'] = round(spend.get(day_key, 0.0), 6)
+        stats['spend_this_month'] = round(spend.get(month_key, 0.0), 6)
+
         conn.close()
         return stats
 
     def is_conversation_active(self, phone_number: str) -> bool:
         """Check if conversation has recent activity"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
 
         cursor.execute('''
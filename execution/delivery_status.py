@@ -0,0 +1,219 @@
+"""
+Delivery Status - Track sent/delivered/read/failed receipts for outgoing messages
+Parses provider status callbacks and writes them to message_status in batches
+"""
+
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import config
+from conversation_tracker import ConversationTracker
+from metrics import percentile
+from whatsapp_sender import LANE_NAMES
+
+# Provider status -> our status (anything else is ignored)
+META_STATUSES = {'sent': 'sent', 'delivered': 'delivered', 'read': 'read', 'failed': 'failed'}
+TWILIO_STATUSES = {'sent': 'sent', 'delivered': 'delivered', 'read': 'read',
+                   'failed': 'failed', 'undelivered': 'failed'}
+
+
+def _from_unix(value) -> Optional[datetime]:
+    try:
+        return datetime.fromtimestamp(int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_update(provider: str, raw: Dict) -> Optional[Dict]:
+    """Meta and 360Dialog share the same status object"""
+    status = META_STATUSES.get(raw.get('status'))
+    if not status or not raw.get('id'):
+        return None
+    errors = raw.get('errors') or []
+    error = None
+    if errors:
+        error = f"{errors[0].get('code', '')} {errors[0].get('title', '')}".strip()
+    return {
+        "message_id": raw['id'],
+        "provider": provider,
+        "status": status,
+        "recipient": raw.get('recipient_id'),
+        "at": _from_unix(raw.get('timestamp')) or datetime.now(),
+        "error": error
+    }
+
+
+def parse_meta_statuses(data: Dict) -> List[Dict]:
+    """Status updates from a Meta webhook payload (all entries and changes)"""
+    updates = []
+    for entry in data.get('entry', []) or []:
+        for change in entry.get('changes', []) or []:
+            for raw in change.get('value', {}).get('statuses', []) or []:
+                update = _status_update('meta', raw)
+                if update:
+                    updates.append(update)
+    return updates
+
+
+def parse_360dialog_statuses(data: Dict) -> List[Dict]:
+    """Status updates from a 360Dialog webhook payload"""
+    updates = []
+    for raw in data.get('statuses', []) or []:
+        update = _status_update('360dialog', raw)
+        if update:
+            updates.append(update)
+    return updates
+
+
+def parse_twilio_status(form) -> Optional[Dict]:
+    """Status update from a Twilio status callback (form fields); None if not one"""
+    status = TWILIO_STATUSES.get(form.get('MessageStatus', ''))
+    if not status or not form.get('MessageSid'):
+        return None
+    error_code = form.get('ErrorCode')
+    return {
+        "message_id": form.get('MessageSid'),
+        "provider": 'twilio',
+        "status": status,
+        "recipient": form.get('To', '').replace('whatsapp:', '') or None,
+        # Twilio callbacks carry no event time
+        "at": datetime.now(),
+        "error": f"Twilio error {error_code}" if error_code else None
+    }
+
+
+class StatusRecorder:
+    """
+    Buffers status updates and writes them in one transaction
+    Flushes when `batch_size` updates are waiting or every `flush_interval`
+    seconds from a background thread, so webhook requests never wait on the DB.
+    provider labels submissions (the sending tenant's; default WHATSAPP_API_PROVIDER).
+    """
+
+    def __init__(self, tracker: ConversationTracker,
+                 batch_size: int = config.DELIVERY_STATUS_BATCH_SIZE,
+                 flush_interval: float = config.DELIVERY_STATUS_FLUSH_INTERVAL,
+                 provider: Optional[str] = None):
+        self.tracker = tracker
+        self.provider = provider or config.WHATSAPP_API_PROVIDER
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer: List[Dict] = []
+        self.recorded = 0
+        self.flushes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def record(self, updates: List[Dict]):
+        """Queue status updates for the next flush"""
+        if not updates:
+            return
+        with self._lock:
+            self.buffer.extend(updates)
+            full = len(self.buffer) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='status-recorder', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def record_sent_item(self, item):
+        """OutboundQueue listener: remember when each accepted message was submitted"""
+        if not item.message_id:
+            return
+        self.record([{
+            "message_id": item.message_id,
+            "provider": self.provider,
+            "status": 'submitted',
+            "recipient": item.to_number,
+            "lane": LANE_NAMES[item.priority],
+            "at": datetime.now()
+        }])
+
+    def flush(self):
+        """Write everything buffered so far"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self.buffer = self.buffer, []
+            if not batch:
+                return
+            try:
+                self.tracker.record_message_statuses(batch)
+                self.recorded += len(batch)
+                self.flushes += 1
+            except Exception as e:
+                print(f"❌ Failed to record {len(batch)} status update(s): {e}")
+                with self._lock:
+                    self.buffer[:0] = batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self):
+        """Flush and stop the background thread"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            buffered = len(self.buffer)
+        return {"buffered": buffered, "recorded": self.recorded, "flushes": self.flushes}
+
+
+def delivery_stats(tracker: ConversationTracker, days: int = 7) -> Dict:
+    """
+    Delivery latency percentiles and failure rate per provider
+    Latencies are seconds from our send to the delivered / read receipt.
+    """
+    rows = tracker.get_delivery_rows(datetime.now() - timedelta(days=days))
+    by_provider: Dict[str, Dict] = {}
+    for row in rows:
+        group = by_provider.setdefault(row['provider'] or 'unknown',
+                                       {"statuses": {}, "delivered": [], "read": [], "lanes": {}})
+        group["statuses"][row['status']] = group["statuses"].get(row['status'], 0) + 1
+        lane = row['lane'] or 'unknown'
+        group["lanes"][lane] = group["lanes"].get(lane, 0) + 1
+        # Receipts carry whole-second timestamps while submitted_at has
+        # microseconds, so a sub-second delivery can come out slightly negative
+        if row['delivered_after'] is not None and row['delivered_after'] > -1:
+            group["delivered"].append(max(row['delivered_after'], 0.0))
+        if row['read_after'] is not None and row['read_after'] > -1:
+            group["read"].append(max(row['read_after'], 0.0))
+
+    def latency(values):
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "p99": round(percentile(values, 99), 3),
+        }
+
+    result = {}
+    for provider, group in by_provider.items():
+        total = sum(group["statuses"].values())
+        failed = group["statuses"].get('failed', 0)
+        result[provider] = {
+            "messages": total,
+            "statuses": group["statuses"],
+            "lanes": group["lanes"],
+            "failure_rate": round(failed / total, 4) if total else 0.0,
+            "delivered_latency_seconds": latency(group["delivered"]),
+            "read_latency_seconds": latency(group["read"]),
+        }
+    return {"window_days": days, "providers": result}
+
+
+if __name__ == '__main__':
+    import json
+    tracker = ConversationTracker(config.DATABASE_PATH)
+    print(json.dumps(delivery_stats(tracker), indent=2))
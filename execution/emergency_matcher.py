@@ -0,0 +1,115 @@
+"""
+Emergency Matcher - Detect emergency terms in customer messages
+Compiles the term list into one keyword automaton (one pass per message) and
+rebuilds it when the term file changes, without a restart.
+"""
+
+import os
+import time
+import threading
+from typing import Iterable, List, Optional, Tuple
+import config
+from keyword_matcher import KeywordMatcher
+from text_normalizer import fold_diacritics, normalize_text
+
+
+def normalize_for_matching(text: str) -> str:
+    """Turkish casefolding, punctuation removed, diacritics dropped"""
+    return fold_diacritics(normalize_text(text))
+
+
+def load_emergency_terms(path: str) -> List[str]:
+    """Read terms from a file: one per line, # starts a comment line"""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.lstrip().startswith('#')]
+
+
+class EmergencyMatcher:
+    """
+    Compiled term list
+    Terms match whole words; a trailing * lets a term match as a word prefix.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self.matcher = KeywordMatcher()
+        for term in terms:
+            whole_word = not term.endswith('*')
+            normalized = normalize_for_matching(term.rstrip('*'))
+            if normalized:
+                self.matcher.add(normalized, term, whole_word=whole_word)
+        self.matcher.build()
+        self.size = self.matcher.size
+
+    def find(self, message: str) -> Optional[str]:
+        """Get the first matching term (as written in the list), or None"""
+        text = normalize_for_matching(message or '')
+        for _start, _end, _phrase, term in self.matcher.iter_matches(text):
+            return term
+        return None
+
+
+class EmergencyDetector:
+    """
+    Emergency matcher backed by EMERGENCY_TERMS_FILE
+    The file is checked at most every `reload_interval` seconds and the
+    matcher rebuilt when it changed. A file that fails to load keeps the
+    previous matcher; without a file, EMERGENCY_KEYWORDS are used.
+    """
+
+    def __init__(self, path: str = config.EMERGENCY_TERMS_FILE,
+                 reload_interval: float = config.EMERGENCY_TERMS_RELOAD_INTERVAL,
+                 fallback_terms: Iterable[str] = config.EMERGENCY_KEYWORDS):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.fallback_terms = list(fallback_terms)
+        self.reloads = 0
+        self._signature: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.matcher = EmergencyMatcher(self.fallback_terms)
+        self.reload()
+
+    def _file_signature(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self) -> bool:
+        """Rebuild the matcher if the term file changed; True if it was rebuilt"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = self._file_signature()
+            if signature == self._signature:
+                return False
+            try:
+                terms = load_emergency_terms(self.path) if signature else self.fallback_terms
+                matcher = EmergencyMatcher(terms)
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"❌ Could not load emergency terms from {self.path}: {e}")
+                return False
+            self.matcher = matcher
+            self._signature = signature
+            self.reloads += 1
+        source = self.path if signature else 'EMERGENCY_KEYWORDS'
+        print(f"🚨 Loaded {matcher.size} emergency term(s) from {source}")
+        return True
+
+    def find(self, message: str) -> Optional[str]:
+        """Get the matching emergency term, or None"""
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        return self.matcher.find(message)
+
+    def stats(self) -> dict:
+        return {"terms": self.matcher.size, "file": self.path,
+                "file_loaded": self._signature is not None, "reloads": self.reloads}
+
+
+if __name__ == '__main__':
+    import sys
+    detector = EmergencyDetector()
+    for message in sys.argv[1:] or ["ACİL yardım lazım", "Acilen arar mısınız", "Fiyat bilgisi"]:
+        print(f"{message!r}: {detector.find(message)}")
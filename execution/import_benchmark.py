@@ -0,0 +1,154 @@
+"""
+Import Benchmark - Cold-start time and memory per module
+Imports each module in a fresh interpreter and reports import time, RSS
+growth and which provider SDKs were pulled in. Use --baseline to compare
+against an earlier --json run and spot regressions.
+
+Usage:
+    python execution/import_benchmark.py
+    python execution/import_benchmark.py --repeat 5 --json imports.json
+    python execution/import_benchmark.py --baseline imports.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+from typing import Dict, List, Optional
+
+# Application modules first, then the SDKs on their own for reference
+DEFAULT_MODULES = [
+    'config',
+    'conversation_tracker',
+    'ai_responder',
+    'whatsapp_sender',
+    'background_monitor',
+    'whatsapp_webhook_server',
+    'openai',
+    'anthropic',
+    'twilio.rest',
+]
+
+SDK_MODULES = ['openai', 'anthropic', 'twilio', 'httpx', 'requests']
+
+# Runs in the child interpreter; prints one JSON line
+_PROBE = r'''
+import json, sys, time
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            import os
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak // 1024 if sys.platform == 'darwin' else peak
+        except ImportError:
+            return None
+before = rss_kb()
+started = time.perf_counter()
+import importlib
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - started
+after = rss_kb()
+print(json.dumps({
+    "seconds": seconds,
+    "rss_kb": after,
+    "rss_delta_kb": (after - before) if after is not None and before is not None else None,
+    "sdks": [m for m in json.loads(sys.argv[2]) if m in sys.modules],
+}))
+'''
+
+
+def measure(module: str, repeat: int) -> Dict:
+    """Import `module` in `repeat` fresh interpreters; median of each measurement"""
+    execution_dir = os.path.dirname(os.path.abspath(__file__))
+    project_dir = os.path.dirname(execution_dir)
+    runs = []
+    error = None
+    with tempfile.TemporaryDirectory() as tmp:
+        # Run from a scratch directory so log files and the DB stay out of the project
+        os.makedirs(os.path.join(tmp, 'logs'))
+        env = dict(os.environ,
+                   PYTHONPATH=os.pathsep.join(filter(None, [execution_dir, os.environ.get('PYTHONPATH')])),
+                   PYTHONDONTWRITEBYTECODE='1',
+                   # Importing the webhook server must not start a monitor or touch the real DB
+                   EMBEDDED_MONITOR='false',
+                   DATABASE_PATH=os.path.join(tmp, 'bench.db'),
+                   QUICK_REPLIES_FILE=os.path.join(project_dir, 'quick-replies-reference.txt'))
+        for _ in range(repeat):
+            result = subprocess.run([sys.executable, '-c', _PROBE, module, json.dumps(SDK_MODULES)],
+                                    capture_output=True, text=True, env=env, cwd=tmp)
+            if result.returncode != 0:
+                error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed'
+                break
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    if not runs:
+        return {"module": module, "error": error}
+
+    def median(key):
+        values = [r[key] for r in runs if r[key] is not None]
+        return statistics.median(values) if values else None
+
+    return {
+        "module": module,
+        "seconds": round(median('seconds'), 4),
+        "rss_mb": round(median('rss_kb') / 1024, 1) if median('rss_kb') is not None else None,
+        "rss_delta_mb": round(median('rss_delta_kb') / 1024, 1) if median('rss_delta_kb') is not None else None,
+        "sdks": runs[-1]['sdks'],
+    }
+
+
+def print_results(results: List[Dict], baseline: Optional[Dict[str, Dict]] = None):
+    header = f"{'module':<26}{'import s':>10}{'RSS MB':>9}{'+RSS MB':>9}"
+    if baseline:
+        header += f"{'Δ s':>9}{'Δ MB':>8}"
+    print(header + "  SDKs loaded")
+    print("-" * (len(header) + 14))
+    for r in results:
+        if 'error' in r:
+            print(f"{r['module']:<26}  ❌ {r['error']}")
+            continue
+        line = (f"{r['module']:<26}{r['seconds']:>10.3f}"
+                f"{r['rss_mb'] if r['rss_mb'] is not None else '-':>9}"
+                f"{r['rss_delta_mb'] if r['rss_delta_mb'] is not None else '-':>9}")
+        previous = (baseline or {}).get(r['module'])
+        if baseline:
+            if previous and 'error' not in previous:
+                delta_mb = (r['rss_delta_mb'] or 0) - (previous.get('rss_delta_mb') or 0)
+                line += f"{r['seconds'] - previous['seconds']:>+9.3f}{delta_mb:>+8.1f}"
+            else:
+                line += f"{'new':>9}{'':>8}"
+        print(f"{line}  {', '.join(r['sdks']) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time and memory per module")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help="Modules to import")
+    parser.add_argument('--repeat', type=int, default=3, help="Fresh interpreters per module (median)")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    parser.add_argument('--baseline', help="Compare against a previous --json file")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {r['module']: r for r in json.load(f)}
+
+    print(f"Python {sys.version.split()[0]} - {args.repeat} run(s) per module\n")
+    results = [measure(module, args.repeat) for module in args.modules]
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Keyword Matcher - Aho-Corasick automaton for phrase lookup
+Finds every occurrence of many phrases in one pass over the text
+"""
+
+from collections import deque
+from typing import Any, Iterator, List, Tuple
+
+
+class KeywordMatcher:
+    """
+    Multi-phrase matcher with word-boundary checks
+    Phrases and text should be normalized the same way before matching.
+    A match must start at a word boundary; whole_word phrases must also end
+    at one, otherwise the phrase acts as a prefix ("ücret" matches "ücretler").
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs: List[List[Tuple[str, Any, bool]]] = [[]]
+        self._built = False
+        self.size = 0
+
+    def add(self, phrase: str, payload: Any = None, whole_word: bool = True):
+        """Add a phrase; call build() after the last add"""
+        if not phrase:
+            return
+        state = 0
+        for ch in phrase:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            state = next_state
+        self._outputs[state].append((phrase, payload, whole_word))
+        self.size += 1
+        self._built = False
+
+    def build(self):
+        """Compute failure links (breadth-first)"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+
+        while queue:
+            current = queue.popleft()
+            for ch, next_state in self._goto[current].items():
+                queue.append(next_state)
+                fallback = self._fail[current]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._outputs[next_state] = (self._outputs[next_state] +
+                                             self._outputs[self._fail[next_state]])
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str, Any]]:
+        """Yield (start, end, phrase, payload) for every boundary-respecting match"""
+        if not self._built:
+            self.build()
+
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        state = 0
+        length = len(text)
+        for index, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not outputs[state]:
+                continue
+
+            end = index + 1
+            for phrase, payload, whole_word in outputs[state]:
+                start = end - len(phrase)
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if whole_word and end < length and text[end].isalnum():
+                    continue
+                yield start, end, phrase, payload
+
+    def search(self, text: str) -> bool:
+        """True if any phrase matches"""
+        for _ in self.iter_matches(text):
+            return True
+        return False
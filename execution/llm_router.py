@@ -0,0 +1,338 @@
+"""
+LLM Router - Route AI requests across providers and models
+Tracks rolling latency and errors per route, opens a circuit breaker on
+sustained failures and can hedge slow requests with a second route
+"""
+
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional, Tuple
+import config
+from metrics import RollingStats
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures or an error
+    rate above `error_rate` over the last `window` calls; after
+    `reset_seconds` one trial call is let through (half-open) and its
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = config.AI_CIRCUIT_FAILURES,
+                 error_rate: float = config.AI_CIRCUIT_ERROR_RATE,
+                 window: int = config.AI_CIRCUIT_WINDOW,
+                 reset_seconds: float = config.AI_CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.reset_seconds = reset_seconds
+        self.outcomes = deque(maxlen=window)  # True = failure
+        self.consecutive_failures = 0
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a call may go out now (reserves the half-open trial)"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                self.trial_in_flight = False
+            if self.state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures = 0
+            self.state = 'closed'
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.outcomes.append(True)
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            failures = sum(self.outcomes)
+            rate_tripped = (len(self.outcomes) == self.outcomes.maxlen and
+                            failures / len(self.outcomes) >= self.error_rate)
+            if (self.state == 'half_open' or rate_tripped or
+                    self.consecutive_failures >= self.failure_threshold):
+                if self.state != 'open':
+                    print(f"Circuit opened after {self.consecutive_failures} consecutive failure(s)")
+                self.state = 'open'
+                self.opened_at = time.time()
+
+    def release_trial(self):
+        """The half-open trial ended without an outcome (cancelled); let the next call try"""
+        with self._lock:
+            if self.state == 'half_open':
+                self.trial_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "error_rate": round(sum(self.outcomes) / len(self.outcomes), 4) if self.outcomes else 0.0
+            }
+
+
+class Route:
+    """
+    One provider + model pair with its own health statistics
+    The client comes from client_factory(provider) the first time the route
+    is selected, so a fallback that is never used never loads its SDK.
+    """
+
+    def __init__(self, provider: str, model: str, client_factory: Callable):
+        self.provider = provider
+        self.model = model
+        self.client_factory = client_factory
+        self._client = None
+        self.name = f"{provider}:{model}"
+        self.breaker = CircuitBreaker()
+        self.latency = RollingStats(window=200)
+        self.calls = 0
+        self.errors = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.client_factory(self.provider)
+        return self._client
+
+    def stats(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "latency_seconds": self.latency.summary(),
+            **self.breaker.stats()
+        }
+
+
+class LLMRouter:
+    """
+    Sends each request to the best available route
+    Routes are tried in configured order ('priority') or fastest p50 first
+    ('latency'). A failed call fails over to the next route. With hedging on,
+    a second route is started when the first exceeds its observed p95 and the
+    first successful answer wins.
+    """
+
+    def __init__(self, routes: List[Tuple[str, str]], client_factory: Callable,
+                 mode: str = config.AI_ROUTING, hedge: bool = config.AI_HEDGE_ENABLED):
+        self.routes = [Route(provider, model, client_factory) for provider, model in routes]
+        self.mode = mode
+        self.hedge = hedge and len(self.routes) > 1
+        self._executor = ThreadPoolExecutor(max_workers=max(2, config.LLM_MAX_CONCURRENCY * 2),
+                                            thread_name_prefix='llm-hedge') if self.hedge else None
+
+    @classmethod
+    def from_config(cls, client_factory: Callable) -> 'LLMRouter':
+        routes = [(config.AI_PROVIDER, config.AI_MODEL)]
+        if config.AI_FALLBACK_PROVIDER and config.AI_FALLBACK_MODEL:
+            routes.append((config.AI_FALLBACK_PROVIDER, config.AI_FALLBACK_MODEL))
+        return cls(routes, client_factory)
+
+    def _ordered(self) -> List[Route]:
+        if self.mode == 'latency':
+            # Routes without samples sort first so they get measured
+            return sorted(self.routes, key=lambda r: r.latency.summary()['p50'])
+        return list(self.routes)
+
+    def _next_route(self, exclude) -> Optional[Route]:
+        for route in self._ordered():
+            if route not in exclude and route.breaker.allow():
+                return route
+        return None
+
+    def _hedge_delay(self, route: Route) -> float:
+        summary = route.latency.summary()
+        if summary['window'] >= config.AI_HEDGE_MIN_SAMPLES:
+            return summary['p95']
+        return config.AI_HEDGE_DELAY
+
+    def _record(self, route: Route, started: float, error: Optional[Exception]):
+        elapsed = time.perf_counter() - started
+        route.calls += 1
+        if error is None:
+            route.latency.add(elapsed)
+            route.breaker.record_success()
+        else:
+            route.errors += 1
+            route.breaker.record_failure()
+            print(f"AI route {route.name} failed after {elapsed:.2f}s: {error}")
+        return elapsed
+
+    def _call(self, route: Route, request: Dict) -> Tuple[str, Dict]:
+        started = time.perf_counter()
+        try:
+            text, usage = route.client.complete(route.model, **request)
+        except Exception as e:
+            self._record(route, started, e)
+            raise
+        elapsed = self._record(route, started, None)
+        return text, {**usage, "provider": route.provider, "model": route.model,
+                      "latency_ms": int(elapsed * 1000), "hedged": False}
+
+    async def _acall(self, route: Route, request: Dict) -> Tuple[str, Dict]:
+        started = time.perf_counter()
+        try:
+            text, usage = await route.client.acomplete(route.model, **request)
+        except asyncio.CancelledError:
+            # Lost a hedge race; not a failure of the route, but a cancelled
+            # half-open trial must not keep the circuit from trying again
+            route.breaker.release_trial()
+            raise
+        except Exception as e:
+            self._record(route, started, e)
+            raise
+        elapsed = self._record(route, started, None)
+        return text, {**usage, "provider": route.provider, "model": route.model,
+                      "latency_ms": int(elapsed * 1000), "hedged": False}
+
+    @staticmethod
+    def _report_discarded(future, on_discarded: Callable):
+        """Pass a losing hedge answer to on_discarded once it arrives (it is billed too)"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        text, usage = future.result()
+        try:
+            on_discarded(text, {**usage, "hedged": True})
+        except Exception as e:
+            print(f"Could not record discarded hedge answer: {e}")
+
+    def complete(self, on_discarded: Optional[Callable] = None, **request) -> Tuple[str, Dict]:
+        """
+        Run a completion on the best route; returns (text, usage with provider/model/latency)
+        on_discarded(text, usage) is called for a hedged answer that lost the race.
+        """
+        tried = []
+        last_error: Optional[Exception] = None
+
+        while True:
+            route = self._next_route(tried)
+            if route is None:
+                raise last_error or RuntimeError("All AI routes unavailable (circuits open)")
+            tried.append(route)
+
+            if not self.hedge:
+                try:
+                    return self._call(route, request)
+                except Exception as e:
+                    last_error = e
+                    continue
+
+            future = self._executor.submit(self._call, route, request)
+            done, _ = wait([future], timeout=self._hedge_delay(route))
+            if not done:
+                backup = self._next_route(tried)
+                if backup is not None:
+                    tried.append(backup)
+                    pending = {future, self._executor.submit(self._call, backup, request)}
+                    while pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for finished in done:
+                            if finished.exception() is None:
+                                if on_discarded:
+                                    for loser in (done | pending) - {finished}:
+                                        loser.add_done_callback(
+                                            lambda f: self._report_discarded(f, on_discarded))
+                                text, usage = finished.result()
+                                return text, {**usage, "hedged": True}
+                            last_error = finished.exception()
+                    continue
+            try:
+                return future.result()
+            except Exception as e:
+                last_error = e
+
+    async def acomplete(self, **request) -> Tuple[str, Dict]:
+        """
+        Async version of complete(); the losing hedge request is cancelled
+        (its usage is never returned, so there is nothing to record)
+        """
+        tried = []
+        last_error: Optional[Exception] = None
+
+        while True:
+            route = self._next_route(tried)
+            if route is None:
+                raise last_error or RuntimeError("All AI routes unavailable (circuits open)")
+            tried.append(route)
+
+            if not self.hedge:
+                try:
+                    return await self._acall(route, request)
+                except Exception as e:
+                    last_error = e
+                    continue
+
+            first = asyncio.ensure_future(self._acall(route, request))
+            done, _ = await asyncio.wait({first}, timeout=self._hedge_delay(route))
+            if not done:
+                backup = self._next_route(tried)
+                if backup is not None:
+                    tried.append(backup)
+                    pending = {first, asyncio.ensure_future(self._acall(backup, request))}
+                    while pending:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for finished in done:
+                            if finished.exception() is None:
+                                for loser in pending:
+                                    loser.cancel()
+                                text, usage = finished.result()
+                                return text, {**usage, "hedged": True}
+                            last_error = finished.exception()
+                    continue
+            try:
+                return await first
+            except Exception as e:
+                last_error = e
+
+    def stats(self) -> Dict:
+        """Per-route health, keyed by provider:model"""
+        return {route.name: route.stats() for route in self.routes}
+
+
+def test_cancelled_trial():
+    """A half-open trial cancelled by a lost hedge race must free the circuit"""
+
+    class SlowClient:
+        async def acomplete(self, model, **request):
+            await asyncio.sleep(10)
+
+    router = LLMRouter([('openai', 'slow')], lambda provider: SlowClient(), hedge=False)
+    route = router.routes[0]
+    route.breaker.state = 'open'
+    route.breaker.opened_at = 0.0
+
+    async def cancel_trial():
+        assert route.breaker.allow(), "trial should be allowed after reset_seconds"
+        task = asyncio.ensure_future(router._acall(route, {}))
+        await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancel_trial())
+    stats = route.breaker.stats()
+    allowed = route.breaker.allow()
+    print(f"After cancelled trial: {stats['state']}, allow? {allowed}")
+    assert allowed, "circuit stuck half-open after a cancelled trial"
+    print("✅ Cancelled trial releases the circuit")
+
+
+if __name__ == '__main__':
+    test_cancelled_trial()
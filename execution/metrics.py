@@ -0,0 +1,115 @@
+"""
+Metrics - Lightweight in-process rolling statistics
+Keeps bounded windows of samples and reports percentile summaries
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+
+def percentile(sorted_values, pct: float) -> float:
+    """Nearest-rank percentile over an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+
+class RollingStats:
+    """Bounded window of numeric samples with percentile summaries"""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.times = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, value: float):
+        """Record one sample"""
+        with self._lock:
+            self.samples.append(value)
+            self.times.append(time.time())
+            self.count += 1
+            self.total += value
+
+    def summary(self, max_age: Optional[float] = None) -> Dict:
+        """
+        Get count, mean and p50/p95/p99/max over the current window
+        max_age: only samples recorded in the last max_age seconds
+        """
+        with self._lock:
+            if max_age is None:
+                values = sorted(self.samples)
+            else:
+                cutoff = time.time() - max_age
+                values = sorted(v for t, v in zip(self.times, self.samples) if t >= cutoff)
+            count = self.count
+        if not values:
+            return {"count": count, "window": 0, "mean": 0.0,
+                    "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "count": count,
+            "window": len(values),
+            "mean": round(sum(values) / len(values), 4),
+            "p50": round(percentile(values, 50), 4),
+            "p95": round(percentile(values, 95), 4),
+            "p99": round(percentile(values, 99), 4),
+            "max": round(values[-1], 4),
+        }
+
+
+class MetricsRegistry:
+    """Named rolling stats and counters shared by one component"""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.stats: Dict[str, RollingStats] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float):
+        """Record a sample under a metric name"""
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = RollingStats(self.window)
+        stats.add(value)
+
+    def increment(self, name: str, amount: int = 1):
+        """Increment a named counter"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self, name: str, max_age: Optional[float] = None) -> Optional[Dict]:
+        """Get the summary for one metric, or None if never observed"""
+        stats = self.stats.get(name)
+        return stats.summary(max_age) if stats else None
+
+    def snapshot(self) -> Dict:
+        """Get all summaries and counters"""
+        with self._lock:
+            names = list(self.stats.keys())
+            counters = dict(self.counters)
+        return {
+            "timings": {name: self.stats[name].summary() for name in names},
+            "counters": counters,
+        }
+
+
+class Timer:
+    """Context manager that measures elapsed wall time in seconds"""
+
+    def __init__(self):
+        self.start = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        return False
@@ -0,0 +1,236 @@
+"""
+Outbox - Dispatcher for the transactional outbox of outgoing messages
+Callers write the message to the outbox table together with their own state
+changes; the dispatcher claims due rows in batches, hands them to the send
+queue and records provider message IDs when the sends finish.
+"""
+
+import time
+import socket
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import config
+from conversation_tracker import ConversationTracker
+from metrics import MetricsRegistry
+from whatsapp_sender import WhatsAppSender
+import tracing
+
+
+class OutboxWakeups:
+    """
+    Wakes the outbox dispatchers of another process
+    One process dispatches, so the send rate limits and priority lanes hold
+    across all web workers. A worker that enqueued a message sends the tenant
+    ID as a datagram to OUTBOX_NOTIFY_PORT on localhost; the dispatching
+    process listens there. A lost datagram only delays the message to the
+    next poll.
+    """
+
+    HOST = '127.0.0.1'
+
+    def __init__(self, port: int = config.OUTBOX_NOTIFY_PORT):
+        self.port = port
+        self._socket = None
+        self._listener = None
+
+    def send(self, tenant_id: str):
+        if not self.port:
+            return
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.sendto(tenant_id.encode('utf-8'), (self.HOST, self.port))
+        except OSError:
+            pass
+
+    def listen(self, wake: Callable[[str], None]):
+        """Call wake(tenant_id) for every datagram (in the dispatching process)"""
+        if not self.port or self._listener is not None:
+            return
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            listener.bind((self.HOST, self.port))
+        except OSError as e:
+            listener.close()
+            print(f"⚠️ Outbox wakeups disabled, port {self.port} unavailable: {e}")
+            return
+        self._listener = listener
+
+        def run():
+            while True:
+                try:
+                    data, _ = listener.recvfrom(256)
+                except OSError:
+                    return  # closed
+                wake(data.decode('utf-8', errors='replace'))
+
+        threading.Thread(target=run, name='outbox-wakeups', daemon=True).start()
+
+    def close(self):
+        for sock in (self._socket, self._listener):
+            if sock is not None:
+                sock.close()
+        self._socket = self._listener = None
+
+
+class OutboxDispatcher:
+    """
+    Drains the outbox into the outbound queue
+    Delivery is at-least-once: a row stays 'sending' until its result is
+    written, and is claimed again once its lease expires (e.g. after a crash
+    between the provider call and the write). While a row waits in the send
+    queue its lease is renewed, so only a dead dispatcher's rows are reclaimed.
+    Each row is recorded in messages only once, by its idempotency key.
+    """
+
+    def __init__(self, tracker: ConversationTracker, sender: WhatsAppSender,
+                 batch_size: int = config.OUTBOX_BATCH_SIZE,
+                 poll_interval: float = config.OUTBOX_POLL_INTERVAL,
+                 lease_seconds: float = config.OUTBOX_LEASE_SECONDS,
+                 max_attempts: int = config.OUTBOX_MAX_ATTEMPTS,
+                 retry_backoff: float = config.OUTBOX_RETRY_BACKOFF):
+        self.tracker = tracker
+        self.sender = sender
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.metrics = MetricsRegistry()
+        self.in_flight_ids = set()
+        self._renewed_at = time.monotonic()
+        self.results: List[tuple] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the dispatch loop in a daemon thread (picks up rows left by a previous run)"""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def notify(self):
+        """Dispatch now instead of at the next poll (call after enqueueing)"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.dispatch_once()
+            except Exception as e:
+                print(f"❌ Outbox dispatch error: {e}")
+                self.metrics.increment('errors')
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def dispatch_once(self) -> int:
+        """Write finished sends, then claim and queue due messages; returns how many were queued"""
+        self.flush()
+        self._renew_leases()
+        with self._lock:
+            capacity = self.batch_size - len(self.in_flight_ids)
+        if capacity <= 0 or self._stopped.is_set():
+            return 0
+
+        rows = self.tracker.claim_outbox_messages(capacity, self.lease_seconds, self.max_attempts)
+        if not rows:
+            return 0
+        claimed_at = time.time()
+        with self._lock:
+            self.in_flight_ids.update(row['id'] for row in rows)
+
+        for row in rows:
+            if row['attempts'] > 1:
+                self.metrics.increment('retries')
+            created_at = datetime.fromisoformat(str(row['created_at']))
+            tracing.record('outbox.wait', row['trace_id'], created_at.timestamp(), claimed_at,
+                           outbox_id=row['id'], attempt=row['attempts'])
+            try:
+                self.sender.outbound.submit(row['phone_number'], row['message_text'],
+                                            priority=row['priority'],
+                                            callback=self._on_done(row, claimed_at))
+            except Exception as e:
+                self._finish(row['id'], None, f"could not queue: {e}")
+        return len(rows)
+
+    def _renew_leases(self):
+        """Renew the leases of queued rows well before they can expire"""
+        if time.monotonic() - self._renewed_at < self.lease_seconds / 3:
+            return
+        self._renewed_at = time.monotonic()
+        with self._lock:
+            outbox_ids = list(self.in_flight_ids)
+        try:
+            self.tracker.renew_outbox_leases(outbox_ids)
+        except Exception as e:
+            print(f"❌ Failed to renew {len(outbox_ids)} outbox lease(s): {e}")
+
+    def _on_done(self, row: Dict, claimed_at: float):
+        def callback(item):
+            created_at = datetime.fromisoformat(str(row['created_at']))
+            if item.message_id:
+                self.metrics.observe('enqueue_to_sent_seconds',
+                                     (datetime.now() - created_at).total_seconds())
+            # Queue, rate limit and provider call of this attempt
+            tracing.record('outbox.send', row['trace_id'], claimed_at, time.time(),
+                           error=None if item.message_id else 'send failed',
+                           outbox_id=row['id'], attempt=row['attempts'],
+                           provider_message_id=item.message_id)
+            self._finish(row['id'], item.message_id, None if item.message_id else 'send failed')
+        return callback
+
+    def _finish(self, outbox_id: int, provider_message_id: Optional[str], error: Optional[str]):
+        with self._lock:
+            self.results.append((outbox_id, provider_message_id, error))
+            self.in_flight_ids.discard(outbox_id)
+        # Results are written from the dispatcher thread, in batches
+        self._wakeup.set()
+
+    def flush(self):
+        """Write finished sends in one transaction"""
+        with self._lock:
+            batch, self.results = self.results, []
+        if not batch:
+            return
+        try:
+            counts = self.tracker.complete_outbox_messages(batch, self.max_attempts, self.retry_backoff)
+        except Exception as e:
+            print(f"❌ Failed to record {len(batch)} outbox result(s): {e}")
+            with self._lock:
+                self.results[:0] = batch
+            return
+        for outcome, count in counts.items():
+            if count:
+                self.metrics.increment(f'outcome.{outcome}', count)
+
+    def stop(self, timeout: float = 10):
+        """Stop claiming, wait up to `timeout` seconds for in-flight sends and write their results"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self.in_flight_ids:
+                    break
+            self._wakeup.wait(0.1)
+            self._wakeup.clear()
+        self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            in_flight = len(self.in_flight_ids)
+            unwritten = len(self.results)
+        return {
+            "in_flight": in_flight,
+            "unwritten_results": unwritten,
+            "statuses": self.tracker.get_outbox_counts(),
+            **self.metrics.snapshot()
+        }
@@ -0,0 +1,65 @@
+"""
+Pricing - Per-model AI token prices and cost calculation
+Prices are USD per 1M tokens; update when providers change them
+"""
+
+from typing import Dict, Tuple
+
+# model prefix -> (input, output, cached input, cache write)
+# Longest matching prefix wins, so "gpt-4o-mini" is checked before "gpt-4o".
+MODEL_PRICES: Dict[str, Tuple[float, float, float, float]] = {
+    # OpenAI (cached input is billed at a discount, no write surcharge)
+    'gpt-4o-mini': (0.15, 0.60, 0.075, 0.15),
+    'gpt-4o': (2.50, 10.00, 1.25, 2.50),
+    'gpt-4.1-nano': (0.10, 0.40, 0.025, 0.10),
+    'gpt-4.1-mini': (0.40, 1.60, 0.10, 0.40),
+    'gpt-4.1': (2.00, 8.00, 0.50, 2.00),
+    'gpt-4-turbo': (10.00, 30.00, 10.00, 10.00),
+    'gpt-4': (30.00, 60.00, 30.00, 30.00),
+    'gpt-3.5-turbo': (0.50, 1.50, 0.50, 0.50),
+    # Anthropic (cache reads 0.1x input, cache writes 1.25x input)
+    'claude-3-haiku': (0.25, 1.25, 0.03, 0.30),
+    'claude-3-5-haiku': (0.80, 4.00, 0.08, 1.00),
+    'claude-haiku-4': (1.00, 5.00, 0.10, 1.25),
+    'claude-3-sonnet': (3.00, 15.00, 0.30, 3.75),
+    'claude-3-5-sonnet': (3.00, 15.00, 0.30, 3.75),
+    'claude-3-7-sonnet': (3.00, 15.00, 0.30, 3.75),
+    'claude-sonnet-4': (3.00, 15.00, 0.30, 3.75),
+    'claude-3-opus': (15.00, 75.00, 1.50, 18.75),
+    'claude-opus-4': (15.00, 75.00, 1.50, 18.75),
+}
+
+# Unknown models are charged at a deliberately high rate so budgets stay safe
+DEFAULT_PRICE = (3.00, 15.00, 3.00, 3.75)
+
+# Local answers (quick replies, response cache) cost nothing
+FREE_MODELS = {'local-quickreply', 'response-cache'}
+
+_PREFIXES = sorted(MODEL_PRICES, key=len, reverse=True)
+
+
+def get_price(model: str) -> Tuple[float, float, float, float]:
+    """Get (input, output, cached input, cache write) USD per 1M tokens"""
+    if not model:
+        return DEFAULT_PRICE
+    for prefix in _PREFIXES:
+        if model.startswith(prefix):
+            return MODEL_PRICES[prefix]
+    return DEFAULT_PRICE
+
+
+def estimate_cost(model: str, input_tokens: int = 0, output_tokens: int = 0,
+                  cached_input_tokens: int = 0, cache_write_tokens: int = 0) -> float:
+    """
+    Cost in USD for one call
+    input_tokens is all uncached input; cache_write_tokens is the part of it
+    that was written to the provider's prompt cache.
+    """
+    if model in FREE_MODELS:
+        return 0.0
+    input_rate, output_rate, cached_rate, write_rate = get_price(model)
+    plain_input = max(input_tokens - cache_write_tokens, 0)
+    return (plain_input * input_rate +
+            cache_write_tokens * write_rate +
+            cached_input_tokens * cached_rate +
+            output_tokens * output_rate) / 1_000_000
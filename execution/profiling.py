@@ -0,0 +1,245 @@
+"""
+Profiling - Opt-in sampling profiler for webhook requests and monitor cycles
+Profiles a fraction of requests/cycles with cProfile (pstats files) or a stack
+sampler (collapsed stacks for flame graphs) into PROFILE_DIR, keeping the
+newest PROFILE_MAX_FILES. Costs one attribute check when disabled.
+"""
+
+import os
+import sys
+import time
+import hmac
+import random
+import logging
+import threading
+import contextlib
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+import runtime_config
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sampler')
+
+# One profile at a time per process: bounds the overhead, and cProfile
+# cannot run in two threads at once on newer Pythons
+_active = threading.Lock()
+_retention_lock = threading.Lock()
+
+_DISABLED = contextlib.nullcontext()
+
+
+def sampler_available() -> bool:
+    """The stack sampler reads other threads' frames (CPython only)"""
+    return hasattr(sys, '_current_frames')
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every `interval` seconds
+    Stacks are counted as 'outer;...;inner' lines, the collapsed format
+    flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileSession:
+    """One profiled request or cycle; written on exit if it took at least PROFILE_MIN_MS"""
+
+    def __init__(self, profiler: 'Profiler', mode: str, label: str):
+        self.profiler = profiler
+        self.mode = mode
+        self.label = label
+        self._backend = None
+        self._started = 0.0
+
+    def __enter__(self):
+        try:
+            if self.mode == 'sampler':
+                self._backend = StackSampler(threading.get_ident(),
+                                             runtime_config.current().PROFILE_SAMPLE_INTERVAL_MS / 1000)
+                self._backend.start()
+            else:
+                import cProfile
+                self._backend = cProfile.Profile()
+                self._backend.enable()
+        except Exception:
+            _active.release()
+            raise
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        try:
+            if self.mode == 'sampler':
+                self._backend.stop()
+            else:
+                self._backend.disable()
+            self.profiler.finish(self, elapsed)
+        finally:
+            _active.release()
+        return False
+
+
+class Profiler:
+    """
+    Decides which requests/cycles of one kind ('webhook', 'monitor') get profiled
+    The sample rate and mode come from PROFILE_SAMPLE_RATE / PROFILE_MODE
+    (reloaded with the config) unless set at runtime via set_rate().
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.override: Optional[float] = None
+        self.mode_override: Optional[str] = None
+        self.rate = 0.0
+        self.mode = 'cprofile'
+        self.profiles = 0
+        self.skipped_busy = 0
+        self.errors = 0
+        self.last_file: Optional[str] = None
+        self._apply(runtime_config.current())
+        runtime_config.add_listener(lambda old, new, changed: self._apply(new))
+
+    def _apply(self, settings):
+        mode = self.mode_override or settings.PROFILE_MODE
+        if mode == 'sampler' and not sampler_available():
+            mode = 'cprofile'
+        self.mode = mode
+        self.rate = self.override if self.override is not None else settings.PROFILE_SAMPLE_RATE
+
+    def set_rate(self, rate: Optional[float], mode: Optional[str] = None):
+        """Override the configured rate and mode (None returns to the config)"""
+        if rate is not None and not 0 <= rate <= 1:
+            raise ValueError("rate must be between 0 and 1")
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        self.override = rate
+        self.mode_override = mode
+        self._apply(runtime_config.current())
+
+    def session(self, label: str = '', force: bool = False):
+        """
+        Context manager profiling the enclosed code when sampled
+        force profiles regardless of the rate (admin header). Returns a shared
+        no-op context when not sampled or another profile is running.
+        """
+        if not force and (not self.rate or random.random() >= self.rate):
+            return _DISABLED
+        if not _active.acquire(blocking=False):
+            self.skipped_busy += 1
+            return _DISABLED
+        return ProfileSession(self, self.mode, label)
+
+    def finish(self, session: ProfileSession, elapsed: float):
+        settings = runtime_config.current()
+        if elapsed * 1000 < settings.PROFILE_MIN_MS:
+            return
+        directory = settings.PROFILE_DIR
+        label = ''.join(c if c.isalnum() or c in '-_' else '-' for c in session.label)[:40]
+        name = (f"{self.kind}{'-' + label if label else ''}-{datetime.now():%Y%m%d-%H%M%S-%f}"
+                f"-{os.getpid()}-{int(elapsed * 1000)}ms")
+        path = os.path.join(directory, f"{name}.collapsed" if session.mode == 'sampler' else f"{name}.prof")
+        # A full disk or unwritable PROFILE_DIR must not fail the profiled request
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if session.mode == 'sampler':
+                session._backend.write(path)
+            else:
+                session._backend.dump_stats(path)
+        except OSError as e:
+            self.errors += 1
+            logger.error(f"❌ Could not write profile {path}: {e}")
+            return
+        self.profiles += 1
+        self.last_file = path
+        logger.info(f"🔬 Profile written: {path}")
+        enforce_retention(directory, settings.PROFILE_MAX_FILES)
+
+    def stats(self) -> Dict:
+        return {
+            "rate": self.rate,
+            "mode": self.mode,
+            "overridden": self.override is not None,
+            "profiles": self.profiles,
+            "skipped_busy": self.skipped_busy,
+            "errors": self.errors,
+            "last_file": self.last_file,
+        }
+
+
+def list_profiles(directory: Optional[str] = None) -> List[str]:
+    """Profile files, oldest first"""
+    directory = directory or runtime_config.current().PROFILE_DIR
+    try:
+        names = [n for n in os.listdir(directory) if n.endswith(('.prof', '.collapsed'))]
+    except OSError:
+        return []
+    paths = [os.path.join(directory, n) for n in names]
+    return sorted(paths, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+
+
+def enforce_retention(directory: str, max_files: int):
+    """Delete the oldest profiles beyond max_files"""
+    with _retention_lock:
+        paths = list_profiles(directory)
+        for path in paths[:max(len(paths) - max_files, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def check_admin_token(token: Optional[str]) -> bool:
+    """True if token matches PROFILE_ADMIN_TOKEN (never when no token is configured)"""
+    expected = runtime_config.current().PROFILE_ADMIN_TOKEN
+    # Compared as bytes: compare_digest raises TypeError on non-ASCII str
+    return bool(expected) and bool(token) and hmac.compare_digest(token.encode('utf-8'),
+                                                                  expected.encode('utf-8'))
+
+
+webhook_profiler = Profiler('webhook')
+monitor_profiler = Profiler('monitor')
+PROFILERS = {'webhook': webhook_profiler, 'monitor': monitor_profiler}
+
+
+if __name__ == '__main__':
+    # Summarize the newest pstats profile (or the one given)
+    import pstats
+    paths = sys.argv[1:] or [p for p in list_profiles() if p.endswith('.prof')][-1:]
+    if not paths:
+        print("No profiles found")
+    for path in paths:
+        print(f"\n{path}")
+        pstats.Stats(path).sort_stats('cumulative').print_stats(25)
@@ -0,0 +1,65 @@
+"""
+Providers - Registry of AI and WhatsApp provider SDKs
+SDKs are imported on first use, so a process only loads the ones it is configured for
+"""
+
+import time
+import importlib
+import threading
+from typing import Dict, Optional, Tuple
+
+# provider -> (module, sync client class, async client class, pip package)
+AI_PROVIDERS: Dict[str, Tuple[str, str, str, str]] = {
+    'openai': ('openai', 'OpenAI', 'AsyncOpenAI', 'openai'),
+    'anthropic': ('anthropic', 'Anthropic', 'AsyncAnthropic', 'anthropic'),
+}
+
+# provider -> (module, client class, pip package); None = plain HTTPS via requests
+WHATSAPP_PROVIDERS: Dict[str, Optional[Tuple[str, str, str]]] = {
+    'twilio': ('twilio.rest', 'Client', 'twilio'),
+    'meta': None,
+    '360dialog': None,
+}
+
+_import_seconds: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def load_sdk(module_name: str, package: Optional[str] = None):
+    """Import an SDK module once, recording how long the first import took"""
+    with _lock:
+        if module_name not in _import_seconds:
+            started = time.perf_counter()
+            try:
+                importlib.import_module(module_name)
+            except ImportError as e:
+                raise ImportError(f"Provider SDK '{module_name}' is not installed "
+                                  f"(pip install {package or module_name})") from e
+            _import_seconds[module_name] = round(time.perf_counter() - started, 4)
+    return importlib.import_module(module_name)
+
+
+def ai_client_classes(provider: str) -> Tuple[type, type]:
+    """Get (sync client class, async client class) for an AI provider"""
+    if provider not in AI_PROVIDERS:
+        raise ValueError(f"Unsupported AI provider: {provider}")
+    module_name, sync_name, async_name, package = AI_PROVIDERS[provider]
+    module = load_sdk(module_name, package)
+    return getattr(module, sync_name), getattr(module, async_name)
+
+
+def whatsapp_client_class(provider: str) -> Optional[type]:
+    """Get the SDK client class for a WhatsApp provider, or None if it needs no SDK"""
+    if provider not in WHATSAPP_PROVIDERS:
+        raise ValueError(f"Unsupported WhatsApp provider: {provider}")
+    entry = WHATSAPP_PROVIDERS[provider]
+    if entry is None:
+        return None
+    module_name, class_name, package = entry
+    return getattr(load_sdk(module_name, package), class_name)
+
+
+def loaded_sdks() -> Dict[str, float]:
+    """SDK modules loaded so far, with first-import time in seconds"""
+    with _lock:
+        return dict(_import_seconds)
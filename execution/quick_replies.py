@@ -0,0 +1,169 @@
+"""
+Quick Replies - Answer common questions locally without calling the LLM
+Compiles quick-replies-reference.txt into a keyword index at startup
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+import config
+from keyword_matcher import KeywordMatcher
+from text_normalizer import normalize_text
+
+# "1. RANDEVU ALMA - Shortcut: /randevu"
+_SECTION_RE = re.compile(r'^\d+\.\s+(?P<title>.+?)\s+-\s+Shortcut:\s+/(?P<shortcut>\w+)\s*$')
+_RULE_CHARS = set('─═')
+
+# Words that carry no intent; ignored when measuring how much of a message matched
+FILLER_WORDS = {
+    'merhaba', 'merhabalar', 'selam', 'selamlar', 'iyi', 'günler', 'akşamlar',
+    'hocam', 'hanım', 'bey', 'lütfen', 'acaba', 'rica', 'ederim', 'ederiz',
+    'bilgi', 'almak', 'istiyorum', 'istiyoruz', 'isterim', 'öğrenebilir', 'miyim',
+    'mi', 'mı', 'mu', 'mü', 'misiniz', 'mısınız', 'musunuz', 'müsünüz',
+    'var', 'mıdır', 'midir', 'nedir', 'ne', 'bir', 've', 'ile', 'için', 'de', 'da',
+    'sizin', 'sizde', 'sizden', 'yapıyor', 'veriyor', 'hakkında', 'bana', 'bize'
+}
+
+
+def load_quick_replies(path: str) -> Dict[str, Dict]:
+    """
+    Parse the quick replies reference card
+    Returns {shortcut: {"title": ..., "text": ...}} for each numbered section
+    """
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    replies = {}
+    current = None
+    body: List[str] = []
+
+    def finish():
+        if current:
+            replies[current['shortcut']] = {
+                'title': current['title'],
+                'text': '\n'.join(body).strip()
+            }
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped and set(stripped) <= _RULE_CHARS:
+            # Section rules both open and close a header; only the first
+            # rule after a body ends the section
+            if current and any(l.strip() for l in body):
+                finish()
+                current = None
+                body = []
+            continue
+
+        match = _SECTION_RE.match(stripped)
+        if match:
+            current = match.groupdict()
+            body = []
+        elif current is not None:
+            body.append(line.rstrip())
+
+    finish()
+    return replies
+
+
+def prompt_reference(path: str) -> str:
+    """
+    The quick replies as a system prompt section, so AI answers agree with them
+    Empty when path is empty or missing.
+    """
+    if not path or not os.path.exists(path):
+        return ''
+    replies = load_quick_replies(path)
+    if not replies:
+        return ''
+    sections = '\n\n'.join(f"[{reply['title']}]\n{reply['text']}" for reply in replies.values())
+    return ("HAZIR YANITLAR (kliniğin standart cevapları; bu konulardaki sorularda "
+            f"bunlarla tutarlı yanıt ver):\n\n{sections}")
+
+
+class QuickReplyMatcher:
+    """
+    Maps a customer message to a quick reply
+    Confidence is the share of meaningful words covered by the best intent's
+    keywords, halved when another intent also matches.
+    """
+
+    def __init__(self, replies: Dict[str, Dict], keywords: Dict[str, List[str]],
+                 footer: str = ''):
+        self.replies = replies
+        self.footer = footer
+        self.matcher = KeywordMatcher()
+        for shortcut, phrases in keywords.items():
+            if shortcut not in replies:
+                continue
+            # The shortcut itself ("/ucret" normalizes to "ucret")
+            self.matcher.add(shortcut, shortcut)
+            for phrase in phrases:
+                # Trailing * makes the phrase a prefix ("ücret*" matches "ücretler")
+                whole_word = not phrase.endswith('*')
+                normalized = normalize_text(phrase.rstrip('*'))
+                if normalized:
+                    self.matcher.add(normalized, shortcut, whole_word=whole_word)
+        self.matcher.build()
+
+    @classmethod
+    def from_config(cls, settings=None) -> Optional['QuickReplyMatcher']:
+        """Build from QUICK_REPLIES_FILE (of `settings`, default config), or None if the file is missing"""
+        settings = settings or config
+        if not os.path.exists(settings.QUICK_REPLIES_FILE):
+            print(f"Quick replies file not found: {settings.QUICK_REPLIES_FILE}")
+            return None
+        replies = load_quick_replies(settings.QUICK_REPLIES_FILE)
+        return cls(replies, settings.QUICK_REPLY_KEYWORDS, footer=settings.QUICK_REPLY_FOOTER)
+
+    def classify(self, message_text: str) -> Tuple[Optional[str], float]:
+        """Get (shortcut, confidence) for the best matching intent"""
+        text = normalize_text(message_text)
+        if not text:
+            return None, 0.0
+
+        # Word spans, so prefix matches cover the whole inflected word
+        words = [(m.start(), m.end(), m.group()) for m in re.finditer(r'\S+', text)]
+        meaningful = {i for i, w in enumerate(words) if w[2] not in FILLER_WORDS}
+        if not meaningful:
+            return None, 0.0
+
+        covered: Dict[str, set] = {}
+        for start, end, _phrase, shortcut in self.matcher.iter_matches(text):
+            spans = covered.setdefault(shortcut, set())
+            for index, (w_start, w_end, _word) in enumerate(words):
+                if w_start < end and start < w_end:
+                    spans.add(index)
+
+        if not covered:
+            return None, 0.0
+
+        scores = {
+            shortcut: len(indexes & meaningful) / len(meaningful)
+            for shortcut, indexes in covered.items()
+        }
+        best = max(scores, key=scores.get)
+        confidence = scores[best]
+        if len(scores) > 1:
+            confidence /= 2
+        return best, round(confidence, 4)
+
+    def match(self, message_text: str, threshold: float) -> Optional[Tuple[str, str, float]]:
+        """Get (shortcut, reply_text, confidence) if confidence reaches the threshold"""
+        shortcut, confidence = self.classify(message_text)
+        if shortcut is None or confidence < threshold:
+            return None
+        text = self.replies[shortcut]['text']
+        if self.footer:
+            text = f"{text}\n\n{self.footer}"
+        return shortcut, text, confidence
+
+
+if __name__ == '__main__':
+    matcher = QuickReplyMatcher.from_config()
+    if matcher:
+        print(f"Loaded {len(matcher.replies)} quick replies, {matcher.matcher.size} phrases")
+        for msg in ["Merhaba, randevu almak istiyorum", "Ücretler ne kadar?",
+                    "Adresiniz neresi?", "Çocuğum 3 yaşında ve henüz konuşmuyor",
+                    "Online terapi var mı?", "Teşekkür ederim"]:
+            print(f"{msg!r} -> {matcher.classify(msg)}")
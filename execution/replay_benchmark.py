@@ -0,0 +1,384 @@
+"""
+Replay Benchmark - Measure the AI reply pipeline offline
+Replays recorded (or synthetic) conversations through
+AIResponder.generate_response against a deterministic stub LLM and reports
+per-stage latency, tokens per reply, cache hit rates and DB queries per reply.
+No network access and no API spend.
+
+Usage:
+    python execution/replay_benchmark.py --synthetic 200
+    python execution/replay_benchmark.py --db data/conversations.db --json bench.json
+    python execution/replay_benchmark.py --fixture conversations.jsonl --latency-ms 800
+
+Fixture format (JSONL, one message per line, in order):
+    {"conversation": "+905551112233", "direction": "incoming", "text": "Merhaba"}
+    {"conversation": "+905551112233", "direction": "outgoing", "text": "...", "is_ai": false}
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, List, Optional
+import config
+from conversation_tracker import ConversationTracker
+from context_builder import estimate_tokens
+from metrics import RollingStats
+
+# Typical first questions and follow-ups for synthetic conversations
+SYNTHETIC_OPENERS = [
+    "Merhaba, randevu almak istiyorum",
+    "Ücretler ne kadar?",
+    "Adresiniz neresi?",
+    "Çocuğum 3 yaşında ve henüz konuşmuyor",
+    "Kekemelik tedavisi yapıyor musunuz?",
+    "Online terapi var mı?",
+    "Oğlum bazı sesleri çıkaramıyor, ne yapmalıyız?",
+    "Hafta içi randevu verebiliyor musunuz?",
+    "Sesim sürekli kısılıyor, bu konuda destek alabilir miyim?",
+    "Otizm tanılı kızım için dil terapisi almak istiyoruz",
+]
+SYNTHETIC_FOLLOW_UPS = [
+    "Teşekkür ederim",
+    "Cumartesi sabah uygun mu?",
+    "Seanslar kaç dakika sürüyor?",
+    "Kaç seans gerekir genelde?",
+    "Adım Ayşe, oğlum 5 yaşında",
+    "Tamam, dönüşünüzü bekliyorum",
+]
+
+# Filler used to give stub replies a realistic length
+_STUB_SENTENCE = ("Mesajınız için teşekkür ederiz, size en kısa sürede detaylı bilgi "
+                  "vereceğiz. ")
+
+
+class StubLLMClient:
+    """
+    Deterministic stand-in for LLMClient
+    Latency is drawn from a seeded normal distribution; token counts are
+    estimated from the request so context changes show up in the numbers.
+    Simulates provider prompt caching of the system prompt.
+    """
+
+    def __init__(self, provider: str, latency_ms: float = 50, jitter_ms: float = 0,
+                 output_tokens: int = 120, seed: int = 42, min_cache_tokens: int = 1024):
+        self.provider = provider
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.output_tokens = output_tokens
+        self.min_cache_tokens = min_cache_tokens
+        self.random = random.Random(f"{seed}:{provider}")
+        self.cached_prefixes = set()
+        self.calls = 0
+
+    def _delay(self) -> float:
+        delay = self.random.gauss(self.latency_ms, self.jitter_ms) if self.jitter_ms else self.latency_ms
+        return max(delay, 0) / 1000
+
+    def _respond(self, model: str, system: str, messages: List[Dict], extra_system: Optional[str],
+                 max_tokens: int, cache_system: bool):
+        self.calls += 1
+        system_tokens = estimate_tokens(system)
+        other_tokens = (estimate_tokens(extra_system or '') +
+                        sum(estimate_tokens(m['content']) + 4 for m in messages))
+
+        cacheable = cache_system and system_tokens >= self.min_cache_tokens
+        cached = system_tokens if cacheable and system in self.cached_prefixes else 0
+        written = 0
+        if cacheable and not cached:
+            self.cached_prefixes.add(system)
+            written = system_tokens if self.provider == 'anthropic' else 0
+
+        output = min(self.output_tokens, max_tokens)
+        last = messages[-1]['content'] if messages else ''
+        text = f"[{model}] {last[:40]}\n" + _STUB_SENTENCE * max(1, int(output * 3.5 / len(_STUB_SENTENCE)))
+        input_tokens = system_tokens - cached + other_tokens
+        return text, {
+            "total_tokens": input_tokens + cached + output,
+            "input_tokens": input_tokens,
+            "cached_input_tokens": cached,
+            "cache_write_tokens": written,
+            "output_tokens": output
+        }
+
+    def complete(self, model, system, messages, extra_system=None, max_tokens=500,
+                 temperature=0.7, cache_system=True):
+        time.sleep(self._delay())
+        return self._respond(model, system, messages, extra_system, max_tokens, cache_system)
+
+    async def acomplete(self, model, system, messages, extra_system=None, max_tokens=500,
+                        temperature=0.7, cache_system=True):
+        await asyncio.sleep(self._delay())
+        return self._respond(model, system, messages, extra_system, max_tokens, cache_system)
+
+
+class CountingTracker(ConversationTracker):
+    """ConversationTracker that counts connections and SQL statements"""
+
+    def __init__(self, db_path):
+        self.queries = 0
+        self.connections = 0
+        super().__init__(db_path)
+
+    def _trace(self, statement: str):
+        if statement.split(None, 1)[0].upper() not in ('BEGIN', 'COMMIT', 'ROLLBACK'):
+            self.queries += 1
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.set_trace_callback(self._trace)
+        self.connections += 1
+        return conn
+
+
+# ==================== INPUT ====================
+
+def load_fixture(path: str) -> List[Dict]:
+    """Load messages from a JSONL fixture"""
+    messages = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                row = json.loads(line)
+                messages.append({
+                    "conversation": str(row['conversation']),
+                    "direction": row.get('direction', 'incoming'),
+                    "text": row['text'],
+                    "is_ai": bool(row.get('is_ai', False))
+                })
+    return messages
+
+
+def load_tracker_db(path: str, limit: Optional[int] = None) -> List[Dict]:
+    """Load messages from a tracker database (opened read-only)"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    cursor = conn.cursor()
+    query = '''
+        SELECT c.phone_number, m.direction, m.message_text, m.is_ai_response
+        FROM messages m JOIN conversations c ON m.conversation_id = c.id
+        WHERE m.message_text IS NOT NULL
+        ORDER BY m.id
+    '''
+    if limit:
+        query += f' LIMIT {int(limit)}'
+    cursor.execute(query)
+    messages = [{"conversation": phone, "direction": direction, "text": text, "is_ai": bool(is_ai)}
+                for phone, direction, text, is_ai in cursor.fetchall()]
+    conn.close()
+    return messages
+
+
+def synthetic_conversations(count: int, seed: int = 42) -> List[Dict]:
+    """Generate `count` conversations of 1-4 customer messages each"""
+    rng = random.Random(seed)
+    messages = []
+    for index in range(count):
+        phone = f"+90555{index:07d}"
+        messages.append({"conversation": phone, "direction": "incoming",
+                         "text": rng.choice(SYNTHETIC_OPENERS), "is_ai": False})
+        for _ in range(rng.randint(0, 3)):
+            messages.append({"conversation": phone, "direction": "incoming",
+                             "text": rng.choice(SYNTHETIC_FOLLOW_UPS), "is_ai": False})
+    return messages
+
+
+# ==================== REPLAY ====================
+
+def _instrument(obj, name: str, stage: str, timings: Dict[str, RollingStats]):
+    """Wrap obj.name so each call's wall time is recorded under `stage` (ms)"""
+    original = getattr(obj, name)
+    stats = timings.setdefault(stage, RollingStats(window=1_000_000))
+
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            stats.add((time.perf_counter() - started) * 1000)
+
+    setattr(obj, name, wrapper)
+
+
+def run_replay(messages: List[Dict], stub_options: Dict, db_path: str) -> Dict:
+    """Replay messages through a fresh tracker and AIResponder; returns the report"""
+    from ai_responder import AIResponder
+
+    tracker = CountingTracker(db_path)
+    stubs = {}
+
+    def client_factory(provider):
+        if provider not in stubs:
+            stubs[provider] = StubLLMClient(provider, **stub_options)
+        return stubs[provider]
+
+    responder = AIResponder(tracker=tracker, client_factory=client_factory)
+
+    timings: Dict[str, RollingStats] = {}
+    _instrument(responder, '_prepare', 'prepare', timings)
+    _instrument(responder, '_build_context', 'context', timings)
+    _instrument(responder, '_generate', 'llm', timings)
+    _instrument(responder, '_finish', 'finish', timings)
+    if responder.quick_replies:
+        _instrument(responder.quick_replies, 'match', 'quick_reply_match', timings)
+    if responder.cache:
+        _instrument(responder.cache, 'get', 'cache_lookup', timings)
+
+    total = timings.setdefault('total', RollingStats(window=1_000_000))
+    queries = RollingStats(window=1_000_000)
+    connections = RollingStats(window=1_000_000)
+    replies = 0
+    started = time.perf_counter()
+
+    for message in messages:
+        phone = message['conversation']
+        if message['direction'] != 'incoming':
+            # Recorded AI replies are regenerated; human replies stay as history
+            if not message['is_ai']:
+                tracker.add_outgoing_message(phone, message['text'], is_ai=False)
+            continue
+
+        message_id = tracker.add_incoming_message(phone, message['text'], None)
+        conversation_id = tracker.get_or_create_conversation(phone)
+
+        tracker.queries = tracker.connections = 0
+        call_started = time.perf_counter()
+        reply = responder.generate_response(phone, message['text'], conversation_id, message_id)
+        total.add((time.perf_counter() - call_started) * 1000)
+        queries.add(tracker.queries)
+        connections.add(tracker.connections)
+
+        if reply:
+            replies += 1
+            tracker.add_outgoing_message(phone, reply, is_ai=True)
+
+    elapsed = time.perf_counter() - started
+    return _report(tracker, responder, messages, replies, elapsed, timings,
+                   queries, connections, stubs)
+
+
+def _report(tracker, responder, messages, replies, elapsed, timings, queries,
+            connections, stubs) -> Dict:
+    conn = sqlite3.connect(tracker.db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT model, COUNT(*) FROM ai_responses WHERE kind = 'reply' GROUP BY model")
+    sources = dict(cursor.fetchall())
+    cursor.execute('''
+        SELECT COUNT(*), AVG(input_tokens), AVG(cached_input_tokens), AVG(output_tokens)
+        FROM ai_responses
+        WHERE model NOT IN ('local-quickreply', 'response-cache', 'local-fallback')
+          AND kind = 'reply'
+    ''')
+    llm_replies, avg_input, avg_cached, avg_output = cursor.fetchone()
+    # Summaries and lost hedges are spend too
+    cursor.execute('SELECT SUM(cost_estimate) FROM ai_responses')
+    cost = cursor.fetchone()[0]
+    conn.close()
+
+    logged = sum(sources.values())
+    if replies > logged:
+        sources['escalation (not logged)'] = replies - logged
+
+    return {
+        "conversations": len({m['conversation'] for m in messages}),
+        "incoming_messages": sum(1 for m in messages if m['direction'] == 'incoming'),
+        "replies": replies,
+        "elapsed_seconds": round(elapsed, 3),
+        "replies_per_second": round(replies / elapsed, 2) if elapsed else 0.0,
+        "reply_sources": sources,
+        "stage_latency_ms": {stage: stats.summary() for stage, stats in timings.items()},
+        "tokens_per_llm_reply": {
+            "llm_replies": llm_replies or 0,
+            "input": round(avg_input or 0, 1),
+            "cached_input": round(avg_cached or 0, 1),
+            "output": round(avg_output or 0, 1),
+        },
+        "estimated_cost_usd": round(cost or 0, 6),
+        "response_cache": responder.get_cache_stats(),
+        "quick_replies": responder.get_quick_reply_stats(),
+        "db_queries_per_reply": queries.summary(),
+        "db_connections_per_reply": connections.summary(),
+        "stub_llm_calls": {provider: stub.calls for provider, stub in stubs.items()},
+    }
+
+
+def print_report(report: Dict):
+    print("=" * 60)
+    print("AI Reply Pipeline - Replay Benchmark")
+    print("=" * 60)
+    print(f"Conversations: {report['conversations']}   "
+          f"Incoming: {report['incoming_messages']}   Replies: {report['replies']}")
+    print(f"Elapsed: {report['elapsed_seconds']}s   ({report['replies_per_second']} replies/s)")
+    print(f"Reply sources: {report['reply_sources']}")
+
+    print(f"\n{'stage':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, s in report['stage_latency_ms'].items():
+        print(f"{stage:<20}{s['count']:>8}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}{s['max']:>10.2f}")
+
+    t = report['tokens_per_llm_reply']
+    print(f"\nTokens per LLM reply ({t['llm_replies']} replies): input {t['input']}, "
+          f"cached input {t['cached_input']}, output {t['output']}")
+    print(f"Estimated cost: ${report['estimated_cost_usd']}")
+    if report['response_cache']:
+        c = report['response_cache']
+        print(f"Response cache: {c['hits']} hits / {c['misses']} misses (hit rate {c['hit_rate']:.1%})")
+    if report['quick_replies']:
+        print(f"Quick replies: {report['quick_replies']['hits']} hits")
+    q = report['db_queries_per_reply']
+    print(f"DB queries per reply: mean {q['mean']}, p95 {q['p95']}, max {q['max']} "
+          f"(connections mean {report['db_connections_per_reply']['mean']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline replay benchmark for the AI reply pipeline")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--db', help="Replay messages from a tracker database")
+    source.add_argument('--fixture', help="Replay messages from a JSONL fixture")
+    source.add_argument('--synthetic', type=int, default=100,
+                        help="Replay N synthetic conversations (default)")
+    parser.add_argument('--limit', type=int, help="Max messages to read from --db")
+    parser.add_argument('--latency-ms', type=float, default=50, help="Stub LLM mean latency")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="Stub LLM latency std deviation")
+    parser.add_argument('--output-tokens', type=int, default=120, help="Stub LLM tokens per reply")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-cache', action='store_true', help="Disable the response cache")
+    parser.add_argument('--no-quick-replies', action='store_true', help="Disable quick replies")
+    parser.add_argument('--max-ai-responses', type=int,
+                        help="Override MAX_AI_RESPONSES (default from config)")
+    parser.add_argument('--json', help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.db:
+        messages = load_tracker_db(args.db, args.limit)
+    elif args.fixture:
+        messages = load_fixture(args.fixture)
+    else:
+        messages = synthetic_conversations(args.synthetic, args.seed)
+
+    # Configuration is read when AIResponder is built
+    if args.no_cache:
+        config.RESPONSE_CACHE_ENABLED = False
+    if args.no_quick_replies:
+        config.QUICK_REPLIES_ENABLED = False
+    if args.max_ai_responses is not None:
+        config.MAX_AI_RESPONSES_PER_CONVERSATION = args.max_ai_responses
+
+    stub_options = dict(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                        output_tokens=args.output_tokens, seed=args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run_replay(messages, stub_options, os.path.join(tmp, 'replay.db'))
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
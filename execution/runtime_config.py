@@ -0,0 +1,278 @@
+"""
+Runtime Config - Reload settings without restarting the processes
+Re-reads .env and config.py into a new snapshot, validates it and swaps it in
+as one reference; triggered by SIGHUP or by the file watcher.
+"""
+
+import os
+import signal
+import logging
+import threading
+import importlib.util
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dotenv import dotenv_values, find_dotenv
+import config
+
+logger = logging.getLogger(__name__)
+
+# Settings read from the current snapshot on every request; anything else is
+# bound into long-lived objects (clients, pools, database) at startup
+LIVE_SETTINGS = {
+    'RESPONSE_DELAY',
+    'MAX_AI_RESPONSES_PER_CONVERSATION',
+    'IMMEDIATE_RESPONSE_OUTSIDE_HOURS',
+    'SYSTEM_PROMPT',
+    'BUSINESS_INFO',
+    'BUSINESS_HOURS_START',
+    'BUSINESS_HOURS_END',
+    'BUSINESS_DAYS',
+    'BUSINESS_TIMEZONE',
+    'HOLIDAYS_FILE',
+    'BUSINESS_CALENDAR_DAYS',
+    'QUICK_REPLY_MIN_CONFIDENCE',
+    'WEBHOOK_VERIFY_TOKEN',
+    'MONITOR_CHECK_INTERVAL',
+    'MONITOR_LAG_ALERT_SECONDS',
+    'MONITOR_LAG_WINDOW_SECONDS',
+    'MONITOR_HEARTBEAT_TIMEOUT',
+    'MONITOR_STATUS_FILE',
+    'PROFILE_SAMPLE_RATE',
+    'PROFILE_MODE',
+    'PROFILE_SAMPLE_INTERVAL_MS',
+    'PROFILE_MIN_MS',
+    'PROFILE_DIR',
+    'PROFILE_MAX_FILES',
+    'PROFILE_ADMIN_TOKEN',
+    'TRACE_FILE',
+    'TRACE_FORMAT',
+    'TRACE_MAX_BYTES',
+}
+
+
+class ConfigSnapshot:
+    """
+    One loaded version of config.py
+    Read settings as attributes (snapshot.RESPONSE_DELAY). Reloads build a new
+    snapshot instead of changing this one, so a request that took it sees one
+    consistent version. Version 1 is the imported `config` module itself.
+    """
+
+    def __init__(self, module, version: int):
+        self._module = module
+        self.version = version
+        self.loaded_at = datetime.now()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._module, name)
+
+    def settings(self) -> Dict[str, Any]:
+        """All UPPER_CASE settings"""
+        return {key: value for key, value in vars(self._module).items() if key.isupper()}
+
+    def validate(self):
+        """Raise ValueError if the snapshot is not usable (config.validate_config)"""
+        self._module.validate_config()
+
+
+_current = ConfigSnapshot(config, 1)
+_reload_lock = threading.Lock()
+_listeners: List[Callable[[ConfigSnapshot, ConfigSnapshot, List[str]], None]] = []
+_reloads = 0
+_rejected = 0
+_last_error: Optional[str] = None
+
+# What .env held at the last load; only keys whose environment value still
+# matches it are owned by the file (real environment variables always win)
+_env_path = find_dotenv()
+_env_values = {k: v for k, v in dotenv_values(_env_path).items() if v is not None} if _env_path else {}
+
+
+def current() -> ConfigSnapshot:
+    """The config snapshot in effect now"""
+    return _current
+
+
+def add_listener(listener: Callable[[ConfigSnapshot, ConfigSnapshot, List[str]], None]):
+    """Call listener(old, new, changed_keys) after every applied reload"""
+    _listeners.append(listener)
+
+
+def _apply_env_file(path: str) -> Tuple[Dict[str, Optional[str]], Dict[str, str]]:
+    """
+    Copy .env values into os.environ
+    Returns (previous values to restore on rejection, new file values).
+    """
+    values = {k: v for k, v in dotenv_values(path).items() if v is not None} if path else {}
+    previous = {}
+    for key in set(values) | set(_env_values):
+        current_value = os.environ.get(key)
+        if current_value is not None and current_value != _env_values.get(key):
+            continue  # set outside .env
+        new_value = values.get(key)
+        if new_value == current_value:
+            continue
+        previous[key] = current_value
+        if new_value is None:
+            del os.environ[key]
+        else:
+            os.environ[key] = new_value
+    return previous, values
+
+
+def _restore_env(previous: Dict[str, Optional[str]]):
+    for key, value in previous.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+def _load_config_module():
+    """Execute config.py into a new module object (sys.modules is untouched)"""
+    spec = importlib.util.spec_from_file_location('config', config.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reload(reason: str = 'manual') -> bool:
+    """
+    Load and validate a new snapshot, then swap it in
+    A config that fails to load or validate is rejected and the running one
+    stays in effect. Returns True if a new snapshot was applied.
+    """
+    global _current, _env_path, _env_values, _reloads, _rejected, _last_error
+    with _reload_lock:
+        path = find_dotenv()
+        previous_env, env_values = _apply_env_file(path)
+        try:
+            snapshot = ConfigSnapshot(_load_config_module(), _current.version + 1)
+            snapshot.validate()
+        except Exception as e:
+            _restore_env(previous_env)
+            _rejected += 1
+            _last_error = str(e)
+            logger.error(f"❌ Config reload ({reason}) rejected, keeping version "
+                         f"{_current.version}:\n{e}")
+            return False
+
+        old = _current
+        old_settings = old.settings()
+        changed = sorted(key for key, value in snapshot.settings().items()
+                         if old_settings.get(key, object()) != value)
+        _env_path, _env_values = path, env_values
+        # Swapped even without setting changes: a new version also rebuilds
+        # what is derived from files (holidays)
+        _current = snapshot
+        _reloads += 1
+        _last_error = None
+
+    restart_only = [key for key in changed if key not in LIVE_SETTINGS]
+    logger.info(f"🔄 Config version {snapshot.version} loaded ({reason}): "
+                f"{', '.join(changed) if changed else 'no setting changes'}")
+    if restart_only:
+        logger.warning(f"⚠️ Restart required for: {', '.join(restart_only)}")
+
+    for listener in _listeners:
+        try:
+            listener(old, snapshot, changed)
+        except Exception as e:
+            logger.error(f"Config listener error: {e}", exc_info=True)
+    return True
+
+
+def install_signal_handler() -> bool:
+    """
+    Reload on SIGHUP (kill -HUP <pid>)
+    Only possible from the main thread and not on Windows; the reload runs in
+    its own thread so the interrupted code is never re-entered.
+    """
+    if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+        return False
+
+    def handle_sighup(signum, frame):
+        threading.Thread(target=reload, args=('SIGHUP',), name='config-reload', daemon=True).start()
+
+    signal.signal(signal.SIGHUP, handle_sighup)
+    return True
+
+
+class ConfigWatcher:
+    """
+    Polls .env, config.py and HOLIDAYS_FILE and reloads when one changes
+    Uses (mtime_ns, size) like the emergency term file; no extra dependency.
+    """
+
+    def __init__(self, interval: float = config.CONFIG_WATCH_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._signature = self._files_signature()
+
+    def _files_signature(self) -> Tuple:
+        paths = [find_dotenv(), config.__file__, current().HOLIDAYS_FILE]
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path) if path else None
+            except OSError:
+                stat = None
+            signature.append((path, stat.st_mtime_ns, stat.st_size) if stat else (path, None, None))
+        return tuple(signature)
+
+    def check(self) -> bool:
+        """Reload if a watched file changed since the last check"""
+        signature = self._files_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        reload('file change')
+        # The reload may point HOLIDAYS_FILE elsewhere
+        self._signature = self._files_signature()
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Config watcher error: {e}", exc_info=True)
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+_watcher: Optional[ConfigWatcher] = None
+
+
+def start_watching() -> Optional[ConfigWatcher]:
+    """Install the SIGHUP handler and start the file watcher (once per process)"""
+    global _watcher
+    install_signal_handler()
+    if _watcher is None and config.CONFIG_WATCH_INTERVAL > 0:
+        _watcher = ConfigWatcher()
+        _watcher.start()
+    return _watcher
+
+
+def stats() -> Dict:
+    return {
+        "version": _current.version,
+        "loaded_at": _current.loaded_at.isoformat(),
+        "reloads": _reloads,
+        "rejected": _rejected,
+        "last_error": _last_error,
+        "watching": _watcher is not None,
+    }
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    print("Reloaded" if reload('command line') else "Rejected")
+    print(stats())
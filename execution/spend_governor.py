@@ -0,0 +1,78 @@
+"""
+Spend Governor - Keep AI spend within daily and monthly budgets
+Reads the running spend counters kept by ConversationTracker.log_ai_response
+"""
+
+from typing import Dict
+import config
+from conversation_tracker import ConversationTracker
+
+
+class SpendGovernor:
+    """
+    Decides how replies may be generated given the current spend
+    normal    - configured model
+    downgrade - cheaper AI_BUDGET_DOWNGRADE_MODEL once AI_BUDGET_DOWNGRADE_AT
+                of a budget is used
+    local     - budget used up: quick replies only, otherwise hand over to a human
+    """
+
+    NORMAL = 'normal'
+    DOWNGRADE = 'downgrade'
+    LOCAL = 'local'
+
+    def __init__(self, tracker: ConversationTracker,
+                 daily_budget: float = config.DAILY_AI_BUDGET_USD,
+                 monthly_budget: float = config.MONTHLY_AI_BUDGET_USD,
+                 downgrade_at: float = config.AI_BUDGET_DOWNGRADE_AT,
+                 downgrade_model: str = config.AI_BUDGET_DOWNGRADE_MODEL):
+        self.tracker = tracker
+        self.daily_budget = daily_budget
+        self.monthly_budget = monthly_budget
+        self.downgrade_at = downgrade_at
+        self.downgrade_model = downgrade_model
+        self.last_mode = self.NORMAL
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.daily_budget or self.monthly_budget)
+
+    def _usage(self, spend: Dict[str, float]) -> float:
+        """Highest share of any budget used so far"""
+        shares = []
+        if self.daily_budget:
+            shares.append(spend['day'] / self.daily_budget)
+        if self.monthly_budget:
+            shares.append(spend['month'] / self.monthly_budget)
+        return max(shares) if shares else 0.0
+
+    def mode(self) -> str:
+        """Current generation mode"""
+        if not self.enabled:
+            return self.NORMAL
+
+        usage = self._usage(self.tracker.get_spend())
+        if usage >= 1.0:
+            mode = self.LOCAL
+        elif self.downgrade_model and usage >= self.downgrade_at:
+            mode = self.DOWNGRADE
+        else:
+            mode = self.NORMAL
+
+        if mode != self.last_mode:
+            print(f"AI spend governor: {self.last_mode} -> {mode} ({usage:.0%} of budget used)")
+            self.last_mode = mode
+        return mode
+
+    def status(self) -> Dict:
+        """Budgets, spend so far and current mode"""
+        spend = self.tracker.get_spend()
+        return {
+            "mode": self.mode(),
+            "daily_budget": self.daily_budget,
+            "monthly_budget": self.monthly_budget,
+            "spend_today": round(spend['day'], 6),
+            "spend_this_month": round(spend['month'], 6),
+            "budget_used": round(self._usage(spend), 4),
+            "downgrade_model": self.downgrade_model or None
+        }
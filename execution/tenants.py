@@ -0,0 +1,400 @@
+"""
+Tenants - Several clinics (WhatsApp numbers) served by one deployment
+Each tenant overrides a set of config settings (prompt, business info and
+hours, provider credentials, database); inbound webhooks are routed to a
+tenant by the receiving phone-number ID or WhatsApp number.
+"""
+
+import os
+import json
+import threading
+from datetime import time
+from typing import Dict, Iterator, List, Optional
+import config
+import runtime_config
+from metrics import MetricsRegistry
+from conversation_tracker import ConversationTracker
+from ai_responder import AIResponder, get_llm_client
+from llm_router import LLMRouter
+from whatsapp_sender import WhatsAppSender, make_session
+from delivery_status import StatusRecorder, delivery_stats
+from outbox import OutboxDispatcher, OutboxWakeups
+from business_calendar import get_calendar
+
+DEFAULT_TENANT = 'default'
+
+# Settings a tenant may override; AI provider keys, pools and queue limits
+# stay process-wide because those resources are shared
+TENANT_SETTINGS = {
+    'WHATSAPP_API_PROVIDER',
+    'WHATSAPP_API_KEY',
+    'WHATSAPP_PHONE_NUMBER',
+    'WHATSAPP_PHONE_NUMBER_ID',
+    'TWILIO_ACCOUNT_SID',
+    'TWILIO_AUTH_TOKEN',
+    'TWILIO_WHATSAPP_NUMBER',
+    'WEBHOOK_VERIFY_TOKEN',
+    'DATABASE_PATH',
+    'BUSINESS_INFO',
+    'SYSTEM_PROMPT',
+    'BUSINESS_HOURS_START',
+    'BUSINESS_HOURS_END',
+    'BUSINESS_DAYS',
+    'BUSINESS_TIMEZONE',
+    'HOLIDAYS_FILE',
+    'RESPONSE_DELAY',
+    'IMMEDIATE_RESPONSE_OUTSIDE_HOURS',
+    'MAX_AI_RESPONSES_PER_CONVERSATION',
+    'QUICK_REPLIES_FILE',
+    'PROMPT_REFERENCE_FILE',
+    'QUICK_REPLY_MIN_CONFIDENCE',
+    'DAILY_AI_BUDGET_USD',
+    'MONTHLY_AI_BUDGET_USD',
+}
+
+
+def _whatsapp_number(number: str) -> str:
+    """'whatsapp:+90 543...' -> '+90543...' for routing lookups"""
+    return number.replace('whatsapp:', '').replace(' ', '').strip()
+
+
+def parse_overrides(tenant_id: str, raw: Dict, base_dir: str = '.') -> Dict:
+    """
+    Check and convert one tenant's settings from the tenants file
+    Strings may reference environment variables (${CLINIC2_API_KEY}) so
+    secrets stay in .env; SYSTEM_PROMPT_FILE reads the prompt from a file.
+    BUSINESS_INFO may be partial: TenantSettings fills it in from the current
+    config (and derives the prompt from it) at read time.
+    """
+    overrides = {}
+    for key, value in raw.items():
+        if isinstance(value, str):
+            value = os.path.expandvars(value)
+        if key == 'SYSTEM_PROMPT_FILE':
+            with open(os.path.join(base_dir, value), encoding='utf-8') as f:
+                overrides['SYSTEM_PROMPT'] = f.read()
+            continue
+        if key not in TENANT_SETTINGS:
+            raise ValueError(f"Tenant '{tenant_id}': {key} cannot be set per tenant")
+        if key in ('BUSINESS_HOURS_START', 'BUSINESS_HOURS_END'):
+            value = time.fromisoformat(value.zfill(5))
+        elif key == 'BUSINESS_INFO' and not isinstance(value, dict):
+            raise ValueError(f"Tenant '{tenant_id}': BUSINESS_INFO must be an object")
+        overrides[key] = value
+    return overrides
+
+
+class TenantSettings:
+    """
+    Tenant overrides on top of a config snapshot; read like config
+    A tenant's BUSINESS_INFO is merged over the snapshot's, and without its
+    own prompt its SYSTEM_PROMPT is built from the merged info, so both follow
+    config reloads. `cache` (kept by the tenant) holds them per config version.
+    """
+
+    def __init__(self, overrides: Dict, base, cache: Optional[Dict] = None):
+        self._overrides = overrides
+        self._base = base
+        self._cache = cache if cache is not None else {}
+        self.version = base.version
+
+    def _derived(self) -> Dict:
+        derived = self._cache.get(self.version)
+        if derived is None:
+            info = {**self._base.BUSINESS_INFO, **self._overrides['BUSINESS_INFO']}
+            derived = {'BUSINESS_INFO': info}
+            if 'SYSTEM_PROMPT' not in self._overrides:
+                derived['SYSTEM_PROMPT'] = self._base.build_system_prompt(info)
+            self._cache.clear()
+            self._cache[self.version] = derived
+        return derived
+
+    def __getattr__(self, name: str):
+        if name in ('BUSINESS_INFO', 'SYSTEM_PROMPT') and 'BUSINESS_INFO' in self._overrides:
+            derived = self._derived()
+            if name in derived:
+                return derived[name]
+        if name in self._overrides:
+            return self._overrides[name]
+        return getattr(self._base, name)
+
+
+class Tenant:
+    """
+    One clinic: its settings plus the components bound to them
+    Components are built on first use; the LLM clients and router and the
+    WhatsApp HTTP session are shared with the other tenants.
+    """
+
+    def __init__(self, tenant_id: str, overrides: Dict, registry: 'TenantRegistry'):
+        self.id = tenant_id
+        self.overrides = overrides
+        self._derived_settings: Dict = {}
+        self.registry = registry
+        self.metrics = MetricsRegistry()
+        self._lock = threading.RLock()
+        self._tracker = None
+        self._ai_responder = None
+        self._sender = None
+        self._status_recorder = None
+        self._outbox = None
+        self.dispatching = False
+
+    def settings(self) -> TenantSettings:
+        """This tenant's view of the current config"""
+        return TenantSettings(self.overrides, runtime_config.current(), self._derived_settings)
+
+    @property
+    def provider(self) -> str:
+        return self.settings().WHATSAPP_API_PROVIDER
+
+    def routing_keys(self) -> List[str]:
+        """Receiving phone-number ID (Meta/360Dialog) and WhatsApp number (Twilio)"""
+        settings = self.settings()
+        keys = []
+        if settings.WHATSAPP_PHONE_NUMBER_ID:
+            keys.append(str(settings.WHATSAPP_PHONE_NUMBER_ID))
+        if settings.WHATSAPP_API_PROVIDER == 'twilio' and settings.TWILIO_WHATSAPP_NUMBER:
+            keys.append(_whatsapp_number(settings.TWILIO_WHATSAPP_NUMBER))
+        return keys
+
+    @property
+    def tracker(self) -> ConversationTracker:
+        with self._lock:
+            if self._tracker is None:
+                self._tracker = ConversationTracker(self.settings().DATABASE_PATH)
+            return self._tracker
+
+    @property
+    def ai_responder(self) -> AIResponder:
+        with self._lock:
+            if self._ai_responder is None:
+                self._ai_responder = AIResponder(tracker=self.tracker, settings=self.settings,
+                                                 client_factory=self.registry.client_factory,
+                                                 router=self.registry.router)
+            return self._ai_responder
+
+    @property
+    def sender(self) -> WhatsAppSender:
+        with self._lock:
+            if self._sender is None:
+                self._sender = WhatsAppSender(self.settings(), session=self.registry.session)
+                # Record submissions so delivery receipts can be timed
+                self._status_recorder = StatusRecorder(self.tracker, provider=self.provider)
+                self._sender.outbound.add_listener(self._status_recorder.record_sent_item)
+            return self._sender
+
+    @property
+    def status_recorder(self) -> StatusRecorder:
+        self.sender  # built together with the sender
+        return self._status_recorder
+
+    @property
+    def outbox(self) -> OutboxDispatcher:
+        with self._lock:
+            if self._outbox is None:
+                self._outbox = OutboxDispatcher(self.tracker, self.sender)
+            return self._outbox
+
+    def calendar(self):
+        return get_calendar(self.settings(), key=self.id)
+
+    def start(self, dispatch: bool = True):
+        """Build the components and, in the dispatching process, start the outbox"""
+        self.ai_responder  # warms the response cache before the first message
+        if dispatch:
+            self.outbox.start()
+            self.dispatching = True
+
+    def notify_outbox(self):
+        """Send newly enqueued messages now, from whichever process dispatches"""
+        if self.dispatching:
+            self.outbox.notify()
+        else:
+            self.registry.wakeups.send(self.id)
+
+    def stop(self):
+        """Stop claiming outbox rows, drain sends, then flush receipts"""
+        if self._outbox:
+            self._outbox.stop()
+        if self._sender:
+            self._sender.close()
+        if self._status_recorder:
+            self._status_recorder.stop()
+
+    def stats(self) -> Dict:
+        """Conversation, dispatch and delivery stats from this tenant's shard"""
+        calendar = self.calendar()
+        stats = self.tracker.get_statistics()
+        stats.update({
+            "tenant": self.id,
+            "provider": self.provider,
+            "is_business_hours": calendar.is_open(),
+            "business_calendar": calendar.stats(),
+            "response_delay": self.settings().RESPONSE_DELAY,
+            "response_cache": self.ai_responder.get_cache_stats(),
+            "quick_replies": self.ai_responder.get_quick_reply_stats(),
+            "ai_budget": self.ai_responder.get_budget_stats(),
+            "outbound": self.sender.outbound.stats(),
+            "outbox": self.outbox.stats(),
+            "delivery": delivery_stats(self.tracker),
+            "metrics": self.metrics.snapshot(),
+        })
+        stats["delivery"]["recorder"] = self.status_recorder.stats()
+        return stats
+
+
+class TenantRegistry:
+    """
+    All tenants of this deployment, with routing by receiving number
+    Without a tenants file there is one 'default' tenant using config as is.
+    The first tenant in the file is the default (manual sends, /webhook
+    requests that cannot be routed in single-tenant setups).
+    """
+
+    # LLM clients for every tenant; the webhook benchmark swaps in a stub
+    client_factory = staticmethod(get_llm_client)
+
+    def __init__(self, tenant_overrides: Dict[str, Dict]):
+        if not tenant_overrides:
+            tenant_overrides = {DEFAULT_TENANT: {}}
+        self.metrics = MetricsRegistry()
+        self.wakeups = OutboxWakeups()
+        self._router = None
+        self._session = None
+        self._lock = threading.Lock()
+        self.tenants: Dict[str, Tenant] = {
+            tenant_id: Tenant(tenant_id, overrides, self)
+            for tenant_id, overrides in tenant_overrides.items()
+        }
+        self.default = next(iter(self.tenants.values()))
+        self.routes: Dict[str, Tenant] = {}
+        databases: Dict[str, str] = {}
+        for tenant in self.tenants.values():
+            for key in tenant.routing_keys():
+                if key in self.routes:
+                    raise ValueError(f"Tenants '{self.routes[key].id}' and '{tenant.id}' "
+                                     f"both receive on {key}")
+                self.routes[key] = tenant
+            database = os.path.abspath(tenant.settings().DATABASE_PATH)
+            if database in databases:
+                raise ValueError(f"Tenants '{databases[database]}' and '{tenant.id}' "
+                                 f"share DATABASE_PATH {database}")
+            databases[database] = tenant.id
+
+    @classmethod
+    def from_config(cls, path: str = config.TENANTS_FILE) -> 'TenantRegistry':
+        """Tenants from TENANTS_FILE, or the single default tenant if it does not exist"""
+        if not path or not os.path.exists(path):
+            return cls({})
+        with open(path, encoding='utf-8') as f:
+            raw = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(path))
+        registry = cls({str(tenant_id): parse_overrides(str(tenant_id), settings, base_dir)
+                        for tenant_id, settings in raw.items()})
+        print(f"🏥 Loaded {len(registry)} tenant(s) from {path}")
+        return registry
+
+    def __len__(self) -> int:
+        return len(self.tenants)
+
+    def __iter__(self) -> Iterator[Tenant]:
+        return iter(list(self.tenants.values()))
+
+    @property
+    def multi_tenant(self) -> bool:
+        return len(self.tenants) > 1
+
+    def get(self, tenant_id: str) -> Optional[Tenant]:
+        return self.tenants.get(tenant_id)
+
+    def route(self, receiving: Optional[str]) -> Optional[Tenant]:
+        """
+        Tenant for a receiving phone-number ID or WhatsApp number
+        A single tenant takes everything; otherwise None when nobody receives on it.
+        """
+        if not self.multi_tenant:
+            return self.default
+        if not receiving:
+            return None
+        return self.routes.get(str(receiving)) or self.routes.get(_whatsapp_number(str(receiving)))
+
+    @property
+    def router(self) -> LLMRouter:
+        """LLM router shared by all tenants (one circuit breaker per provider:model)"""
+        with self._lock:
+            if self._router is None:
+                self._router = LLMRouter.from_config(self.client_factory)
+            return self._router
+
+    @property
+    def session(self):
+        """WhatsApp HTTP session shared by all tenants (None for one tenant: it owns its own)"""
+        if not self.multi_tenant:
+            return None
+        with self._lock:
+            if self._session is None:
+                self._session = make_session({"Content-Type": "application/json"})
+            return self._session
+
+    def validate(self):
+        """Raise ValueError listing every tenant with incomplete settings"""
+        errors = []
+        for tenant in self:
+            try:
+                config.validate_config(tenant.settings())
+            except ValueError as e:
+                errors.append(f"[{tenant.id}] {e}")
+        if errors:
+            raise ValueError("\n".join(errors))
+        return True
+
+    def start(self, dispatch: bool = True):
+        """
+        Start every tenant
+        dispatch=False for web workers: they only enqueue, and the monitor
+        process (standalone, or the worker holding the embedded-monitor lock)
+        sends, so rate limits and priorities apply once per deployment.
+        """
+        for tenant in self:
+            tenant.start(dispatch=False)
+        if dispatch:
+            self.start_dispatching()
+
+    def start_dispatching(self):
+        """Run every tenant's outbox dispatcher in this process"""
+        for tenant in self:
+            tenant.start(dispatch=True)
+        self.wakeups.listen(self._wake)
+
+    def _wake(self, tenant_id: str):
+        tenant = self.get(tenant_id)
+        if tenant is not None and tenant.dispatching:
+            tenant.outbox.notify()
+
+    def stop(self):
+        for tenant in self:
+            tenant.stop()
+        self.wakeups.close()
+        if self._session:
+            self._session.close()
+
+    def stats(self) -> Dict:
+        return {tenant.id: tenant.stats() for tenant in self}
+
+    def route_stats(self) -> Dict:
+        return self.router.stats()
+
+
+if __name__ == '__main__':
+    registry = TenantRegistry.from_config()
+    for tenant in registry:
+        settings = tenant.settings()
+        print(f"{tenant.id}: {settings.BUSINESS_INFO['name']} via {settings.WHATSAPP_API_PROVIDER} "
+              f"({', '.join(tenant.routing_keys()) or f'only /webhook/{tenant.id}'}) "
+              f"-> {settings.DATABASE_PATH}")
+    try:
+        registry.validate()
+        print("\n✅ All tenants validated")
+    except ValueError as e:
+        print(f"\n❌ Tenant configuration errors:\n{e}")
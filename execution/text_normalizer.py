@@ -0,0 +1,48 @@
+"""
+Text Normalizer - Turkish-aware text normalization
+Used for cache keys and keyword matching on customer messages
+"""
+
+import re
+import unicodedata
+
+# str.lower() maps 'I' to 'i' and 'İ' to 'i̇' (with a combining dot),
+# which is wrong for Turkish. Map the dotted/dotless pairs first.
+_TURKISH_UPPER_MAP = str.maketrans({'I': 'ı', 'İ': 'i'})
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Dotless ı has no decomposition, so it is mapped explicitly
+_DOTLESS_MAP = str.maketrans({'ı': 'i'})
+
+
+def turkish_casefold(text: str) -> str:
+    """Lowercase text using Turkish rules for I/İ"""
+    return text.translate(_TURKISH_UPPER_MAP).lower()
+
+
+def strip_punctuation(text: str) -> str:
+    """Replace punctuation and symbols (including emoji) with spaces"""
+    return ''.join(
+        ' ' if unicodedata.category(ch)[0] in ('P', 'S') else ch
+        for ch in text
+    )
+
+
+def fold_diacritics(text: str) -> str:
+    """Drop diacritics ('ş' -> 's', 'ı' -> 'i') so spellings without Turkish letters match"""
+    if text.isascii():
+        return text
+    decomposed = unicodedata.normalize('NFKD', text.translate(_DOTLESS_MAP))
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a message for comparison
+    Turkish casefolding, punctuation/symbols removed, whitespace collapsed
+    """
+    if not text:
+        return ''
+    text = strip_punctuation(turkish_casefold(text))
+    return _WHITESPACE_RE.sub(' ', text).strip()
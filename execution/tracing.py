@@ -0,0 +1,358 @@
+"""
+Tracing - Per-message spans from the webhook to the delivered reply
+A trace ID is created when a message arrives and stored with the message, its
+pending response and outbox rows, so the webhook, background monitor and
+outbox dispatcher (possibly separate processes) add spans to the same trace.
+Spans are appended to TRACE_FILE as JSON lines or OTLP/JSON.
+
+Usage:
+    python execution/tracing.py                  # slowest traces in TRACE_FILE
+    python execution/tracing.py <trace_id>       # one trace as a timeline
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from datetime import datetime
+from typing import Dict, List, Optional
+import runtime_config
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('jsonl', 'otlp')
+
+# Recorded with every span; entry points name their process
+service = 'norodil'
+
+_current = contextvars.ContextVar('tracing_span', default=None)
+
+
+def new_trace_id() -> str:
+    """32 hex characters, the W3C/OpenTelemetry trace ID format"""
+    return os.urandom(16).hex()
+
+
+class Span:
+    """One timed stage of a trace; created by span() and record()"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes',
+                 'start', 'end', 'error', '_token')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict] = None, start: Optional[float] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start = start if start is not None else time.time()
+        self.end = None
+        self.error = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.finish()
+        return False
+
+    def finish(self, end: Optional[float] = None):
+        self.end = end if end is not None else time.time()
+        sink.export(self)
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off or there is no trace to join"""
+
+    trace_id = None
+    span_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def _parent_in(trace_id: str) -> Optional[str]:
+    parent = _current.get()
+    return parent.span_id if parent is not None and parent.trace_id == trace_id else None
+
+
+def span(name: str, trace_id: Optional[str] = None, **attributes):
+    """
+    Context manager timing the enclosed code as a span
+    Joins trace_id when given (a stage picking up a stored message), otherwise
+    the span open in this thread/task. Without either, or with TRACE_FILE
+    empty, returns a shared no-op span.
+    """
+    if not sink.enabled:
+        return _NOOP
+    if trace_id is None:
+        parent = _current.get()
+        if parent is None:
+            return _NOOP
+        trace_id = parent.trace_id
+    return Span(name, trace_id, _parent_in(trace_id), attributes)
+
+
+def record(name: str, trace_id: Optional[str], start: float, end: float,
+           error: Optional[str] = None, **attributes):
+    """Export a span timed elsewhere (waits between stages, send callbacks)"""
+    if not sink.enabled or not trace_id:
+        return
+    finished = Span(name, trace_id, _parent_in(trace_id), attributes, start)
+    finished.error = error
+    finished.finish(end)
+
+
+def set_attributes(**attributes):
+    """Add attributes to the span open in this thread/task, if any"""
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def _jsonl(span: Span) -> Dict:
+    return {
+        "trace_id": span.trace_id,
+        "span_id": span.span_id,
+        "parent_id": span.parent_id,
+        "name": span.name,
+        "service": service,
+        "pid": os.getpid(),
+        "start": datetime.fromtimestamp(span.start).isoformat(),
+        "duration_ms": round((span.end - span.start) * 1000, 3),
+        "error": span.error,
+        "attributes": span.attributes,
+    }
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp(span: Span) -> Dict:
+    """One span as an OTLP/JSON export request (what otlpjsonfile receivers read)"""
+    record = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(int(span.start * 1e9)),
+        "endTimeUnixNano": str(int(span.end * 1e9)),
+        "attributes": [{"key": key, "value": _otlp_value(value)}
+                       for key, value in span.attributes.items() if value is not None],
+        "status": {"code": 2, "message": span.error} if span.error else {},
+    }
+    if span.parent_id:
+        record["parentSpanId"] = span.parent_id
+    return {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": service}},
+            {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+        ]},
+        "scopeSpans": [{"scope": {"name": "norodil"}, "spans": [record]}],
+    }]}
+
+
+class TraceSink:
+    """
+    Appends finished spans to TRACE_FILE
+    Each span is a single write() on an O_APPEND descriptor, so the webhook
+    and monitor processes can share the file without interleaving lines.
+    At TRACE_MAX_BYTES the file moves to TRACE_FILE.1 (one generation kept).
+    """
+
+    def __init__(self):
+        self.path = ''
+        self.format = 'jsonl'
+        self.max_bytes = 0
+        self.enabled = False
+        self.exported = 0
+        self.errors = 0
+        self._fd = None
+        self._failing = False
+        self._lock = threading.Lock()
+        self._apply(runtime_config.current())
+        runtime_config.add_listener(lambda old, new, changed: self._apply(new))
+
+    def _apply(self, settings):
+        with self._lock:
+            if settings.TRACE_FILE != self.path:
+                self._close()
+            self.path = settings.TRACE_FILE
+            self.format = settings.TRACE_FORMAT
+            self.max_bytes = settings.TRACE_MAX_BYTES
+            self.enabled = bool(self.path)
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _rotate(self):
+        # Another process may have rotated first; then only reopen
+        try:
+            if os.stat(self.path).st_ino == os.fstat(self._fd).st_ino:
+                os.replace(self.path, self.path + '.1')
+        except FileNotFoundError:
+            pass
+        self._close()
+
+    def export(self, span: Span):
+        document = _otlp(span) if self.format == 'otlp' else _jsonl(span)
+        line = (json.dumps(document, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+        with self._lock:
+            if not self.enabled:
+                return
+            try:
+                if self._fd is None:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                os.write(self._fd, line)
+                self.exported += 1
+                self._failing = False
+                if self.max_bytes and os.fstat(self._fd).st_size >= self.max_bytes:
+                    self._rotate()
+            except OSError as e:
+                self.errors += 1
+                if not self._failing:
+                    logger.error(f"❌ Could not write spans to {self.path}: {e}")
+                    self._failing = True
+                self._close()
+
+    def stats(self) -> Dict:
+        return {
+            "file": self.path or None,
+            "format": self.format,
+            "exported": self.exported,
+            "errors": self.errors,
+        }
+
+
+sink = TraceSink()
+
+
+# ==================== READING TRACES ====================
+
+def _from_otlp(document: Dict) -> List[Dict]:
+    spans = []
+    for resource_spans in document.get('resourceSpans', []):
+        resource = {a['key']: next(iter(a['value'].values()))
+                    for a in resource_spans.get('resource', {}).get('attributes', [])}
+        for scope_spans in resource_spans.get('scopeSpans', []):
+            for s in scope_spans.get('spans', []):
+                start = int(s['startTimeUnixNano']) / 1e9
+                spans.append({
+                    "trace_id": s['traceId'],
+                    "span_id": s['spanId'],
+                    "parent_id": s.get('parentSpanId'),
+                    "name": s['name'],
+                    "service": resource.get('service.name'),
+                    "start": datetime.fromtimestamp(start).isoformat(),
+                    "duration_ms": (int(s['endTimeUnixNano']) / 1e9 - start) * 1000,
+                    "error": s.get('status', {}).get('message'),
+                    "attributes": {a['key']: next(iter(a['value'].values()))
+                                   for a in s.get('attributes', [])},
+                })
+    return spans
+
+
+def load_traces(path: str) -> Dict[str, List[Dict]]:
+    """Spans in path (and its rotated .1 file) grouped by trace, in start order"""
+    traces: Dict[str, List[Dict]] = {}
+    for candidate in (path + '.1', path):
+        if not os.path.exists(candidate):
+            continue
+        with open(candidate, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    document = json.loads(line)
+                except ValueError:
+                    continue
+                spans = _from_otlp(document) if 'resourceSpans' in document else [document]
+                for s in spans:
+                    s['_start'] = datetime.fromisoformat(s['start']).timestamp()
+                    traces.setdefault(s['trace_id'], []).append(s)
+    for spans in traces.values():
+        spans.sort(key=lambda s: s['_start'])
+    return traces
+
+
+def trace_duration(spans: List[Dict]) -> float:
+    """First span start to last span end, in ms"""
+    start = min(s['_start'] for s in spans)
+    return max(s['_start'] * 1000 + s['duration_ms'] for s in spans) - start * 1000
+
+
+def print_trace(trace_id: str, spans: List[Dict]):
+    """Timeline of one trace, children indented under their parents"""
+    parents = {s['span_id']: s.get('parent_id') for s in spans}
+
+    def depth(span_id: str) -> int:
+        level = 0
+        while parents.get(span_id):
+            span_id = parents[span_id]
+            level += 1
+        return level
+
+    t0 = spans[0]['_start']
+    print(f"\nTrace {trace_id} ({trace_duration(spans):,.0f} ms)")
+    print(f"{'start ms':>10} {'duration ms':>12}  span")
+    # Parents before children that started in the same microsecond
+    for s in sorted(spans, key=lambda s: (s['_start'], depth(s['span_id']))):
+        attributes = ', '.join(f"{k}={v}" for k, v in s.get('attributes', {}).items())
+        error = f"  ❌ {s['error']}" if s.get('error') else ''
+        print(f"{(s['_start'] - t0) * 1000:>10,.1f} {s['duration_ms']:>12,.1f}  "
+              f"{'  ' * depth(s['span_id'])}{s['name']} [{s.get('service')}] {attributes}{error}")
+
+
+def print_slowest(traces: Dict[str, List[Dict]], limit: int = 10):
+    """The slowest traces with the stage that took longest in each"""
+    print(f"{'trace':<34} {'total ms':>12}  {'spans':>5}  longest stage")
+    ranked = sorted(traces.items(), key=lambda item: trace_duration(item[1]), reverse=True)
+    for trace_id, spans in ranked[:limit]:
+        longest = max(spans, key=lambda s: s['duration_ms'])
+        print(f"{trace_id:<34} {trace_duration(spans):>12,.1f}  {len(spans):>5}  "
+              f"{longest['name']} ({longest['duration_ms']:,.1f} ms)")
+
+
+if __name__ == '__main__':
+    traces = load_traces(runtime_config.current().TRACE_FILE or 'logs/traces.jsonl')
+    if not traces:
+        print("No traces found")
+    elif len(sys.argv) > 1:
+        for trace_id in sys.argv[1:]:
+            if trace_id in traces:
+                print_trace(trace_id, traces[trace_id])
+            else:
+                print(f"Trace {trace_id} not found")
+    else:
+        print_slowest(traces)
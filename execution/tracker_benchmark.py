@@ -0,0 +1,433 @@
+"""
+Tracker Benchmark - ConversationTracker methods as the database grows
+Seeds tracker databases with synthetic history (up to millions of messages) in
+bulk, times every public ConversationTracker method and runs EXPLAIN QUERY
+PLAN on each statement it executes, flagging full table scans.
+
+Usage:
+    python execution/tracker_benchmark.py
+    python execution/tracker_benchmark.py --scales 10000,100000,1000000 --json tracker.json
+    python execution/tracker_benchmark.py --scales 1000000 --methods get_statistics,get_pending_responses
+"""
+
+import os
+import json
+import time
+import random
+import sqlite3
+import argparse
+import itertools
+import tempfile
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+import config
+from conversation_tracker import ConversationTracker
+from metrics import RollingStats
+from replay_benchmark import SYNTHETIC_OPENERS, SYNTHETIC_FOLLOW_UPS
+
+# Seeded history spans this many days, oldest first
+SEED_DAYS = 365
+# Due pending responses and unsent outbox rows left for the monitor/dispatcher queries
+SEED_DUE_PENDING = 20
+SEED_PENDING_OUTBOX = 2000
+SEED_CACHE_ENTRIES = 500
+SEED_BROADCAST_RECIPIENTS = 5000
+
+SEED_REPLY = ("Merhaba, mesajınız için teşekkür ederiz. Dil ve konuşma terapisi "
+              "değerlendirmesi için size uygun bir randevu saati ayarlayabiliriz.")
+
+_CHUNK = 50_000
+
+
+def _ts(dt: datetime) -> str:
+    """Timestamps in the format sqlite3 stores datetime parameters in"""
+    return dt.isoformat(' ')
+
+
+# ==================== SEEDING ====================
+
+def seed_database(db_path: str, messages: int, per_conversation: int = 20, seed: int = 42) -> Dict:
+    """
+    Fill a new tracker database with `messages` messages over the last SEED_DAYS
+    Half are incoming (each with a processed pending response), 35% AI replies
+    (with ai_responses, outbox and delivery rows) and 15% human replies.
+    """
+    started = time.perf_counter()
+    ConversationTracker(db_path)  # schema and indexes
+    rng = random.Random(seed)
+    conversations = max(1, messages // per_conversation)
+    phones = [f"+90555{index:07d}" for index in range(conversations)]
+    now = datetime.now()
+    first = now - timedelta(days=SEED_DAYS)
+    step = timedelta(days=SEED_DAYS) / max(messages, 1)
+    texts = SYNTHETIC_OPENERS + SYNTHETIC_FOLLOW_UPS
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    cursor = conn.cursor()
+
+    cursor.executemany('''
+        INSERT INTO conversations (id, phone_number, created_at, last_message_at, status)
+        VALUES (?, ?, ?, ?, 'active')
+    ''', [(index + 1, phone, _ts(first), _ts(first)) for index, phone in enumerate(phones)])
+
+    for chunk_start in range(0, messages, _CHUNK):
+        rows = {name: [] for name in ('messages', 'pending', 'ai', 'outbox', 'status')}
+        for n in range(chunk_start, min(chunk_start + _CHUNK, messages)):
+            message_id = n + 1
+            conversation_id = rng.randint(1, conversations)
+            at = first + step * n
+            roll = rng.random()
+            provider_id = f"wamid.SEED{n:012d}"
+            if roll < 0.5:
+                rows['messages'].append((message_id, conversation_id, 'incoming', rng.choice(texts),
+                                         provider_id, _ts(at), 0, 0))
+                status = 'sent' if rng.random() < 0.7 else 'cancelled'
+                rows['pending'].append((message_id, conversation_id, _ts(at + timedelta(minutes=5)),
+                                        _ts(at), status, _ts(at + timedelta(minutes=5))))
+                continue
+
+            is_ai = roll < 0.85
+            rows['messages'].append((message_id, conversation_id, 'outgoing', SEED_REPLY,
+                                     provider_id, _ts(at), int(is_ai), 0))
+            if is_ai:
+                rows['ai'].append((conversation_id, message_id, SEED_REPLY, config.AI_MODEL, 1400,
+                                   0.00021, _ts(at), 1200, 1024, 120, 'openai', 900))
+            rows['outbox'].append((f"seed-{n}", conversation_id, phones[conversation_id - 1],
+                                   SEED_REPLY, int(is_ai), 2 if is_ai else 1, provider_id,
+                                   message_id, _ts(at), _ts(at), _ts(at)))
+            read = rng.random() < 0.6
+            rows['status'].append((provider_id, phones[conversation_id - 1],
+                                   'read' if read else 'delivered', 3 if read else 2, _ts(at),
+                                   _ts(at + timedelta(seconds=1)), _ts(at + timedelta(seconds=3)),
+                                   _ts(at + timedelta(minutes=2)) if read else None))
+
+        cursor.executemany('''
+            INSERT INTO messages (id, conversation_id, direction, message_text, message_id,
+                                  received_at, is_ai_response, human_response_pending)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows['messages'])
+        cursor.executemany('''
+            INSERT INTO pending_responses (message_id, conversation_id, scheduled_for, created_at,
+                                           status, processed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows['pending'])
+        cursor.executemany('''
+            INSERT INTO ai_responses (conversation_id, message_id, response, model, tokens_used,
+                                      cost_estimate, generated_at, input_tokens, cached_input_tokens,
+                                      output_tokens, provider, latency_ms, was_sent)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+        ''', rows['ai'])
+        cursor.executemany('''
+            INSERT INTO outbox (idempotency_key, conversation_id, phone_number, message_text, is_ai,
+                                priority, status, attempts, provider_message_id, sent_message_id,
+                                created_at, next_attempt_at, sent_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'sent', 1, ?, ?, ?, ?, ?)
+        ''', rows['outbox'])
+        cursor.executemany('''
+            INSERT INTO message_status (message_id, provider, recipient, lane, status, status_rank,
+                                        submitted_at, sent_at, delivered_at, read_at)
+            VALUES (?, 'meta', ?, 'ai', ?, ?, ?, ?, ?, ?)
+        ''', rows['status'])
+        conn.commit()
+
+    # Latest activity per conversation
+    cursor.execute('''
+        UPDATE conversations SET last_message_at = COALESCE(
+            (SELECT MAX(received_at) FROM messages WHERE conversation_id = conversations.id),
+            last_message_at)
+    ''')
+
+    # Work that is due now: the monitor's and the dispatcher's queries look for these
+    due = _ts(now - timedelta(minutes=1))
+    cursor.execute('''
+        UPDATE pending_responses SET status = 'pending', scheduled_for = ?, processed_at = NULL
+        WHERE id IN (SELECT id FROM pending_responses ORDER BY id DESC LIMIT ?)
+    ''', (due, SEED_DUE_PENDING))
+    cursor.executemany('''
+        INSERT INTO outbox (idempotency_key, conversation_id, phone_number, message_text, is_ai,
+                            priority, status, created_at, next_attempt_at)
+        VALUES (?, ?, ?, ?, 1, 2, 'pending', ?, ?)
+    ''', [(f"seed-pending-{index}", conversation_id, phones[conversation_id - 1], SEED_REPLY, due, due)
+          for index, conversation_id in enumerate(
+              rng.randint(1, conversations) for _ in range(SEED_PENDING_OUTBOX))])
+
+    cache_keys = [f"seed-cache-{index}" for index in range(SEED_CACHE_ENTRIES)]
+    cursor.executemany('''
+        INSERT INTO response_cache (cache_key, prompt_version, normalized_text, response,
+                                    created_at, last_hit_at, hits)
+        VALUES (?, 'bench', ?, ?, ?, ?, ?)
+    ''', [(key, rng.choice(texts).lower(), SEED_REPLY, _ts(now - timedelta(hours=1)),
+           _ts(now - timedelta(minutes=rng.randint(0, 60))), rng.randint(0, 50)) for key in cache_keys])
+
+    day = first
+    spend = []
+    while day <= now:
+        spend.append((f"day:{day:%Y-%m-%d}", 0.05, _ts(day)))
+        day += timedelta(days=1)
+    cursor.executemany('INSERT OR REPLACE INTO spend_counters (period, spend, updated_at) VALUES (?, ?, ?)',
+                       spend)
+
+    cursor.executemany('''
+        INSERT INTO broadcast_jobs (job_id, phone_number, template_name, status, created_at, updated_at)
+        VALUES ('seed-job', ?, 'randevu_hatirlatma', 'pending', ?, ?)
+    ''', [(phone, _ts(now), _ts(now)) for phone in phones[:SEED_BROADCAST_RECIPIENTS]])
+
+    conn.commit()
+    cursor.execute('ANALYZE')
+    conn.close()
+
+    return {
+        "messages": messages,
+        "conversations": conversations,
+        "phones": phones,
+        "cache_keys": cache_keys,
+        "seed_seconds": round(time.perf_counter() - started, 2),
+        "db_mb": round(os.path.getsize(db_path) / 1024 / 1024, 1),
+    }
+
+
+# ==================== CASES ====================
+
+def benchmark_cases(tracker: ConversationTracker, data: Dict, seed: int = 42) -> Dict[str, Callable]:
+    """One call of each public method with realistic arguments, by method name"""
+    rng = random.Random(seed)
+    counter = itertools.count()
+    claimed: List[int] = []
+
+    def phone():
+        return data['phones'][rng.randrange(data['conversations'])]
+
+    def conversation():
+        return rng.randint(1, data['conversations'])
+
+    def message():
+        return rng.randint(1, data['messages'])
+
+    def cache_key():
+        return rng.choice(data['cache_keys'])
+
+    def claim_outbox():
+        claimed.extend(row['id'] for row in tracker.claim_outbox_messages(10, 60, 5))
+
+    def complete_outbox():
+        batch = claimed[:10]
+        del claimed[:10]
+        tracker.complete_outbox_messages([(outbox_id, f"wamid.BENCHOUT{next(counter)}", None)
+                                          for outbox_id in batch], 5, 30)
+
+    def week_ago():
+        return datetime.now() - timedelta(days=7)
+
+    # Ordered as the pipeline uses them: webhook, monitor, responder, dispatcher, reporting
+    return {
+        'get_or_create_conversation': lambda: tracker.get_or_create_conversation(phone()),
+        'add_incoming_message': lambda: tracker.add_incoming_message(
+            phone(), rng.choice(SYNTHETIC_OPENERS), f"wamid.BENCHIN{next(counter)}"),
+        'schedule_ai_response': lambda: tracker.schedule_ai_response(message(), delay_seconds=3600),
+        'is_conversation_active': lambda: tracker.is_conversation_active(phone()),
+        'get_pending_responses': lambda: tracker.get_pending_responses(),
+        'mark_pending_as_processed': lambda: tracker.mark_pending_as_processed(
+            rng.randint(1, data['messages'] // 2), 'sent'),
+        'get_ai_response_count': lambda: tracker.get_ai_response_count(conversation()),
+        'get_conversation_history': lambda: tracker.get_conversation_history(phone(), 10),
+        'get_messages_between': lambda: tracker.get_messages_between(conversation(), 0, 2 ** 62, 50),
+        'get_conversation_summary': lambda: tracker.get_conversation_summary(conversation()),
+        'save_conversation_summary': lambda: tracker.save_conversation_summary(
+            conversation(), "Veli randevu almak istiyor.", message()),
+        'get_cached_response': lambda: tracker.get_cached_response(
+            cache_key(), datetime.now() - timedelta(days=1)),
+        'get_cached_responses': lambda: tracker.get_cached_responses(
+            'bench', datetime.now() - timedelta(days=1), SEED_CACHE_ENTRIES),
+        'record_cache_hit': lambda: tracker.record_cache_hit(cache_key()),
+        'store_cached_response': lambda: tracker.store_cached_response(
+            f"bench-cache-{next(counter)}", 'bench', 'ucret', SEED_REPLY, SEED_CACHE_ENTRIES,
+            datetime.now() - timedelta(days=1)),
+        'spend_periods': lambda: tracker.spend_periods(datetime.now()),
+        'get_spend': lambda: tracker.get_spend(),
+        'log_ai_response': lambda: tracker.log_ai_response(
+            conversation(), message(), 'prompt', SEED_REPLY, config.AI_MODEL,
+            input_tokens=1200, cached_input_tokens=1024, output_tokens=120),
+        'add_outgoing_message': lambda: tracker.add_outgoing_message(phone(), SEED_REPLY, is_ai=False),
+        'enqueue_outgoing_message': lambda: tracker.enqueue_outgoing_message(
+            phone(), SEED_REPLY, 2, is_ai=True),
+        'claim_outbox_messages': claim_outbox,
+        'complete_outbox_messages': complete_outbox,
+        'get_outbox_message': lambda: tracker.get_outbox_message(rng.randint(1, data['messages'] // 2)),
+        'get_outbox_counts': lambda: tracker.get_outbox_counts(),
+        'record_message_statuses': lambda: tracker.record_message_statuses([{
+            'message_id': f"wamid.SEED{message() - 1:012d}", 'status': 'read', 'at': datetime.now()}]),
+        'get_delivery_rows': lambda: tracker.get_delivery_rows(week_ago()),
+        'create_broadcast_job': lambda: tracker.create_broadcast_job(
+            f"bench-job-{next(counter)}", [phone() for _ in range(50)], 'randevu_hatirlatma'),
+        'claim_broadcast_recipients': lambda: tracker.claim_broadcast_recipients('seed-job', 50),
+        'requeue_broadcast_recipients': lambda: tracker.requeue_broadcast_recipients('seed-job', ['sending']),
+        'update_broadcast_results': lambda: tracker.update_broadcast_results(
+            'seed-job', [(phone(), 'sent', f"wamid.BENCHBC{next(counter)}", None)]),
+        'get_broadcast_progress': lambda: tracker.get_broadcast_progress(),
+        'get_conversation_phones': lambda: tracker.get_conversation_phones('active', week_ago()),
+        'get_statistics': lambda: tracker.get_statistics(),
+    }
+
+
+def public_methods() -> List[str]:
+    return sorted(name for name, value in vars(ConversationTracker).items()
+                  if not name.startswith('_') and callable(getattr(ConversationTracker, name)))
+
+
+# ==================== QUERY PLANS ====================
+
+class TracingTracker(ConversationTracker):
+    """ConversationTracker that records the SQL it executes while `statements` is a list"""
+
+    def __init__(self, db_path):
+        self.statements: Optional[List[str]] = None
+        super().__init__(db_path)
+
+    def _trace(self, statement: str):
+        if self.statements is not None and statement.split(None, 1)[0].upper() in (
+                'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            self.statements.append(statement)
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.set_trace_callback(self._trace)
+        return conn
+
+
+def explain(conn: sqlite3.Connection, statement: str) -> Dict:
+    """
+    Query plan of one statement
+    'SCAN table' is a full table scan; 'SCAN table USING INDEX' still reads
+    the whole index; 'SEARCH' is an index lookup.
+    """
+    plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {statement}')]
+    return {
+        "sql": ' '.join(statement.split()),
+        "plan": plan,
+        "full_scans": [line.split()[1] for line in plan
+                       if line.startswith('SCAN ') and ' USING ' not in line],
+        "index_scans": [line.split()[1] for line in plan
+                        if line.startswith('SCAN ') and ' USING ' in line],
+    }
+
+
+# ==================== RUN ====================
+
+def run_case(tracker: TracingTracker, call: Callable, explain_conn: sqlite3.Connection,
+             iterations: int, max_seconds: float) -> Dict:
+    """Trace one call for query plans, then time up to `iterations` calls"""
+    tracker.statements = []
+    call()
+    statements = list(dict.fromkeys(tracker.statements))
+    tracker.statements = None
+    plans = [explain(explain_conn, statement) for statement in statements]
+
+    latency = RollingStats(window=max(iterations, 1))
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        call()
+        latency.add((time.perf_counter() - call_started) * 1000)
+        if time.perf_counter() - started > max_seconds:
+            break
+    elapsed = time.perf_counter() - started
+    summary = latency.summary()
+    return {
+        "calls": summary['count'],
+        "calls_per_second": round(summary['count'] / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": summary,
+        "full_scan": sorted({table for plan in plans for table in plan['full_scans']}),
+        "statements": plans,
+    }
+
+
+def run_scale(messages: int, args, workdir: str) -> Dict:
+    db_path = os.path.join(workdir, f"tracker-{messages}.db")
+    print(f"\n🌱 Seeding {messages:,} messages...", flush=True)
+    data = seed_database(db_path, messages, args.messages_per_conversation, args.seed)
+    print(f"   {data['conversations']:,} conversations, {data['db_mb']} MB in {data['seed_seconds']}s")
+
+    tracker = TracingTracker(db_path)
+    cases = benchmark_cases(tracker, data, args.seed)
+    missing = sorted(set(public_methods()) - set(cases))
+    if missing:
+        print(f"   ⚠️ No benchmark case for: {', '.join(missing)}")
+    if args.methods:
+        cases = {name: call for name, call in cases.items() if name in args.methods}
+    explain_conn = sqlite3.connect(db_path)
+    results = {name: run_case(tracker, call, explain_conn, args.iterations, args.max_seconds)
+               for name, call in cases.items()}
+    explain_conn.close()
+    if not args.keep:
+        os.remove(db_path)
+    return {
+        "messages": messages,
+        "conversations": data['conversations'],
+        "db_mb": data['db_mb'],
+        "seed_seconds": data['seed_seconds'],
+        "methods": results,
+    }
+
+
+def print_scale(scale: Dict):
+    print(f"\n{'method':<30}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  plan")
+    for name, r in scale['methods'].items():
+        s = r['latency_ms']
+        index_scans = sorted({t for plan in r['statements'] for t in plan['index_scans']})
+        plan = (f"⚠️ full scan: {', '.join(r['full_scan'])}" if r['full_scan'] else
+                f"index scan: {', '.join(index_scans)}" if index_scans else "ok")
+        print(f"{name:<30}{r['calls']:>7}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['p99']:>10.3f}"
+              f"{s['max']:>10.3f}  {plan}")
+
+
+def print_scaling(scales: List[Dict]):
+    """p50 per method at each size, and how much it grew from the smallest"""
+    header = f"{'method':<30}" + ''.join(f"{scale['messages']:>12,}" for scale in scales) + f"{'growth':>9}"
+    print(f"\np50 ms by message count\n{header}")
+    for name in scales[0]['methods']:
+        values = [scale['methods'][name]['latency_ms']['p50'] for scale in scales]
+        growth = values[-1] / values[0] if values[0] else 0.0
+        size_growth = scales[-1]['messages'] / scales[0]['messages']
+        flag = "  ⚠️" if size_growth > 1 and growth > size_growth ** 0.5 else ""
+        print(f"{name:<30}" + ''.join(f"{value:>12.3f}" for value in values) + f"{growth:>8.1f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ConversationTracker methods at growing DB sizes")
+    parser.add_argument('--scales', default='10000,100000',
+                        help="Comma-separated message counts to seed (e.g. 10000,100000,1000000)")
+    parser.add_argument('--messages-per-conversation', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=200, help="Timed calls per method")
+    parser.add_argument('--max-seconds', type=float, default=2.0, help="Time limit per method")
+    parser.add_argument('--methods', type=lambda value: value.split(','),
+                        help="Only these methods (comma-separated)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help="Where to create the databases (default: temporary)")
+    parser.add_argument('--keep', action='store_true', help="Keep the seeded databases")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    scales = [int(value) for value in args.scales.split(',')]
+    workdir = args.workdir or tempfile.mkdtemp(prefix='tracker-bench-')
+    os.makedirs(workdir, exist_ok=True)
+
+    results = []
+    for messages in scales:
+        scale = run_scale(messages, args, workdir)
+        print_scale(scale)
+        results.append(scale)
+    if len(results) > 1:
+        print_scaling(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"sqlite": sqlite3.sqlite_version, "scales": results}, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.json}")
+    if not args.workdir and not args.keep:
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,522 @@
+"""
+Webhook Benchmark - Load-test the inbound webhook end to end
+Drives /webhook with synthetic Meta, 360Dialog or Twilio payloads through the
+Flask test client or a real gunicorn with N workers, with a stub LLM and the
+WhatsApp simulator behind it. Reports throughput, p50/p95/p99 latency, SQLite
+lock errors and database growth per 10k messages; --baseline compares runs.
+
+Usage:
+    python execution/webhook_benchmark.py --messages 2000
+    python execution/webhook_benchmark.py --server gunicorn --workers 4 --concurrency 32 --json webhook.json
+    python execution/webhook_benchmark.py --provider twilio --baseline webhook.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import random
+import sqlite3
+import argparse
+import contextlib
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+from metrics import RollingStats, Timer
+
+EXECUTION_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(EXECUTION_DIR)
+
+BENCH_TENANT = 'bench'
+
+# Read by stubbed_app() in gunicorn workers
+STUB_LATENCY_ENV = 'WEBHOOK_BENCH_LLM_LATENCY_MS'
+
+# Log records (not traceback lines) reporting SQLite lock timeouts
+_LOCK_ERROR_RE = re.compile(r'^\d{4}-\d{2}-\d{2} .*database is locked')
+
+
+def stubbed_app(llm_latency_ms: Optional[float] = None):
+    """
+    The webhook Flask app with every tenant using the replay benchmark's stub LLM
+    Also the gunicorn app factory ('webhook_benchmark:stubbed_app()').
+    """
+    from replay_benchmark import StubLLMClient
+    from tenants import TenantRegistry
+
+    if llm_latency_ms is None:
+        llm_latency_ms = float(os.getenv(STUB_LATENCY_ENV, '50'))
+    stubs = {}
+    lock = threading.Lock()
+
+    def client_factory(provider):
+        with lock:
+            if provider not in stubs:
+                stubs[provider] = StubLLMClient(provider, latency_ms=llm_latency_ms)
+            return stubs[provider]
+
+    TenantRegistry.client_factory = staticmethod(client_factory)
+    from whatsapp_webhook_server import app
+    return app
+
+
+# ==================== SETUP ====================
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def benchmark_environment(workdir: str, api_port: int, args) -> Dict[str, str]:
+    """
+    Environment for the server under test
+    Everything it writes stays in workdir; sends go to the simulator and the
+    API keys are placeholders, so nothing reaches a real provider.
+    """
+    api_url = f"http://127.0.0.1:{api_port}"
+    return {
+        'TENANTS_FILE': os.path.join(workdir, 'tenants.json'),
+        'DATABASE_PATH': os.path.join(workdir, 'data', 'bench.db'),
+        'EMBEDDED_MONITOR': 'false' if args.no_monitor else 'true',
+        'MONITOR_CHECK_INTERVAL': '1',
+        'MONITOR_STATUS_PORT': '0',
+        'MONITOR_LOCK_FILE': os.path.join(workdir, 'data', 'monitor.lock'),
+        'OUTBOX_NOTIFY_PORT': str(_free_port()),
+        'MONITOR_STATUS_FILE': os.path.join(workdir, 'logs', 'monitor_status.json'),
+        'CONFIG_WATCH_INTERVAL': '0',
+        'QUICK_REPLIES_FILE': os.path.join(PROJECT_DIR, 'quick-replies-reference.txt'),
+        'EMERGENCY_TERMS_FILE': os.path.join(PROJECT_DIR, 'emergency-terms.txt'),
+        'META_API_URL': f"{api_url}/v18.0",
+        'DIALOG360_API_URL': f"{api_url}/v1",
+        'TWILIO_API_URL': api_url,
+        'OPENAI_API_KEY': 'bench-stub',
+        'ANTHROPIC_API_KEY': 'bench-stub',
+        STUB_LATENCY_ENV: str(args.llm_latency_ms),
+    }
+
+
+def write_tenants_file(path: str, workdir: str, args):
+    """
+    One tenant receiving on the simulator's number
+    Business hours cover the whole week (or nothing with --outside-hours) so
+    results do not depend on when the benchmark runs.
+    """
+    from whatsapp_simulator import SIM_PHONE_NUMBER_ID, SIM_BUSINESS_NUMBER
+
+    tenant = {
+        "WHATSAPP_API_PROVIDER": args.provider,
+        "WHATSAPP_API_KEY": "bench-stub",
+        "WHATSAPP_PHONE_NUMBER_ID": SIM_PHONE_NUMBER_ID,
+        "TWILIO_ACCOUNT_SID": "ACSIMULATOR",
+        "TWILIO_AUTH_TOKEN": "bench-stub",
+        "TWILIO_WHATSAPP_NUMBER": f"whatsapp:{SIM_BUSINESS_NUMBER}",
+        "DATABASE_PATH": os.path.join(workdir, 'data', 'bench.db'),
+        "BUSINESS_DAYS": [] if args.outside_hours else list(range(7)),
+        "BUSINESS_HOURS_START": "00:00",
+        "BUSINESS_HOURS_END": "23:59",
+        "HOLIDAYS_FILE": "",
+        "RESPONSE_DELAY": args.response_delay,
+        "IMMEDIATE_RESPONSE_OUTSIDE_HOURS": True,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({BENCH_TENANT: tenant}, f, indent=2)
+
+
+# ==================== LOAD ====================
+
+class WebhookLoad:
+    """
+    Closed loop: `concurrency` clients each post the next inbound message as
+    soon as the previous one is answered, so throughput is what the server sustains
+    """
+
+    def __init__(self, post: Callable[[Dict], int], provider: str, concurrency: int,
+                 senders: int = 500, seed: int = 42):
+        from whatsapp_simulator import INBOUND_BUILDERS
+        from replay_benchmark import SYNTHETIC_OPENERS, SYNTHETIC_FOLLOW_UPS
+
+        self.post = post
+        self.build = INBOUND_BUILDERS[provider]
+        self.provider = provider
+        self.concurrency = concurrency
+        self.rng = random.Random(seed)
+        self.senders = [f"+90555{index:07d}" for index in range(senders)]
+        self.texts = (SYNTHETIC_OPENERS, SYNTHETIC_FOLLOW_UPS)
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+    def next_payload(self) -> Dict:
+        with self._lock:
+            self._sequence += 1
+            sender = self.rng.choice(self.senders)
+            text = self.rng.choice(self.texts[0] if self.rng.random() < 0.6 else self.texts[1])
+            message_id = (f"SMBENCH{self._sequence:026d}" if self.provider == 'twilio'
+                          else f"wamid.BENCH{self._sequence:012d}")
+        return self.build(sender, text, message_id)
+
+    def run(self, count: int) -> Dict:
+        """Post `count` messages; latency in ms and responses by status code"""
+        latency = RollingStats(window=max(count, 1))
+        responses = Counter()
+        remaining = [count]
+        counter_lock = threading.Lock()
+
+        def client():
+            while True:
+                with counter_lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                payload = self.next_payload()
+                with Timer() as timer:
+                    try:
+                        outcome = str(self.post(payload))
+                    except Exception as e:
+                        outcome = type(e).__name__
+                latency.add(timer.elapsed * 1000)
+                with counter_lock:
+                    responses[outcome] += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for _ in range(self.concurrency):
+                pool.submit(client)
+        elapsed = time.perf_counter() - started
+        return {"elapsed": elapsed, "latency_ms": latency.summary(), "responses": dict(responses)}
+
+
+def flask_poster(app, provider: str) -> Callable[[Dict], int]:
+    """Post through the Flask test client (one per thread)"""
+    local = threading.local()
+
+    def post(payload: Dict) -> int:
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        if provider == 'twilio':
+            return local.client.post('/webhook', data=payload).status_code
+        return local.client.post('/webhook', json=payload).status_code
+
+    return post
+
+
+def http_poster(url: str, provider: str, pool_size: int) -> Callable[[Dict], int]:
+    """Post over HTTP with a pooled session"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from whatsapp_simulator import post_webhook
+
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_maxsize=pool_size))
+
+    def post(payload: Dict) -> int:
+        return post_webhook(session, url, provider, payload).status_code
+
+    return post
+
+
+# ==================== DATABASE ====================
+
+def database_bytes(path: str) -> int:
+    """Database file plus its journal/WAL"""
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal", f"{path}-journal")
+               if os.path.exists(p))
+
+
+def _count_by_status(cursor, table: str) -> Dict[str, int]:
+    cursor.execute(f'SELECT status, COUNT(*) FROM {table} GROUP BY status')
+    return dict(cursor.fetchall())
+
+
+def pipeline_state(path: str) -> Dict:
+    """Row counts of what the messages turned into"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+    cursor = conn.cursor()
+    rows = {}
+    for table in ('conversations', 'messages', 'pending_responses', 'ai_responses', 'outbox'):
+        cursor.execute(f'SELECT COUNT(*) FROM {table}')
+        rows[table] = cursor.fetchone()[0]
+    state = {
+        "rows": rows,
+        "pending_responses": _count_by_status(cursor, 'pending_responses'),
+        "outbox": _count_by_status(cursor, 'outbox'),
+    }
+    conn.close()
+    return state
+
+
+def drain(path: str, timeout: float) -> float:
+    """Wait until due AI responses and the outbox are processed; returns seconds waited"""
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        state = pipeline_state(path)
+        if (not state['pending_responses'].get('pending') and
+                not state['outbox'].get('pending') and not state['outbox'].get('sending')):
+            break
+        time.sleep(0.2)
+    return time.monotonic() - started
+
+
+def count_lock_errors(log_path: str) -> int:
+    if not os.path.exists(log_path):
+        return 0
+    with open(log_path, encoding='utf-8', errors='replace') as f:
+        return sum(1 for line in f if _LOCK_ERROR_RE.match(line))
+
+
+# ==================== SERVERS ====================
+
+def run_flask(args, db_path: str) -> Dict:
+    """In-process: the app is driven through Flask's test client"""
+    import logging
+    app = stubbed_app(args.llm_latency_ms)
+    if not args.verbose:
+        # Keep the file log (part of the cost of a request), drop the console copy
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if type(handler) is logging.StreamHandler:
+                root.removeHandler(handler)
+
+    import whatsapp_webhook_server as server
+    # The sender and monitor print per message; keep that out of the report
+    output = open(os.devnull, 'w') if not args.verbose else sys.stdout
+    try:
+        with contextlib.redirect_stdout(output):
+            return measure(flask_poster(app, args.provider), args, db_path)
+    finally:
+        if server.monitor:
+            server.monitor.stop()
+        server.tenants.stop()
+        if output is not sys.stdout:
+            output.close()
+
+
+def _wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not answer {url} within {timeout}s")
+
+
+def run_gunicorn(args, db_path: str, workdir: str, env: Dict[str, str]) -> Dict:
+    """Out of process: a real gunicorn with --workers sync (or --threads gthread) workers"""
+    port = _free_port()
+    command = [sys.executable, '-m', 'gunicorn',
+               '--workers', str(args.workers), '--threads', str(args.threads),
+               '--bind', f'127.0.0.1:{port}', '--timeout', '60', '--graceful-timeout', '20',
+               'webhook_benchmark:stubbed_app()']
+    env = dict(os.environ, **env,
+               PYTHONPATH=os.pathsep.join(filter(None, [EXECUTION_DIR, os.environ.get('PYTHONPATH')])))
+    log = open(os.path.join(workdir, 'logs', 'gunicorn.log'), 'w')
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        _wait_until_ready(f"http://127.0.0.1:{port}/health", process)
+        return measure(http_poster(f"http://127.0.0.1:{port}/webhook", args.provider,
+                                   args.concurrency), args, db_path)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+
+
+def measure(post: Callable[[Dict], int], args, db_path: str) -> Dict:
+    """Warm up, record the database size, run the measured load, then drain"""
+    load = WebhookLoad(post, args.provider, args.concurrency, args.senders, args.seed)
+    if args.warmup:
+        load.run(args.warmup)
+        drain(db_path, args.drain_seconds)
+    bytes_before = database_bytes(db_path)
+
+    result = load.run(args.messages)
+    waited = drain(db_path, args.drain_seconds) if not args.no_monitor else 0.0
+    bytes_after = database_bytes(db_path)
+
+    ok = sum(n for code, n in result['responses'].items() if code.startswith('2'))
+    growth = (bytes_after - bytes_before) / args.messages * 10_000 if args.messages else 0
+    return {
+        "elapsed_seconds": round(result['elapsed'], 3),
+        "throughput_per_second": round(ok / result['elapsed'], 1) if result['elapsed'] else 0.0,
+        "latency_ms": result['latency_ms'],
+        "responses": result['responses'],
+        "server_errors": sum(n for code, n in result['responses'].items() if not code.startswith(('2', '4'))),
+        "drain_seconds": round(waited, 2),
+        "pipeline": pipeline_state(db_path),
+        "database": {
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "growth_mb_per_10k_messages": round(growth / 1024 / 1024, 3),
+        },
+    }
+
+
+# ==================== REPORT ====================
+
+# (label, path into the report, higher is better)
+COMPARED = [
+    ("throughput/s", ("throughput_per_second",), True),
+    ("p50 ms", ("latency_ms", "p50"), False),
+    ("p95 ms", ("latency_ms", "p95"), False),
+    ("p99 ms", ("latency_ms", "p99"), False),
+    ("lock errors", ("sqlite_lock_errors",), False),
+    ("server errors", ("server_errors",), False),
+    ("DB MB/10k msgs", ("database", "growth_mb_per_10k_messages"), False),
+]
+
+
+def _lookup(report: Dict, path):
+    for key in path:
+        report = (report or {}).get(key)
+    return report
+
+
+def print_report(report: Dict, baseline: Optional[Dict] = None):
+    print("=" * 60)
+    print("Webhook Load Benchmark")
+    print("=" * 60)
+    server = report['server']
+    if server == 'gunicorn':
+        server += f" ({report['workers']} workers x {report['threads']} threads)"
+    print(f"Server: {server}   Provider: {report['provider']}   Commit: {report['commit'] or '-'}")
+    print(f"Messages: {report['messages']}   Concurrency: {report['concurrency']}   "
+          f"Stub LLM: {report['llm_latency_ms']} ms   Monitor: {'on' if report['monitor'] else 'off'}")
+    print(f"Elapsed: {report['elapsed_seconds']}s   Responses: {report['responses']}")
+    p = report['pipeline']
+    print(f"Pipeline: {p['rows']['messages']} messages, {p['rows']['ai_responses']} AI responses, "
+          f"outbox {p['outbox']} (drained in {report['drain_seconds']}s)")
+
+    header = f"\n{'metric':<18}{'value':>12}"
+    if baseline:
+        header += f"{'baseline':>12}{'change':>10}"
+    print(header)
+    for label, path, higher_is_better in COMPARED:
+        value = _lookup(report, path)
+        line = f"{label:<18}{round(value, 1):>12}"
+        if baseline:
+            previous = _lookup(baseline, path)
+            if previous is None:
+                line += f"{'-':>12}{'':>10}"
+            else:
+                change = (value - previous) / previous if previous else 0.0
+                line += f"{round(previous, 1):>12}" + (f"{change:>+10.1%}" if previous else f"{value - previous:>+10}")
+                # Flag regressions over 10%
+                if (change < -0.1) if higher_is_better else (change > 0.1):
+                    line += "  ⚠️"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the inbound webhook")
+    parser.add_argument('--server', choices=('flask', 'gunicorn'), default='flask',
+                        help="Flask test client in-process, or a real gunicorn")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers")
+    parser.add_argument('--threads', type=int, default=1, help="Threads per gunicorn worker")
+    parser.add_argument('--provider', choices=('meta', '360dialog', 'twilio'), default='meta')
+    parser.add_argument('--messages', type=int, default=2000, help="Measured inbound messages")
+    parser.add_argument('--warmup', type=int, default=50, help="Unmeasured messages first")
+    parser.add_argument('--concurrency', type=int, default=8, help="Clients posting in parallel")
+    parser.add_argument('--senders', type=int, default=500, help="Distinct customer numbers")
+    parser.add_argument('--llm-latency-ms', type=float, default=50, help="Stub LLM latency")
+    parser.add_argument('--send-latency-ms', type=float, default=20, help="Simulated send API latency")
+    parser.add_argument('--response-delay', type=int, default=0,
+                        help="RESPONSE_DELAY; 0 generates the AI replies during the run")
+    parser.add_argument('--outside-hours', action='store_true',
+                        help="Clinic closed: every message also gets the outside-hours reply")
+    parser.add_argument('--no-monitor', action='store_true', help="Only the webhook, no AI replies")
+    parser.add_argument('--drain-seconds', type=float, default=30,
+                        help="Max wait for replies and sends after the load")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help="Keep the database and logs here (default: temporary)")
+    parser.add_argument('--verbose', action='store_true', help="Show the server log (flask mode)")
+    parser.add_argument('--json', help="Also write the report to this JSON file")
+    parser.add_argument('--baseline', help="Compare against a previous --json report")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='webhook-bench-')
+    os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+    os.makedirs(os.path.join(workdir, 'data'), exist_ok=True)
+    db_path = os.path.join(workdir, 'data', 'bench.db')
+    api_port = _free_port()
+    env = benchmark_environment(workdir, api_port, args)
+    # Set before anything imports config (the simulator does)
+    os.environ.update(env)
+    os.chdir(workdir)
+
+    from whatsapp_simulator import ProviderSimulator, LatencyModel, make_server
+    write_tenants_file(env['TENANTS_FILE'], workdir, args)
+    simulator = ProviderSimulator(LatencyModel(args.send_latency_ms, distribution='fixed'))
+    api_server = make_server(simulator, '127.0.0.1', api_port)
+    threading.Thread(target=api_server.serve_forever, name='simulator', daemon=True).start()
+
+    try:
+        if args.server == 'gunicorn':
+            results = run_gunicorn(args, db_path, workdir, env)
+        else:
+            results = run_flask(args, db_path)
+    finally:
+        api_server.shutdown()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": sys.version.split()[0],
+        "server": args.server,
+        "workers": args.workers if args.server == 'gunicorn' else None,
+        "threads": args.threads if args.server == 'gunicorn' else None,
+        "provider": args.provider,
+        "messages": args.messages,
+        "concurrency": args.concurrency,
+        "llm_latency_ms": args.llm_latency_ms,
+        "send_latency_ms": args.send_latency_ms,
+        "response_delay": args.response_delay,
+        "outside_hours": args.outside_hours,
+        "monitor": not args.no_monitor,
+        **results,
+        "sqlite_lock_errors": count_lock_errors(os.path.join(workdir, 'logs', 'webhook.log')),
+        "simulator": simulator.stats()['counters'],
+    }
+
+    print_report(report, baseline)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nReport written to {args.json}")
+    if args.workdir:
+        print(f"Database and logs kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,26 +3,417 @@ WhatsApp Sender - Send messages via WhatsApp Business API
 Supports multiple providers: Twilio, Meta, 360Dialog
 """
 
+import time
+import threading
+from collections import deque
 import requests
-from twilio.rest import Client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import config
-from typing import Optional
+from metrics import MetricsRegistry, Timer
+from providers import whatsapp_client_class, load_sdk
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Only retry what the provider certainly did not process: connection
+# failures, rate limiting and "unavailable". Other 5xx may have sent.
+RETRY_STATUSES = (429, 503)
+
+
+def make_session(headers: dict, pool_size: int = config.WHATSAPP_POOL_SIZE,
+                 max_retries: int = config.WHATSAPP_MAX_RETRIES) -> requests.Session:
+    """Keep-alive session with a bounded connection pool and safe retries"""
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({'GET', 'POST'}),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                          max_retries=retry, pool_block=True)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(headers)
+    return session
+
+
+# ==================== OUTBOUND QUEUE ====================
+
+# Priority lanes, highest first
+PRIORITY_EMERGENCY = 0
+PRIORITY_HUMAN = 1
+PRIORITY_AI = 2
+PRIORITY_BULK = 3
+LANE_NAMES = ('emergency', 'human', 'ai', 'bulk')
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `capacity`; rate 0 = unlimited"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 = available now)"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundItem:
+    """One queued message; wait() blocks until it was sent or failed"""
+
+    def __init__(self, to_number: str, message: str, priority: int,
+                 callback: Optional[Callable[['OutboundItem'], None]] = None,
+                 template: Optional[Dict] = None):
+        self.to_number = to_number
+        self.message = message
+        self.priority = priority
+        self.callback = callback
+        self.template = template  # send_template_message kwargs instead of text
+        self.enqueued_at = time.monotonic()
+        self.status = 'queued'  # queued, sending, sent, failed, cancelled
+        self.message_id: Optional[str] = None
+        self._done = threading.Event()
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Get the provider message ID, or None if failed or still queued after timeout"""
+        self._done.wait(timeout)
+        return self.message_id
+
+
+def _recipient_key(to_number: str) -> str:
+    return to_number.replace('whatsapp:', '').replace('+', '')
+
+
+class OutboundQueue:
+    """
+    Paced, prioritized dispatch for outgoing messages
+    Worker threads take the oldest message from the highest non-empty lane
+    whose recipient has a token, as long as the provider bucket has one.
+    A rate-limited recipient never blocks other recipients, and messages to
+    the same recipient keep their order.
+    """
+
+    # How far into a lane to look past rate-limited recipients
+    SCAN_LIMIT = 200
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, sender: 'WhatsAppSender',
+                 rate_per_second: float = config.WHATSAPP_RATE_PER_SECOND,
+                 burst: int = config.WHATSAPP_RATE_BURST,
+                 recipient_per_minute: float = config.WHATSAPP_RECIPIENT_PER_MINUTE,
+                 recipient_burst: int = config.WHATSAPP_RECIPIENT_BURST,
+                 workers: int = config.WHATSAPP_SEND_WORKERS):
+        self.sender = sender
+        self.provider_bucket = TokenBucket(rate_per_second, burst)
+        self.recipient_rate = recipient_per_minute / 60
+        self.recipient_burst = recipient_burst
+        self.recipient_buckets: Dict[str, TokenBucket] = {}
+        self.lanes = [deque() for _ in LANE_NAMES]
+        self.worker_count = max(workers, 1)
+        self.metrics = MetricsRegistry()
+        self.in_flight = 0
+        self.listeners: List[Callable[[OutboundItem], None]] = []
+        self._workers: List[threading.Thread] = []
+        self._running = False
+        self._last_prune = time.monotonic()
+        self._cond = threading.Condition()
+
+    # ---------- producer API ----------
+
+    def submit(self, to_number: str, message: str, priority: int = PRIORITY_AI,
+               callback: Optional[Callable[[OutboundItem], None]] = None) -> OutboundItem:
+        """Queue one message; callback(item) runs on a worker thread when done"""
+        return self.submit_many([(to_number, message, priority, callback)])[0]
+
+    def submit_many(self, messages: List[Tuple]) -> List[OutboundItem]:
+        """
+        Queue several messages under one lock acquisition
+        Each entry is (to_number, message[, priority[, callback]]).
+        """
+        items = []
+        for entry in messages:
+            to_number, message = entry[0], entry[1]
+            priority = entry[2] if len(entry) > 2 else PRIORITY_AI
+            callback = entry[3] if len(entry) > 3 else None
+            items.append(OutboundItem(to_number, message, priority, callback))
+        return self._enqueue(items)
+
+    def submit_templates(self, to_numbers: List[str], template_name: str,
+                         language_code: str = "tr", components: list = None,
+                         priority: int = PRIORITY_BULK,
+                         callback: Optional[Callable[[OutboundItem], None]] = None) -> List[OutboundItem]:
+        """Queue one template message per recipient under one lock acquisition"""
+        template = {"template_name": template_name, "language_code": language_code,
+                    "components": components}
+        return self._enqueue([OutboundItem(to_number, f"[template:{template_name}]", priority,
+                                           callback, template=template)
+                              for to_number in to_numbers])
+
+    def _enqueue(self, items: List[OutboundItem]) -> List[OutboundItem]:
+        for item in items:
+            if not 0 <= item.priority < len(LANE_NAMES):
+                raise ValueError(f"Unknown send priority: {item.priority}")
+        with self._cond:
+            self._ensure_workers()
+            for item in items:
+                self.lanes[item.priority].append(item)
+            self._cond.notify_all()
+        return items
+
+    def send(self, to_number: str, message: str, priority: int = PRIORITY_AI,
+             timeout: float = config.WHATSAPP_QUEUE_TIMEOUT) -> Optional[str]:
+        """
+        Queue a message and wait for it to go out
+        Returns the provider message ID, or None if sending failed. A message
+        still waiting for a rate limit slot after `timeout` is withdrawn.
+        """
+        item = self.submit(to_number, message, priority)
+        message_id = item.wait(timeout)
+        if item.status in ('queued', 'sending') and not self.cancel(item):
+            # Already on the wire; its result is worth waiting for
+            message_id = item.wait()
+        return message_id
+
+    def add_listener(self, listener: Callable[[OutboundItem], None]):
+        """Call listener(item) on the worker thread after every send attempt"""
+        self.listeners.append(listener)
+
+    def set_rate(self, rate_per_second: float, burst: int):
+        """Change the provider-wide send rate (0 = unlimited)"""
+        with self._cond:
+            self.provider_bucket = TokenBucket(rate_per_second, burst)
+
+    def cancel(self, item: OutboundItem) -> bool:
+        """Withdraw a message that has not started sending"""
+        with self._cond:
+            if item.status != 'queued':
+                return False
+            self.lanes[item.priority].remove(item)
+            item.status = 'cancelled'
+            self.metrics.increment(f'cancelled.{LANE_NAMES[item.priority]}')
+        item._done.set()
+        return True
+
+    # ---------- workers ----------
+
+    def _ensure_workers(self):
+        """Start worker threads on first use (caller holds the lock)"""
+        if self._running:
+            return
+        self._running = True
+        self._workers = [threading.Thread(target=self._work, name=f'whatsapp-send-{i}', daemon=True)
+                         for i in range(self.worker_count)]
+        for worker in self._workers:
+            worker.start()
+
+    def _recipient_bucket(self, key: str) -> TokenBucket:
+        bucket = self.recipient_buckets.get(key)
+        if bucket is None:
+            bucket = self.recipient_buckets[key] = TokenBucket(self.recipient_rate, self.recipient_burst)
+        return bucket
+
+    def _prune(self, now: float):
+        """Forget recipients whose bucket has refilled completely"""
+        if now - self._last_prune < self.PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        for key in [k for k, b in self.recipient_buckets.items() if b.is_full(now)]:
+            del self.recipient_buckets[key]
+
+    def _next_ready(self, now: float) -> Tuple[Optional[OutboundItem], Optional[float]]:
+        """Pop the next sendable item, or get how long to wait (None = until notified)"""
+        self._prune(now)
+        if not any(self.lanes):
+            return None, None
+        provider_wait = self.provider_bucket.wait_time(now)
+        if provider_wait:
+            return None, provider_wait
+
+        soonest = None
+        for lane in self.lanes:
+            blocked = set()
+            for index, item in enumerate(lane):
+                if index >= self.SCAN_LIMIT:
+                    break
+                key = _recipient_key(item.to_number)
+                if key in blocked:
+                    continue
+                bucket = self._recipient_bucket(key)
+                wait = bucket.wait_time(now)
+                if wait:
+                    blocked.add(key)
+                    soonest = wait if soonest is None else min(soonest, wait)
+                    continue
+                del lane[index]
+                bucket.take()
+                self.provider_bucket.take()
+                return item, 0.0
+        return None, soonest
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    item, wait = self._next_ready(time.monotonic())
+                    if item:
+                        item.status = 'sending'
+                        self.in_flight += 1
+                        break
+                    self._cond.wait(timeout=wait)
+            try:
+                self._deliver(item)
+            finally:
+                with self._cond:
+                    self.in_flight -= 1
+                    self._cond.notify_all()
+
+    def _deliver(self, item: OutboundItem):
+        lane = LANE_NAMES[item.priority]
+        self.metrics.observe(f'wait_seconds.{lane}', time.monotonic() - item.enqueued_at)
+        with Timer() as timer:
+            try:
+                if item.template:
+                    item.message_id = self.sender.send_template_message(item.to_number, **item.template)
+                else:
+                    item.message_id = self.sender.send_message(item.to_number, item.message)
+            except Exception as e:
+                print(f"❌ Queued send to {item.to_number} failed: {e}")
+                item.message_id = None
+        self.metrics.observe('send_seconds', timer.elapsed)
+        item.status = 'sent' if item.message_id else 'failed'
+        self.metrics.increment(f'{item.status}.{lane}')
+        item._done.set()
+
+        for callback in [item.callback, *self.listeners]:
+            if callback:
+                try:
+                    callback(item)
+                except Exception as e:
+                    print(f"❌ Send callback error: {e}")
+
+    def stop(self, timeout: float = 10):
+        """Let queued messages drain for up to `timeout` seconds, then stop the workers"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (any(self.lanes) or self.in_flight) and self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(timeout=min(remaining, 0.5))
+            self._running = False
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout=max(deadline - time.monotonic(), 0.1))
+
+    def depth(self) -> int:
+        with self._cond:
+            return sum(len(lane) for lane in self.lanes)
+
+    def stats(self) -> Dict:
+        """Queue depth per lane, in-flight sends, wait times and outcome counters"""
+        with self._cond:
+            depth = {name: len(lane) for name, lane in zip(LANE_NAMES, self.lanes)}
+            in_flight = self.in_flight
+            recipients = len(self.recipient_buckets)
+        return {
+            "depth": depth,
+            "queued": sum(depth.values()),
+            "in_flight": in_flight,
+            "tracked_recipients": recipients,
+            **self.metrics.snapshot()
+        }
+
 
 class WhatsAppSender:
-    def __init__(self):
-        self.provider = config.WHATSAPP_API_PROVIDER
+    def __init__(self, settings=None, session: Optional[requests.Session] = None):
+        """
+        settings: config-like object with the provider credentials (default config)
+        session: shared HTTP session for Meta/360Dialog (auth headers are sent
+        per request, so several numbers can use one connection pool)
+        """
+        settings = settings or config
+        self.provider = settings.WHATSAPP_API_PROVIDER
+        self.timeout = (config.WHATSAPP_CONNECT_TIMEOUT, config.WHATSAPP_READ_TIMEOUT)
+        self.session = None
+        self.owns_session = session is None
+        self.headers = {}
 
         if self.provider == 'twilio':
-            self.client = Client(config.TWILIO_ACCOUNT_SID, config.TWILIO_AUTH_TOKEN)
-            self.from_number = config.TWILIO_WHATSAPP_NUMBER
+            Client = whatsapp_client_class('twilio')
+            TwilioHttpClient = load_sdk('twilio.http.http_client', 'twilio').TwilioHttpClient
+            # Twilio's client pools connections itself; give it a timeout and retries
+            http_client = TwilioHttpClient(pool_connections=True,
+                                           timeout=config.WHATSAPP_READ_TIMEOUT,
+                                           max_retries=config.WHATSAPP_MAX_RETRIES)
+            self.client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN,
+                                 http_client=http_client)
+            if config.TWILIO_API_URL:
+                self.client.api.base_url = config.TWILIO_API_URL.rstrip('/')
+            self.from_number = settings.TWILIO_WHATSAPP_NUMBER
         elif self.provider == 'meta':
-            self.api_key = config.WHATSAPP_API_KEY
-            self.phone_number_id = config.WHATSAPP_PHONE_NUMBER_ID
+            self.api_key = settings.WHATSAPP_API_KEY
+            self.phone_number_id = settings.WHATSAPP_PHONE_NUMBER_ID
+            self.url = f"{config.META_API_URL.rstrip('/')}/{self.phone_number_id}/messages"
+            self.headers = {
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            }
+            self.session = session or make_session(self.headers)
         elif self.provider == '360dialog':
-            self.api_key = config.WHATSAPP_API_KEY
+            self.api_key = settings.WHATSAPP_API_KEY
+            self.url = f"{config.DIALOG360_API_URL.rstrip('/')}/messages"
+            self.headers = {
+                "D360-API-KEY": self.api_key,
+                "Content-Type": "application/json"
+            }
+            self.session = session or make_session(self.headers)
         else:
             raise ValueError(f"Unsupported WhatsApp provider: {self.provider}")
 
+        # Paced, prioritized sending; workers start on first use
+        self.outbound = OutboundQueue(self)
+
+    def close(self):
+        """Drain the outbound queue and close pooled connections (unless shared)"""
+        self.outbound.stop()
+        if self.session and self.owns_session:
+            self.session.close()
+
+    def _post(self, payload: dict) -> Optional[str]:
+        """POST to the provider's messages endpoint; returns the message ID"""
+        response = self.session.post(self.url, json=payload, headers=self.headers,
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        result = response.json()
+        return result.get('messages', [{}])[0].get('id')
+
     def send_message(self, to_number: str, message: str) -> Optional[str]:
         """
         Send WhatsApp message
@@ -65,13 +456,6 @@ class WhatsAppSender:
             # Remove 'whatsapp:' prefix if present and '+' if present
             clean_number = to_number.replace('whatsapp:', '').replace('+', '')
 
-            url = f"https://graph.facebook.com/v18.0/{self.phone_number_id}/messages"
-
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-
             payload = {
                 "messaging_product": "whatsapp",
                 "to": clean_number,
@@ -81,11 +465,7 @@ class WhatsAppSender:
                 }
             }
 
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-
-            result = response.json()
-            message_id = result.get('messages', [{}])[0].get('id')
+            message_id = self._post(payload)
 
             print(f"✅ Message sent via Meta: {message_id}")
             return message_id
@@ -100,13 +480,6 @@ class WhatsAppSender:
             # Remove 'whatsapp:' prefix if present
             clean_number = to_number.replace('whatsapp:', '')
 
-            url = "https://waba.360dialog.io/v1/messages"
-
-            headers = {
-                "D360-API-KEY": self.api_key,
-                "Content-Type": "application/json"
-            }
-
             payload = {
                 "to": clean_number,
                 "type": "text",
@@ -115,11 +488,7 @@ class WhatsAppSender:
                 }
             }
 
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-
-            result = response.json()
-            message_id = result.get('messages', [{}])[0].get('id')
+            message_id = self._post(payload)
 
             print(f"✅ Message sent via 360Dialog: {message_id}")
             return message_id
@@ -141,13 +510,6 @@ class WhatsAppSender:
         try:
             clean_number = to_number.replace('whatsapp:', '').replace('+', '')
 
-            url = f"https://graph.facebook.com/v18.0/{self.phone_number_id}/messages"
-
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-
             payload = {
                 "messaging_product": "whatsapp",
                 "to": clean_number,
@@ -163,11 +525,7 @@ class WhatsAppSender:
             if components:
                 payload["template"]["components"] = components
 
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-
-            result = response.json()
-            message_id = result.get('messages', [{}])[0].get('id')
+            message_id = self._post(payload)
 
             print(f"✅ Template message sent: {message_id}")
             return message_id
@@ -0,0 +1,513 @@
+"""
+WhatsApp Simulator - Local stand-in for the Meta, 360Dialog and Twilio send APIs
+Adds configurable latency, 429/5xx errors and a throughput cap, fires status
+callbacks for sent messages and can drive inbound webhook traffic at a target rate.
+
+Usage:
+    python execution/whatsapp_simulator.py --port 5050 --latency-ms 150 --rate-429 0.02 --rate-5xx 0.01
+    python execution/whatsapp_simulator.py --max-rps 80 --callback-url http://localhost:5000/webhook
+    python execution/whatsapp_simulator.py --no-server --inbound meta --inbound-rate 20 \\
+        --inbound-duration 60 --webhook-url http://localhost:5000/webhook
+
+Point the sender at it with:
+    META_API_URL=http://localhost:5050/v18.0
+    DIALOG360_API_URL=http://localhost:5050/v1
+    TWILIO_API_URL=http://localhost:5050
+"""
+
+import re
+import json
+import math
+import time
+import heapq
+import random
+import argparse
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import MetricsRegistry, Timer
+from whatsapp_sender import TokenBucket
+from replay_benchmark import SYNTHETIC_OPENERS, SYNTHETIC_FOLLOW_UPS
+
+META_SEND_RE = re.compile(r'^/v[\d.]+/(?P<phone_number_id>[^/]+)/messages$')
+DIALOG360_SEND_PATH = '/v1/messages'
+TWILIO_SEND_RE = re.compile(r'^/2010-04-01/Accounts/(?P<account_sid>[^/]+)/Messages\.json$')
+
+SIM_PHONE_NUMBER_ID = '100000000000001'
+SIM_BUSINESS_NUMBER = '+905438247016'
+
+
+class LatencyModel:
+    """Response delay in seconds: fixed, normal, lognormal or exponential"""
+
+    DISTRIBUTIONS = ('fixed', 'normal', 'lognormal', 'exponential')
+
+    def __init__(self, mean_ms: float, jitter_ms: float = 0.0,
+                 distribution: str = 'lognormal', rng: Optional[random.Random] = None):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.mean = mean_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.distribution = distribution
+        self.rng = rng or random.Random()
+
+    def sample(self) -> float:
+        if self.mean <= 0:
+            return 0.0
+        if self.distribution == 'fixed' or (self.distribution != 'exponential' and not self.jitter):
+            return self.mean
+        if self.distribution == 'normal':
+            return max(self.rng.gauss(self.mean, self.jitter), 0.0)
+        if self.distribution == 'exponential':
+            return self.rng.expovariate(1 / self.mean)
+        # Lognormal with the mean as median: long right tail like real APIs.
+        # log1p keeps sigma ~ jitter/mean for small jitter without exploding
+        # when the jitter exceeds the mean
+        sigma = math.log1p(self.jitter / self.mean)
+        return self.rng.lognormvariate(0.0, sigma) * self.mean
+
+
+# ==================== PAYLOADS ====================
+
+def _new_id(provider: str) -> str:
+    if provider == 'twilio':
+        return f"SM{uuid.uuid4().hex}"
+    return f"wamid.SIM{uuid.uuid4().hex[:24].upper()}"
+
+
+def _digits(number: str) -> str:
+    return number.replace('whatsapp:', '').replace('+', '')
+
+
+def meta_inbound(from_number: str, text: str, message_id: str) -> Dict:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "SIMWABA",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": _digits(SIM_BUSINESS_NUMBER),
+                                 "phone_number_id": SIM_PHONE_NUMBER_ID},
+                    "contacts": [{"profile": {"name": "Simülasyon"}, "wa_id": _digits(from_number)}],
+                    "messages": [{"from": _digits(from_number), "id": message_id,
+                                  "timestamp": str(int(time.time())), "type": "text",
+                                  "text": {"body": text}}]
+                }
+            }]
+        }]
+    }
+
+
+def meta_status(message_id: str, status: str, recipient: str,
+                phone_number_id: str = SIM_PHONE_NUMBER_ID) -> Dict:
+    raw = {"id": message_id, "status": status, "timestamp": str(int(time.time())),
+           "recipient_id": _digits(recipient)}
+    if status == 'failed':
+        raw["errors"] = [{"code": 131026, "title": "Message undeliverable"}]
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "SIMWABA",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": _digits(SIM_BUSINESS_NUMBER),
+                                 "phone_number_id": phone_number_id},
+                    "statuses": [raw]
+                }
+            }]
+        }]
+    }
+
+
+def dialog360_inbound(from_number: str, text: str, message_id: str) -> Dict:
+    return {
+        "contacts": [{"profile": {"name": "Simülasyon"}, "wa_id": _digits(from_number)}],
+        "messages": [{"from": _digits(from_number), "id": message_id,
+                      "timestamp": str(int(time.time())), "type": "text", "text": {"body": text}}]
+    }
+
+
+def dialog360_status(message_id: str, status: str, recipient: str, **_) -> Dict:
+    raw = {"id": message_id, "status": status, "timestamp": str(int(time.time())),
+           "recipient_id": _digits(recipient)}
+    if status == 'failed':
+        raw["errors"] = [{"code": 1013, "title": "User is not valid"}]
+    return {"statuses": [raw]}
+
+
+def twilio_inbound(from_number: str, text: str, message_id: str) -> Dict:
+    return {
+        "From": f"whatsapp:+{_digits(from_number)}",
+        "To": f"whatsapp:{SIM_BUSINESS_NUMBER}",
+        "Body": text,
+        "MessageSid": message_id,
+        "AccountSid": "ACSIMULATOR",
+        "NumMedia": "0",
+        "SmsStatus": "received",
+    }
+
+
+def twilio_status(message_id: str, status: str, recipient: str, **_) -> Dict:
+    form = {
+        "MessageSid": message_id,
+        "MessageStatus": 'undelivered' if status == 'failed' else status,
+        "To": f"whatsapp:+{_digits(recipient)}",
+        "From": f"whatsapp:{SIM_BUSINESS_NUMBER}",
+        "AccountSid": "ACSIMULATOR",
+    }
+    if status == 'failed':
+        form["ErrorCode"] = "63016"
+    return form
+
+
+INBOUND_BUILDERS = {'meta': meta_inbound, '360dialog': dialog360_inbound, 'twilio': twilio_inbound}
+STATUS_BUILDERS = {'meta': meta_status, '360dialog': dialog360_status, 'twilio': twilio_status}
+
+
+def post_webhook(session: requests.Session, url: str, provider: str, payload: Dict,
+                 timeout: float = 30) -> requests.Response:
+    """Twilio posts form data, Meta and 360Dialog post JSON"""
+    if provider == 'twilio':
+        return session.post(url, data=payload, timeout=timeout)
+    return session.post(url, json=payload, timeout=timeout)
+
+
+def _error_body(provider: str, code: int, message: str) -> Dict:
+    if provider == 'meta':
+        error_code = 130429 if code == 429 else 131000
+        return {"error": {"message": message, "type": "OAuthException", "code": error_code,
+                          "fbtrace_id": uuid.uuid4().hex[:12]}}
+    if provider == '360dialog':
+        return {"errors": [{"code": code, "title": message}]}
+    return {"code": 20429 if code == 429 else 20500, "message": message,
+            "more_info": "https://www.twilio.com/docs/errors", "status": code}
+
+
+# ==================== STATUS CALLBACKS ====================
+
+class CallbackFirer:
+    """Posts status callbacks to the webhook at their scheduled times"""
+
+    def __init__(self, url: str, metrics: MetricsRegistry):
+        self.url = url
+        self.metrics = metrics
+        self.session = requests.Session()
+        self._heap = []
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='sim-callbacks', daemon=True)
+        self._thread.start()
+
+    def schedule(self, delay: float, provider: str, payload: Dict):
+        with self._cond:
+            self._counter += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, provider, payload))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, provider, payload = heapq.heappop(self._heap)
+            try:
+                response = post_webhook(self.session, self.url, provider, payload, timeout=10)
+                self.metrics.increment(f'callbacks.{response.status_code}')
+            except requests.RequestException:
+                self.metrics.increment('callbacks.error')
+
+
+# ==================== SEND API ====================
+
+class ProviderSimulator:
+    """
+    Decides the outcome of each send request
+    Throughput over max_rps is rejected with 429 like the real APIs; the rest
+    fail with rate_429 / rate_5xx probability or succeed after the sampled latency.
+    """
+
+    def __init__(self, latency: LatencyModel, rate_429: float = 0.0, rate_5xx: float = 0.0,
+                 max_rps: float = 0.0, callback_url: Optional[str] = None,
+                 read_ratio: float = 0.6, fail_ratio: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.bucket = TokenBucket(max_rps, max(int(max_rps), 1))
+        self.read_ratio = read_ratio
+        self.fail_ratio = fail_ratio
+        self.rng = random.Random(seed)
+        self.metrics = MetricsRegistry()
+        self.callbacks = CallbackFirer(callback_url, self.metrics) if callback_url else None
+        self._lock = threading.Lock()
+
+    def handle_send(self, provider: str, to_number: str,
+                    phone_number_id: str = SIM_PHONE_NUMBER_ID) -> Tuple[int, Dict, Dict]:
+        """Get (status code, headers, body) for one send request"""
+        self.metrics.increment(f'requests.{provider}')
+        with Timer() as timer:
+            time.sleep(self.latency.sample())
+            with self._lock:
+                throttled = self.bucket.wait_time(time.monotonic()) > 0
+                if not throttled:
+                    self.bucket.take()
+                roll = self.rng.random()
+
+            if throttled or roll < self.rate_429:
+                code, headers, body = 429, {"Retry-After": "1"}, _error_body(
+                    provider, 429, "Throughput limit reached" if throttled else "Rate limit hit")
+                self.metrics.increment('throttled' if throttled else 'injected.429')
+            elif roll < self.rate_429 + self.rate_5xx:
+                code = self.rng.choice((500, 502, 503))
+                headers, body = {}, _error_body(provider, code, "Simulated server error")
+                self.metrics.increment(f'injected.{code}')
+            else:
+                message_id = _new_id(provider)
+                code, headers = (201 if provider == 'twilio' else 200), {}
+                body = self._success_body(provider, message_id, to_number)
+                self._schedule_statuses(provider, message_id, to_number, phone_number_id)
+
+        self.metrics.increment(f'responses.{code}')
+        self.metrics.observe(f'latency_seconds.{provider}', timer.elapsed)
+        return code, headers, body
+
+    def _success_body(self, provider: str, message_id: str, to_number: str) -> Dict:
+        if provider == 'twilio':
+            now = formatdate(usegmt=True)
+            return {
+                "sid": message_id, "account_sid": "ACSIMULATOR", "to": to_number,
+                "from": f"whatsapp:{SIM_BUSINESS_NUMBER}", "status": "queued",
+                "direction": "outbound-api", "api_version": "2010-04-01",
+                "date_created": now, "date_updated": now, "num_segments": "1", "num_media": "0",
+                "error_code": None, "error_message": None, "price": None,
+                "uri": f"/2010-04-01/Accounts/ACSIMULATOR/Messages/{message_id}.json"
+            }
+        body = {"messages": [{"id": message_id}]}
+        if provider == 'meta':
+            body = {"messaging_product": "whatsapp",
+                    "contacts": [{"input": to_number, "wa_id": _digits(to_number)}], **body}
+        return body
+
+    def _schedule_statuses(self, provider: str, message_id: str, to_number: str,
+                           phone_number_id: str):
+        if not self.callbacks:
+            return
+        build = STATUS_BUILDERS[provider]
+        with self._lock:
+            failed = self.rng.random() < self.fail_ratio
+            read = self.rng.random() < self.read_ratio
+            delivered_after = 0.5 + self.rng.expovariate(1 / 1.5)
+            read_after = delivered_after + self.rng.expovariate(1 / 20)
+
+        self.callbacks.schedule(0.2, provider, build(message_id, 'sent', to_number,
+                                                     phone_number_id=phone_number_id))
+        if failed:
+            self.callbacks.schedule(delivered_after, provider,
+                                    build(message_id, 'failed', to_number, phone_number_id=phone_number_id))
+            return
+        self.callbacks.schedule(delivered_after, provider,
+                                build(message_id, 'delivered', to_number, phone_number_id=phone_number_id))
+        if read:
+            self.callbacks.schedule(read_after, provider,
+                                    build(message_id, 'read', to_number, phone_number_id=phone_number_id))
+
+    def stats(self) -> Dict:
+        return self.metrics.snapshot()
+
+
+def make_server(simulator: ProviderSimulator, host: str, port: int) -> ThreadingHTTPServer:
+    """HTTP/1.1 server (keep-alive) for the three providers' send endpoints"""
+
+    class SimulatorHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, code: int, body: Dict, headers: Optional[Dict] = None):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip('/') in ('/stats', '/health', ''):
+                self._reply(200, simulator.stats())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            path = self.path.split('?', 1)[0]
+
+            meta = META_SEND_RE.match(path)
+            if path == DIALOG360_SEND_PATH or meta:
+                try:
+                    payload = json.loads(raw or b'{}')
+                except ValueError:
+                    self._reply(400, {"error": "invalid JSON"})
+                    return
+                if not payload.get('to'):
+                    self._reply(400, {"error": "'to' is required"})
+                    return
+                if meta:
+                    code, headers, body = simulator.handle_send('meta', payload['to'],
+                                                                meta.group('phone_number_id'))
+                else:
+                    code, headers, body = simulator.handle_send('360dialog', payload['to'])
+                self._reply(code, body, headers)
+                return
+
+            if TWILIO_SEND_RE.match(path):
+                form = {key: values[0] for key, values in parse_qs(raw.decode('utf-8')).items()}
+                if not form.get('To'):
+                    self._reply(400, {"code": 21604, "message": "A 'To' phone number is required.",
+                                      "status": 400})
+                    return
+                code, headers, body = simulator.handle_send('twilio', form['To'])
+                self._reply(code, body, headers)
+                return
+
+            self._reply(404, {"error": f"unknown endpoint {path}"})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), SimulatorHandler)
+    server.daemon_threads = True
+    return server
+
+
+# ==================== INBOUND LOAD ====================
+
+class InboundLoad:
+    """
+    Fires inbound message webhooks at a fixed rate (open loop)
+    Requests are started on schedule whether or not earlier ones finished,
+    so a slow webhook shows up as latency instead of a lower offered rate.
+    """
+
+    def __init__(self, webhook_url: str, provider: str, rate: float, duration: float,
+                 senders: int = 20, seed: Optional[int] = None, max_workers: int = 64):
+        if provider not in INBOUND_BUILDERS:
+            raise ValueError(f"Unsupported WhatsApp provider: {provider}")
+        self.webhook_url = webhook_url
+        self.provider = provider
+        self.rate = rate
+        self.duration = duration
+        self.rng = random.Random(seed)
+        self.senders = [f"+90555{self.rng.randint(0, 9_999_999):07d}" for _ in range(senders)]
+        self.max_workers = max_workers
+        self.metrics = MetricsRegistry(window=100_000)
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=max_workers))
+
+    def next_message(self) -> Tuple[str, str, str]:
+        """(sender, text, provider message id)"""
+        sender = self.rng.choice(self.senders)
+        text = self.rng.choice(SYNTHETIC_OPENERS if self.rng.random() < 0.6 else SYNTHETIC_FOLLOW_UPS)
+        return sender, text, _new_id(self.provider)
+
+    def _fire(self, sender: str, text: str, message_id: str):
+        payload = INBOUND_BUILDERS[self.provider](sender, text, message_id)
+        with Timer() as timer:
+            try:
+                response = post_webhook(self.session, self.webhook_url, self.provider, payload)
+                outcome = str(response.status_code)
+            except requests.RequestException as e:
+                outcome = type(e).__name__
+        self.metrics.observe('webhook_seconds', timer.elapsed)
+        self.metrics.increment(f'responses.{outcome}')
+
+    def run(self) -> Dict:
+        total = int(self.rate * self.duration)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for index in range(total):
+                delay = started + index / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self._fire, *self.next_message())
+        elapsed = time.monotonic() - started
+        snapshot = self.metrics.snapshot()
+        return {
+            "provider": self.provider,
+            "sent": total,
+            "elapsed_seconds": round(elapsed, 2),
+            "achieved_rate": round(total / elapsed, 2) if elapsed else 0.0,
+            "webhook_seconds": snapshot['timings'].get('webhook_seconds'),
+            "responses": snapshot['counters'],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local WhatsApp provider simulator")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--no-server', action='store_true', help="Only generate inbound load")
+    parser.add_argument('--latency-ms', type=float, default=150, help="Mean (median for lognormal)")
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--latency-dist', choices=LatencyModel.DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Share of sends rejected with 429")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="Share of sends failing with 5xx")
+    parser.add_argument('--max-rps', type=float, default=0.0, help="Throughput cap (0 = none)")
+    parser.add_argument('--callback-url', help="Webhook URL for sent/delivered/read callbacks")
+    parser.add_argument('--read-ratio', type=float, default=0.6)
+    parser.add_argument('--fail-ratio', type=float, default=0.0, help="Share of sends that fail delivery")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--inbound', choices=sorted(INBOUND_BUILDERS), help="Fire inbound webhooks")
+    parser.add_argument('--webhook-url', default='http://127.0.0.1:5000/webhook')
+    parser.add_argument('--inbound-rate', type=float, default=5.0, help="Messages per second")
+    parser.add_argument('--inbound-duration', type=float, default=30.0, help="Seconds")
+    parser.add_argument('--inbound-senders', type=int, default=20, help="Distinct customer numbers")
+    args = parser.parse_args()
+
+    server = None
+    simulator = None
+    if not args.no_server:
+        rng = random.Random(args.seed)
+        simulator = ProviderSimulator(
+            LatencyModel(args.latency_ms, args.jitter_ms, args.latency_dist, rng),
+            rate_429=args.rate_429, rate_5xx=args.rate_5xx, max_rps=args.max_rps,
+            callback_url=args.callback_url, read_ratio=args.read_ratio,
+            fail_ratio=args.fail_ratio, seed=args.seed)
+        server = make_server(simulator, args.host, args.port)
+        threading.Thread(target=server.serve_forever, name='simulator', daemon=True).start()
+        print(f"🧪 WhatsApp simulator on http://{args.host}:{server.server_port}")
+        print(f"   META_API_URL=http://{args.host}:{server.server_port}/v18.0")
+        print(f"   DIALOG360_API_URL=http://{args.host}:{server.server_port}/v1")
+        print(f"   TWILIO_API_URL=http://{args.host}:{server.server_port}")
+
+    try:
+        if args.inbound:
+            print(f"📨 Firing {args.inbound} webhooks at {args.webhook_url}: "
+                  f"{args.inbound_rate}/s for {args.inbound_duration}s")
+            load = InboundLoad(args.webhook_url, args.inbound, args.inbound_rate,
+                               args.inbound_duration, args.inbound_senders, args.seed)
+            print(json.dumps(load.run(), indent=2))
+        if server:
+            print("Press Ctrl+C to stop")
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            server.shutdown()
+            print(json.dumps(simulator.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,9 +5,18 @@ Handles incoming webhooks from WhatsApp Business API providers
 
 from flask import Flask, request, jsonify
 import config
-from conversation_tracker import ConversationTracker
-from ai_responder import AIResponder
-from whatsapp_sender import WhatsAppSender
+import runtime_config
+from metrics import Timer
+from profiling import PROFILERS, webhook_profiler, check_admin_token, list_profiles
+import tracing
+from whatsapp_sender import PRIORITY_EMERGENCY, PRIORITY_HUMAN, PRIORITY_AI
+from delivery_status import parse_meta_statuses, parse_360dialog_statuses, parse_twilio_status
+from emergency_matcher import EmergencyDetector
+from business_calendar import describe_opening
+from tenants import Tenant, TenantRegistry
+import os
+import time
+import atexit
 import logging
 from datetime import datetime
 
@@ -24,15 +33,88 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
+tracing.service = 'webhook'
+
+# Initialize components (shared with the embedded monitor); each tenant
+# (clinic number) has its own database, sender and outbox. Workers only
+# enqueue: the outbox is sent by the monitor process (standalone, or the
+# worker that holds the embedded-monitor lock)
+tenants = TenantRegistry.from_config()
+emergency_detector = EmergencyDetector()
+tenants.start(dispatch=False)
+# Per tenant: the outbox stops claiming and writes its results, then the
+# queue drains, then receipts are flushed
+atexit.register(tenants.stop)
+# Pick up .env/config.py changes (and SIGHUP) without restarting workers
+runtime_config.start_watching()
+
+# Background monitor running in this process (EMBEDDED_MONITOR=True)
+monitor = None
+_monitor_lock_file = None
+
+
+def _acquire_monitor_lock() -> bool:
+    """
+    Take an exclusive lock so only one process runs the embedded scheduler
+    Gunicorn workers all import this module; the first one wins.
+    """
+    global _monitor_lock_file
+    try:
+        import fcntl
+    except ImportError:
+        # No flock on Windows - assume a single process
+        return True
+
+    lock_dir = os.path.dirname(config.MONITOR_LOCK_FILE)
+    if lock_dir:
+        os.makedirs(lock_dir, exist_ok=True)
+    lock_file = open(config.MONITOR_LOCK_FILE, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _monitor_lock_file = lock_file
+    return True
+
+
+def start_embedded_monitor():
+    """Start the background monitor as a managed thread of this process"""
+    global monitor
+    if monitor is not None:
+        return monitor
+
+    if not _acquire_monitor_lock():
+        logger.info("Embedded monitor already running in another worker")
+        return None
+
+    # Imported here so this module's logging setup stays in effect
+    from background_monitor import BackgroundMonitor
+
+    tenants.start_dispatching()
+    monitor = BackgroundMonitor(tenants=tenants)
+    monitor.start_in_background()
+    atexit.register(monitor.stop)
+    logger.info(f"Embedded background monitor started (pid {os.getpid()})")
+    return monitor
+
+
+if config.EMBEDDED_MONITOR:
+    start_embedded_monitor()
+
 
-# Initialize components
-tracker = ConversationTracker(config.DATABASE_PATH)
-ai_responder = AIResponder()
-whatsapp_sender = WhatsAppSender()
+def _tenant_or_404(tenant_id: str):
+    tenant = tenants.get(tenant_id)
+    if tenant is None:
+        logger.warning(f"Unknown tenant: {tenant_id}")
+    return tenant
 
 
 @app.route('/webhook', methods=['GET'])
-def verify_webhook():
+@app.route('/webhook/<tenant_id>', methods=['GET'])
+def verify_webhook(tenant_id=None):
     """
     Webhook verification for WhatsApp Business API
     Required by Meta/360Dialog to verify your webhook URL
@@ -41,7 +123,15 @@ def verify_webhook():
     token = request.args.get('hub.verify_token')
     challenge = request.args.get('hub.challenge')
 
-    if mode == 'subscribe' and token == config.WEBHOOK_VERIFY_TOKEN:
+    if tenant_id:
+        tenant = _tenant_or_404(tenant_id)
+        if tenant is None:
+            return 'Unknown tenant', 404
+        verify_token = tenant.settings().WEBHOOK_VERIFY_TOKEN
+    else:
+        verify_token = runtime_config.current().WEBHOOK_VERIFY_TOKEN
+
+    if mode == 'subscribe' and token == verify_token:
         logger.info("Webhook verified successfully")
         return challenge, 200
     else:
@@ -49,35 +139,82 @@ def verify_webhook():
         return 'Verification failed', 403
 
 
+def _receiving_number(data) -> str:
+    """
+    The number a webhook was sent to: Meta's phone_number_id, or Twilio's To
+    (From on status callbacks, which report messages we sent)
+    """
+    if request.form:
+        if 'MessageStatus' in request.form and 'Body' not in request.form:
+            return request.form.get('From', '')
+        return request.form.get('To', '')
+    try:
+        value = data['entry'][0]['changes'][0]['value']
+        return str(value.get('metadata', {}).get('phone_number_id', ''))
+    except (KeyError, IndexError, TypeError):
+        return ''
+
+
 @app.route('/webhook', methods=['POST'])
-def handle_webhook():
+@app.route('/webhook/<tenant_id>', methods=['POST'])
+def handle_webhook(tenant_id=None):
     """
     Handle incoming WhatsApp messages
-    Processes messages from all supported providers
+    Processes messages from all supported providers. /webhook routes to a
+    tenant by the receiving number; /webhook/<tenant_id> names it (needed
+    for 360Dialog, whose payloads do not include it).
     """
     try:
-        data = request.get_json()
-        logger.info(f"Received webhook: {data}")
-
-        # Route to appropriate handler based on provider
-        if config.WHATSAPP_API_PROVIDER == 'twilio':
-            return handle_twilio_webhook(data)
-        elif config.WHATSAPP_API_PROVIDER == 'meta':
-            return handle_meta_webhook(data)
-        elif config.WHATSAPP_API_PROVIDER == '360dialog':
-            return handle_360dialog_webhook(data)
+        # Twilio posts form data; silent avoids Flask's 415 for non-JSON bodies
+        data = request.get_json(silent=True) or {}
+        logger.info(f"Received webhook: {data or dict(request.form)}")
+
+        if tenant_id:
+            tenant = _tenant_or_404(tenant_id)
+            if tenant is None:
+                return jsonify({"error": "Unknown tenant"}), 404
         else:
-            logger.error(f"Unknown provider: {config.WHATSAPP_API_PROVIDER}")
-            return jsonify({"error": "Unknown provider"}), 400
+            receiving = _receiving_number(data)
+            tenant = tenants.route(receiving)
+            if tenant is None:
+                # Acknowledge so the provider does not retry a number we do not serve
+                logger.warning(f"No tenant receives on {receiving or 'an unknown number'}")
+                tenants.metrics.increment('webhooks.unrouted')
+                return jsonify({"status": "unrouted"}), 200
+
+        # Route to appropriate handler based on the tenant's provider.
+        # X-Profile with a valid X-Admin-Token profiles this request regardless of the rate
+        force = 'X-Profile' in request.headers and check_admin_token(request.headers.get('X-Admin-Token'))
+        with webhook_profiler.session(tenant.id, force=force), Timer() as timer:
+            provider = tenant.provider
+            if provider == 'twilio':
+                result = handle_twilio_webhook(tenant, data)
+            elif provider == 'meta':
+                result = handle_meta_webhook(tenant, data)
+            elif provider == '360dialog':
+                result = handle_360dialog_webhook(tenant, data)
+            else:
+                logger.error(f"Unknown provider: {provider}")
+                return jsonify({"error": "Unknown provider"}), 400
+        tenant.metrics.observe('webhook_seconds', timer.elapsed)
+        return result
 
     except Exception as e:
         logger.error(f"Error handling webhook: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
-def handle_twilio_webhook(data):
+def handle_twilio_webhook(tenant: Tenant, data):
     """Handle Twilio webhook format"""
     try:
+        # Status callbacks carry MessageStatus and no Body
+        if 'MessageStatus' in request.form and 'Body' not in request.form:
+            update = parse_twilio_status(request.form)
+            if update:
+                tenant.status_recorder.record([update])
+                tenant.metrics.increment('statuses')
+            return jsonify({"status": "status_recorded" if update else "ignored"}), 200
+
         # Extract message details from Twilio format
         from_number = request.form.get('From', '').replace('whatsapp:', '')
         message_text = request.form.get('Body', '')
@@ -86,7 +223,7 @@ def handle_twilio_webhook(data):
         if not from_number or not message_text:
             return jsonify({"error": "Missing required fields"}), 400
 
-        process_incoming_message(from_number, message_text, message_id)
+        process_incoming_message(tenant, from_number, message_text, message_id)
 
         return jsonify({"status": "success"}), 200
 
@@ -95,7 +232,7 @@ def handle_twilio_webhook(data):
         return jsonify({"error": str(e)}), 500
 
 
-def handle_meta_webhook(data):
+def handle_meta_webhook(tenant: Tenant, data):
     """Handle Meta (Facebook) webhook format"""
     try:
         # Extract message from Meta's nested structure
@@ -105,8 +242,11 @@ def handle_meta_webhook(data):
         messages = value.get('messages', [])
 
         if not messages:
-            # This might be a status update, not a message
-            return jsonify({"status": "no_message"}), 200
+            # Delivery / read receipts for messages we sent
+            statuses = parse_meta_statuses(data)
+            tenant.status_recorder.record(statuses)
+            tenant.metrics.increment('statuses', len(statuses))
+            return jsonify({"status": "status_recorded" if statuses else "no_message"}), 200
 
         message = messages[0]
         from_number = message.get('from', '')
@@ -120,7 +260,7 @@ def handle_meta_webhook(data):
         if not from_number.startswith('+'):
             from_number = '+' + from_number
 
-        process_incoming_message(from_number, message_text, message_id)
+        process_incoming_message(tenant, from_number, message_text, message_id)
 
         return jsonify({"status": "success"}), 200
 
@@ -129,14 +269,17 @@ def handle_meta_webhook(data):
         return jsonify({"error": str(e)}), 500
 
 
-def handle_360dialog_webhook(data):
+def handle_360dialog_webhook(tenant: Tenant, data):
     """Handle 360Dialog webhook format"""
     try:
         # Similar to Meta format but with some differences
         messages = data.get('messages', [])
 
         if not messages:
-            return jsonify({"status": "no_message"}), 200
+            statuses = parse_360dialog_statuses(data)
+            tenant.status_recorder.record(statuses)
+            tenant.metrics.increment('statuses', len(statuses))
+            return jsonify({"status": "status_recorded" if statuses else "no_message"}), 200
 
         message = messages[0]
         from_number = message.get('from', '')
@@ -146,7 +289,7 @@ def handle_360dialog_webhook(data):
         if not from_number or not message_text:
             return jsonify({"error": "Missing required fields"}), 400
 
-        process_incoming_message(from_number, message_text, message_id)
+        process_incoming_message(tenant, from_number, message_text, message_id)
 
         return jsonify({"status": "success"}), 200
 
@@ -155,115 +298,237 @@ def handle_360dialog_webhook(data):
         return jsonify({"error": str(e)}), 500
 
 
-def process_incoming_message(phone_number: str, message_text: str, message_id: str):
+def process_incoming_message(tenant: Tenant, phone_number: str, message_text: str, message_id: str):
     """
     Process incoming message and decide on response strategy
+    Starts the message's trace; its ID is stored with the message, the
+    pending response and any reply so later stages add to the same trace.
     """
-    logger.info(f"Processing message from {phone_number}: {message_text}")
-
-    # Add message to database
-    msg_db_id = tracker.add_incoming_message(phone_number, message_text, message_id)
-    conversation_id = tracker.get_or_create_conversation(phone_number)
-
-    # Check for emergency keywords
-    if config.contains_emergency_keyword(message_text):
-        logger.warning(f"Emergency keyword detected in message from {phone_number}")
-        response = ai_responder.generate_emergency_response()
-        send_response(phone_number, response, is_ai=True)
-        # TODO: Send notification to therapist
-        return
-
-    # Check if outside business hours
-    if not config.is_business_hours() and config.IMMEDIATE_RESPONSE_OUTSIDE_HOURS:
-        logger.info("Outside business hours - sending immediate response")
-        response = ai_responder.generate_outside_hours_response(message_text)
-        send_response(phone_number, response, is_ai=True)
-        return
-
-    # Schedule AI response after delay
-    logger.info(f"Scheduling AI response for message {msg_db_id} after {config.RESPONSE_DELAY}s")
-    tracker.schedule_ai_response(msg_db_id, delay_seconds=config.RESPONSE_DELAY)
-
-
-def send_response(phone_number: str, message: str, is_ai: bool = False):
-    """Send a response via WhatsApp"""
+    trace_id = tracing.new_trace_id()
+    logger.info(f"[{tenant.id}] Processing message from {phone_number} (trace {trace_id}): {message_text}")
+    tenant.metrics.increment('messages.received')
+    tracker = tenant.tracker
+
+    with tracing.span('message.ingest', trace_id, tenant=tenant.id, message_id=message_id) as span:
+        # Add message to database
+        msg_db_id = tracker.add_incoming_message(phone_number, message_text, message_id,
+                                                 trace_id=trace_id)
+        conversation_id = tracker.get_or_create_conversation(phone_number)
+
+        # Check for emergency keywords
+        emergency_term = emergency_detector.find(message_text)
+        if emergency_term:
+            logger.warning(f"Emergency keyword '{emergency_term}' detected in message from {phone_number}")
+            tenant.metrics.increment('messages.emergency')
+            span.set(outcome='emergency')
+            response = tenant.ai_responder.generate_emergency_response()
+            send_response(tenant, phone_number, response, is_ai=True, priority=PRIORITY_EMERGENCY,
+                          idempotency_key=f"{message_id}:emergency" if message_id else None,
+                          trace_id=trace_id)
+            # TODO: Send notification to therapist
+            return
+
+        # Outside business hours the follow-up waits until the clinic reopens,
+        # then gives the team the usual delay to answer before the AI does
+        cfg = tenant.settings()
+        delay = cfg.RESPONSE_DELAY
+        calendar = tenant.calendar()
+        now = calendar.now()
+        closed = not calendar.is_open(now)
+        if closed:
+            tenant.metrics.increment('messages.outside_hours')
+            reopens_at = calendar.next_opening(now)
+            if reopens_at:
+                delay += int((reopens_at - now).total_seconds())
+            if cfg.IMMEDIATE_RESPONSE_OUTSIDE_HOURS:
+                logger.info("Outside business hours - sending immediate response")
+                response = tenant.ai_responder.generate_outside_hours_response(
+                    message_text, reopens_at=describe_opening(reopens_at, now) if reopens_at else None)
+                send_response(tenant, phone_number, response, is_ai=True,
+                              idempotency_key=f"{message_id}:outside-hours" if message_id else None,
+                              metadata={"auto_reply": "outside_hours"}, trace_id=trace_id)
+
+        # Schedule AI response after delay; while closed, later messages move
+        # the conversation's follow-up instead of queueing one reply each
+        logger.info(f"Scheduling AI response for message {msg_db_id} after {delay}s")
+        tracker.schedule_ai_response(msg_db_id, delay_seconds=delay, trace_id=trace_id, merge=closed)
+        tenant.metrics.increment('responses.scheduled')
+        span.set(outcome='scheduled', delay_seconds=delay)
+
+    # Wake the embedded monitor exactly when this response is due
+    if monitor:
+        monitor.notify_scheduled(time.time() + delay)
+
+
+def send_response(tenant: Tenant, phone_number: str, message: str, is_ai: bool = False,
+                  priority: int = PRIORITY_AI, idempotency_key: str = None,
+                  metadata: dict = None, trace_id: str = None):
+    """Store a response in the tenant's outbox; the dispatcher sends and logs it"""
     try:
-        message_id = whatsapp_sender.send_message(phone_number, message)
+        outbox_id = tenant.tracker.enqueue_outgoing_message(phone_number, message, priority, is_ai=is_ai,
+                                                            idempotency_key=idempotency_key,
+                                                            metadata=metadata, trace_id=trace_id)
+        tenant.notify_outbox()
+        logger.info(f"[{tenant.id}] Response to {phone_number} queued (outbox {outbox_id})")
+    except Exception as e:
+        logger.error(f"Error queueing response: {e}", exc_info=True)
 
-        if message_id:
-            # Log the outgoing message
-            tracker.add_outgoing_message(phone_number, message, is_ai=is_ai, message_id=message_id)
-            logger.info(f"Response sent to {phone_number}: {message_id}")
-        else:
-            logger.error(f"Failed to send response to {phone_number}")
 
-    except Exception as e:
-        logger.error(f"Error sending response: {e}", exc_info=True)
+def _request_tenant(tenant_id: str = None):
+    """
+    Tenant named by the request (`tenant` in the body or query), or the only one
+    Returns (tenant, error response).
+    """
+    if tenant_id:
+        tenant = tenants.get(tenant_id)
+        return (tenant, None) if tenant else (None, (jsonify({"error": "Unknown tenant"}), 404))
+    if tenants.multi_tenant:
+        return None, (jsonify({"error": "tenant required"}), 400)
+    return tenants.default, None
 
 
 @app.route('/send', methods=['POST'])
 def manual_send():
     """
     API endpoint to manually send messages (for testing or admin use)
+    The message is queued in the outbox; poll GET /send/<outbox_id> for the result.
+    Repeating a request with the same Idempotency-Key header does not send twice.
+    With several tenants, `tenant` names the clinic number to send from.
     """
     try:
         data = request.get_json()
         phone_number = data.get('phone_number')
         message = data.get('message')
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
 
         if not phone_number or not message:
             return jsonify({"error": "phone_number and message required"}), 400
 
-        message_id = whatsapp_sender.send_message(phone_number, message)
+        tenant, error = _request_tenant(data.get('tenant'))
+        if error:
+            return error
 
-        if message_id:
-            tracker.add_outgoing_message(phone_number, message, is_ai=False, message_id=message_id)
-            return jsonify({"status": "success", "message_id": message_id}), 200
-        else:
-            return jsonify({"error": "Failed to send"}), 500
+        outbox_id = tenant.tracker.enqueue_outgoing_message(phone_number, message, PRIORITY_HUMAN,
+                                                            is_ai=False, idempotency_key=idempotency_key)
+        tenant.notify_outbox()
+        tenant.metrics.increment('messages.manual')
+        return jsonify({"status": "queued", "tenant": tenant.id, "outbox_id": outbox_id}), 202
 
     except Exception as e:
         logger.error(f"Manual send error: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/send/<int:outbox_id>', methods=['GET'])
+def manual_send_status(outbox_id: int):
+    """Get the status of a queued message (?tenant=<id> with several tenants)"""
+    tenant, error = _request_tenant(request.args.get('tenant'))
+    if error:
+        return error
+    row = tenant.tracker.get_outbox_message(outbox_id)
+    if not row:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(row), 200
+
+
 @app.route('/stats', methods=['GET'])
 def get_stats():
-    """Get system statistics"""
+    """
+    Get system statistics
+    One tenant: its stats at the top level as before; several: under "tenants"
+    """
     try:
-        stats = tracker.get_statistics()
-        stats['is_business_hours'] = config.is_business_hours()
-        stats['response_delay'] = config.RESPONSE_DELAY
+        stats = {}
+        if not tenants.multi_tenant:
+            stats.update(tenants.default.stats())
+        else:
+            stats['tenants'] = tenants.stats()
+        stats['config'] = runtime_config.stats()
+        stats['ai_routes'] = tenants.route_stats()
+        stats['webhooks'] = tenants.metrics.snapshot()
+        stats['profiling'] = {kind: profiler.stats() for kind, profiler in PROFILERS.items()}
+        stats['tracing'] = tracing.sink.stats()
         return jsonify(stats), 200
     except Exception as e:
         logger.error(f"Stats error: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/stats/<tenant_id>', methods=['GET'])
+def get_tenant_stats(tenant_id: str):
+    """Get one tenant's statistics"""
+    tenant = _tenant_or_404(tenant_id)
+    if tenant is None:
+        return jsonify({"error": "Unknown tenant"}), 404
+    try:
+        return jsonify(tenant.stats()), 200
+    except Exception as e:
+        logger.error(f"Stats error: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    Inspect or change profiling (requires X-Admin-Token = PROFILE_ADMIN_TOKEN)
+    POST {"kind": "webhook"|"monitor", "rate": 0.05, "mode": "sampler"} overrides
+    this process's profiler; "rate": null returns to PROFILE_SAMPLE_RATE.
+    """
+    if not check_admin_token(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "forbidden"}), 403
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        profiler = PROFILERS.get(data.get('kind', 'webhook'))
+        if profiler is None:
+            return jsonify({"error": f"kind must be one of {', '.join(PROFILERS)}"}), 400
+        try:
+            profiler.set_rate(data.get('rate'), data.get('mode'))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        logger.info(f"🔬 {profiler.kind} profiling set to rate={profiler.rate} mode={profiler.mode}")
+
+    return jsonify({
+        "pid": os.getpid(),
+        "profilers": {kind: profiler.stats() for kind, profiler in PROFILERS.items()},
+        "files": [os.path.basename(path) for path in list_profiles()[-20:]],
+    }), 200
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    health = {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "provider": config.WHATSAPP_API_PROVIDER,
-        "ai_provider": config.AI_PROVIDER
-    }), 200
+        "ai_provider": config.AI_PROVIDER,
+        "tenants": len(tenants)
+    }
+    if monitor:
+        monitor_health = monitor.get_health()
+        health["monitor"] = monitor_health
+        if not monitor_health["healthy"]:
+            health["status"] = "degraded"
+            return jsonify(health), 503
+    return jsonify(health), 200
 
 
 if __name__ == '__main__':
     # Create logs directory
-    import os
     os.makedirs('logs', exist_ok=True)
 
     logger.info("Starting WhatsApp Webhook Server...")
     logger.info(f"Provider: {config.WHATSAPP_API_PROVIDER}")
     logger.info(f"AI Provider: {config.AI_PROVIDER}")
     logger.info(f"Response Delay: {config.RESPONSE_DELAY}s")
+    logger.info(f"Tenants: {', '.join(tenant.id for tenant in tenants)}")
+    logger.info(f"Embedded monitor: {'on' if monitor else 'off'}")
 
     # Validate configuration
     try:
         config.validate_config()
+        tenants.validate()
         logger.info("✅ Configuration validated")
     except ValueError as e:
         logger.error(f"❌ Configuration error: {e}")